@@ -1,6 +1,23 @@
 # llm/agents/base.py
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Dict, List, AsyncIterator, Optional, Tuple
+from services.scheduler import PRIORITY_STANDARD
+
+# Строки блока "User profile" — тот же формат, что раньше собирал бот, его разбирает kbju.profile_from_text
+PROFILE_LINES = {
+    "gender": "Gender: {}",
+    "age": "Age: {} years",
+    "weight": "Weight: {} kg",
+    "height": "Height: {} cm",
+    "goal": "Goal: {}",
+    "diet": "Diet: {}",
+    "activity": "Activity: {}",
+}
+
+def last_user_message(query: str) -> str:
+    """Текущее сообщение пользователя без профиля и истории, которые добавляет бот"""
+    idx = query.rfind("User:")
+    return query[idx + len("User:"):].strip() if idx != -1 else query
 
 class BaseAgent(ABC):
     """Интерфейс для агентов с масштабируемыми свойствами"""
@@ -8,8 +25,33 @@ class BaseAgent(ABC):
     _NAME: str  # class var, override in subclasses
     _DESCRIPTION: str
     _KEYWORDS: List[str]
+    _PRIORITY: int = PRIORITY_STANDARD  # класс приоритета в планировщике LLM
+    _PROFILE_FIELDS: Tuple[str, ...] = ()  # поля профиля, которые агент получает в промпте
     
     @abstractmethod
     async def process_query(self, user_query: str) -> str:
         """Основной метод обработки"""
-        pass
\ No newline at end of file
+        pass
+    
+    async def process_query_stream(self, user_query: str) -> AsyncIterator[str]:
+        """Потоковая обработка; по умолчанию отдаёт ответ process_query одним куском"""
+        yield await self.process_query(user_query)
+    
+    def build_query(self, message: str, profile: Optional[Dict] = None, history: Optional[List[Dict]] = None,
+                    summary: str = "") -> str:
+        """Промпт из структурного запроса: нужные агенту поля профиля, резюме, история и текущее сообщение"""
+        parts = []
+        fields = [field for field in self._PROFILE_FIELDS if profile and profile.get(field) not in (None, "")]
+        if fields:
+            lines = "\n".join(f"- {PROFILE_LINES[field].format(profile[field])}" for field in fields)
+            parts.append(f"User profile:\n{lines}\n")
+        if summary:
+            parts.append(f"Summary of past {self._NAME}: {summary}")
+        for turn in history or []:
+            parts.append(f"User: {turn.get('user', '')}\nAI: {turn.get('ai', '')}")
+        parts.append(f"User: {message}")
+        return "\n".join(parts)
+    
+    def fast_answer(self, user_query: str) -> Optional[str]:
+        """Ответ без LLM, когда на полный не хватило времени; None — такого нет"""
+        return None
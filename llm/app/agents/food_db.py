@@ -0,0 +1,238 @@
+# llm/agents/food_db.py
+import csv
+import logging
+import os
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("nutrition-llm")
+
+FOOD_DB_PATH = os.getenv(
+    "FOOD_DB_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "foods.csv")
+)
+FOOD_FUZZY_THRESHOLD = float(os.getenv("FOOD_FUZZY_THRESHOLD", "0.45"))
+
+DEFAULT_PORTION_G = 100
+# Слишком частые триграммы дают мало информации и много кандидатов
+MIN_POSTING_CAP = 300
+
+_WORD_RE = re.compile(r"[a-zа-яё0-9%.]+")
+_ENDINGS_RE = re.compile(r"(?:ами|ями|ого|его|ому|ему|ой|ей|ый|ий|ая|яя|ое|ее|ые|ие|ых|их|ую|юю|ом|ем|ах|ях|ам|ям|ов|ев|а|я|ы|и|у|ю|е|о|ь|й)$")
+
+def normalize_name(text: str) -> str:
+    return " ".join(_WORD_RE.findall(text.lower().replace("ё", "е")))
+
+def stem(word: str) -> str:
+    """Грубый стемминг для русских падежей: "гречки" -> "гречк", "грудкой" -> "грудк" """
+    if len(word) <= 3:
+        return word
+    stemmed = _ENDINGS_RE.sub("", word)
+    return stemmed if len(stemmed) >= 3 else word
+
+def _trigrams(text: str) -> set:
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class FoodMatch:
+    __slots__ = ("name", "grams", "kcal", "protein", "fat", "carbs", "score")
+
+    def __init__(self, name: str, grams: float, per100: Tuple[float, float, float, float], score: float):
+        factor = grams / 100
+        self.name = name
+        self.grams = grams
+        self.kcal = per100[0] * factor
+        self.protein = per100[1] * factor
+        self.fat = per100[2] * factor
+        self.carbs = per100[3] * factor
+        self.score = score
+
+class FoodIndex:
+    """
+    Компактный индекс состава продуктов (на 100 г).
+    Значения лежат в array('f'), поиск — точный, по префиксу основ слов (bisect
+    по отсортированным именам) и нечёткий по триграммам.
+    """
+
+    def __init__(self, rows: List[Tuple[str, float, float, float, float, float]]):
+        self.names: List[str] = []
+        self.values = array("f")      # kcal, protein, fat, carbs подряд
+        self.piece_g = array("f")
+        for name, kcal, protein, fat, carbs, piece in rows:
+            self.names.append(normalize_name(name))
+            self.values.extend((kcal, protein, fat, carbs))
+            self.piece_g.append(piece)
+
+        self._exact: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        order = sorted(range(len(self.names)), key=self.names.__getitem__)
+        self._sorted_names = [self.names[i] for i in order]
+        self._sorted_ids = array("I", order)
+
+        postings: Dict[str, List[int]] = {}
+        for i, name in enumerate(self.names):
+            for gram in _trigrams(name):
+                postings.setdefault(gram, []).append(i)
+        self._trigram_index: Dict[str, array] = {gram: array("I", ids) for gram, ids in postings.items()}
+        self._trigram_counts = array("H", (min(len(_trigrams(name)), 65535) for name in self.names))
+        self._posting_cap = max(MIN_POSTING_CAP, len(self.names) // 50)
+
+    @classmethod
+    def load(cls, path: str = FOOD_DB_PATH) -> "FoodIndex":
+        rows = []
+        with open(path, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    rows.append((
+                        row["name"],
+                        float(row["kcal"]),
+                        float(row["protein"]),
+                        float(row["fat"]),
+                        float(row["carbs"]),
+                        float(row.get("piece_g") or 0),
+                    ))
+                except (KeyError, ValueError):
+                    continue
+        logger.info(f"🥦 Загружена база продуктов: {len(rows)} позиций ({path})")
+        return cls(rows)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def per100(self, food_id: int) -> Tuple[float, float, float, float]:
+        base = food_id * 4
+        return tuple(self.values[base:base + 4])
+
+    def prefix(self, prefix: str, limit: int = 20) -> List[int]:
+        """Продукты, имя которых начинается с prefix"""
+        prefix = normalize_name(prefix)
+        start = bisect_left(self._sorted_names, prefix)
+        result = []
+        for pos in range(start, min(start + limit, len(self._sorted_names))):
+            if not self._sorted_names[pos].startswith(prefix):
+                break
+            result.append(self._sorted_ids[pos])
+        return result
+
+    def _by_stems(self, words: List[str]) -> Optional[int]:
+        stems = [stem(w) for w in words]
+        # При нескольких вариантах берём первый по порядку в базе (типичная форма продукта)
+        best = None
+        for food_id in self.prefix(stems[0], limit=50):
+            name_words = self.names[food_id].split()
+            if all(any(nw.startswith(s) for nw in name_words) for s in stems):
+                if best is None or food_id < best:
+                    best = food_id
+        return best
+
+    def _fuzzy(self, query: str) -> Tuple[Optional[int], float]:
+        grams = _trigrams(query)
+        counts: Counter = Counter()
+        for gram in grams:
+            ids = self._trigram_index.get(gram)
+            if ids is not None and len(ids) <= self._posting_cap:
+                counts.update(ids)
+        best_id, best_score = None, 0.0
+        for food_id, common in counts.items():
+            score = 2 * common / (len(grams) + self._trigram_counts[food_id])
+            if score > best_score:
+                best_id, best_score = food_id, score
+        return best_id, best_score
+
+    def lookup(self, text: str) -> Optional[Tuple[int, float]]:
+        """Лучшее совпадение (id, уверенность) или None"""
+        query = normalize_name(text)
+        if not query:
+            return None
+        food_id = self._exact.get(query)
+        if food_id is not None:
+            return food_id, 1.0
+        food_id = self._by_stems(query.split())
+        if food_id is not None:
+            return food_id, 0.9
+        food_id, score = self._fuzzy(query)
+        if food_id is not None and score >= FOOD_FUZZY_THRESHOLD:
+            return food_id, score
+        return None
+
+    def match(self, text: str, amount: Optional[float] = None, unit: str = "") -> Optional[FoodMatch]:
+        found = self.lookup(text)
+        if found is None:
+            return None
+        food_id, score = found
+        return FoodMatch(self.names[food_id], self._grams(food_id, amount, unit), self.per100(food_id), score)
+
+    def _grams(self, food_id: int, amount: Optional[float], unit: str) -> float:
+        piece = self.piece_g[food_id] or DEFAULT_PORTION_G
+        if amount is None:
+            return piece
+        if unit.startswith("кг") or unit == "л":
+            return amount * 1000
+        if unit.startswith(("г", "мл")):
+            return amount
+        if unit.startswith("шт") or (not unit and amount < 20):
+            return amount * piece
+        return amount
+
+# --- Разбор приёма пищи ---
+
+_ITEM_SPLIT_RE = re.compile(r"[,;\n+]|\s(?:и|с|со|плюс)\s")
+_QTY_RE = re.compile(
+    r"(\d+(?:[.,]\d+)?)(?!\d|[.,]\d|\s*%)\s*(кг|килограмм\w*|грамм\w*|гр|г|мл|л|шт\w*|штук\w*)?(?![a-zа-яё])",
+    re.I
+)
+_STOP_WORDS = {
+    "я", "съел", "съела", "съели", "выпил", "выпила", "ел", "ела", "на", "завтрак", "обед", "ужин",
+    "перекус", "сегодня", "утром", "вечером", "днем", "порция", "порции", "порцию", "тарелка",
+    "тарелку", "стакан", "кусок", "куска", "немного", "сколько", "калорий", "ккал", "в", "это",
+    "бжу", "кбжу", "посчитай", "проанализируй", "мой", "моем", "моём", "рацион", "рационе", "было",
+}
+
+def parse_meal(text: str) -> List[Tuple[str, Optional[float], str]]:
+    """Список (название, количество, единица) из свободного текста"""
+    items = []
+    for part in _ITEM_SPLIT_RE.split(text.lower()):
+        amount, unit = None, ""
+        qty = _QTY_RE.search(part)
+        if qty:
+            amount = float(qty.group(1).replace(",", "."))
+            unit = (qty.group(2) or "").lower()
+            part = part[:qty.start()] + " " + part[qty.end():]
+        words = [w for w in normalize_name(part).split() if w not in _STOP_WORDS and (not w[0].isdigit() or w.endswith("%"))]
+        if words:
+            items.append((" ".join(words), amount, unit))
+    return items
+
+def analyze_meal(index: FoodIndex, text: str) -> Tuple[List[FoodMatch], List[str]]:
+    """Сопоставление разобранных позиций с базой: найденные и нераспознанные"""
+    matched, unknown = [], []
+    for name, amount, unit in parse_meal(text):
+        food = index.match(name, amount, unit)
+        if food is not None:
+            matched.append(food)
+        elif amount is not None:
+            unknown.append(name)
+    return matched, unknown
+
+def format_meal(matched: List[FoodMatch]) -> str:
+    lines = [
+        f"• {m.name} — {m.grams:.0f} г: {m.kcal:.0f} ккал, Б {m.protein:.1f} / Ж {m.fat:.1f} / У {m.carbs:.1f}"
+        for m in matched
+    ]
+    total_kcal = sum(m.kcal for m in matched)
+    total_p = sum(m.protein for m in matched)
+    total_f = sum(m.fat for m in matched)
+    total_c = sum(m.carbs for m in matched)
+    lines.append(f"Итого: {total_kcal:.0f} ккал, Б {total_p:.1f} г / Ж {total_f:.1f} г / У {total_c:.1f} г")
+    return "\n".join(lines)
+
+_food_index: Optional[FoodIndex] = None
+
+def get_food_index() -> FoodIndex:
+    """Индекс загружается один раз на процесс"""
+    global _food_index
+    if _food_index is None:
+        _food_index = FoodIndex.load()
+    return _food_index
@@ -0,0 +1,86 @@
+# llm/agents/kbju.py
+import re
+from typing import Optional
+from .base import last_user_message
+
+# Коэффициенты физической активности для формулы Харриса-Бенедикта
+ACTIVITY_FACTORS = {
+    "sedentary": 1.2,
+    "light": 1.375,
+    "moderate": 1.55,
+    "high": 1.725,
+    "extreme": 1.9,
+}
+
+# Русские и английские формулировки уровня активности
+_ACTIVITY_ALIASES = [
+    ("extreme", ["extreme", "очень высок", "спортсмен", "дважды в день", "тяжел"]),
+    ("high", ["high", "высок", "интенсивн", "каждый день", "ежедневн"]),
+    ("sedentary", ["sedentary", "сидяч", "малоподвиж", "офис", "без спорта", "не занимаюсь"]),
+    ("light", ["light", "низк", "легк", "1-2 раза", "1-3 раза"]),
+    ("moderate", ["moderate", "средн", "умерен", "3-5 раз", "3 раза"]),
+]
+
+def _extract(param_name: str, text: str) -> Optional[str]:
+    match = re.search(rf"{param_name}:\s*([^\n,;]+)", text, re.I)
+    return match.group(1).strip() if match else None
+
+def _extract_number(param_name: str, text: str, default: float) -> float:
+    match = re.search(rf"{param_name}:\s*(\d+(?:[.,]\d+)?)", text, re.I)
+    return float(match.group(1).replace(",", ".")) if match else default
+
+def detect_activity(text: str, default: str = "moderate") -> str:
+    """
+    Уровень активности из явного поля activity, иначе из текущего сообщения пользователя.
+    История и ответы ассистента не смотрятся: "ежедневно" в прошлом ответе — не активность пользователя.
+    """
+    text_lower = (_extract("activity", text) or last_user_message(text)).lower()
+    for level, aliases in _ACTIVITY_ALIASES:
+        if any(alias in text_lower for alias in aliases):
+            return level
+    return default
+
+def profile_from_text(text: str) -> dict:
+    """Поля профиля из блока "User profile", который присылает бот"""
+    return {
+        "gender": (_extract("gender", text) or "м")[:1].lower(),
+        "age": _extract_number("age", text, 30),
+        "weight": _extract_number("weight", text, 70),
+        "height": _extract_number("height", text, 170),
+        "goal": _extract("goal", text) or "maintain",
+        "activity": detect_activity(text),
+    }
+
+def calculate_kbju(gender: str, age: float, weight: float, height: float = 170,
+                   goal: str = "maintain", activity: str = "moderate") -> dict:
+    """Суточные калории и БЖУ по формуле Харриса-Бенедикта, без обращения к LLM"""
+    if gender.lower().startswith(("м", "m")):
+        bmr = 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
+    else:
+        bmr = 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
+
+    activity = activity if activity in ACTIVITY_FACTORS else "moderate"
+    calories = bmr * ACTIVITY_FACTORS[activity]
+
+    goal_lower = goal.lower()
+    if "похуд" in goal_lower or "сброс" in goal_lower or "lose" in goal_lower:
+        calories -= 500
+    elif "набор" in goal_lower or "набр" in goal_lower or "масс" in goal_lower or "gain" in goal_lower:
+        calories += 500
+
+    return {
+        "bmr": round(bmr),
+        "activity": activity,
+        "activity_factor": ACTIVITY_FACTORS[activity],
+        "calories": round(calories),
+        "protein_g": round(weight * 2),
+        "fat_g": round(calories * 0.3 / 9),
+        "carbs_g": round(calories * 0.5 / 4),
+    }
+
+def format_kbju(kbju: dict) -> str:
+    return (
+        f"Твоя суточная норма: ~{kbju['calories']} ккал.\n"
+        f"Белки: {kbju['protein_g']} г, жиры: {kbju['fat_g']} г, углеводы: {kbju['carbs_g']} г.\n"
+        f"(базовый обмен {kbju['bmr']} ккал, коэффициент активности {kbju['activity_factor']})"
+    )
@@ -1,8 +1,15 @@
 # llm/agents/manager.py
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+import asyncio
 import logging
+import time
 from services.llm_orchestrator import LLMOrchestrator
-from config import AGENT_CLASSES
+from services.scheduler import request_priority, SchedulerOverloaded
+from services.deadline import request_deadline, remaining
+from services.metrics import ROUTING_SECONDS, AGENT_SECONDS
+from services.tracing import span, start_span, finish_span
+from config import AGENT_CLASSES, DEADLINE_RESERVE, DEADLINE_FALLBACK_ANSWER, ASK_HISTORY_TURNS
+from .router import IntentRouter
 
 logger = logging.getLogger("nutrition-llm")
 
@@ -10,6 +17,7 @@ class AgentManager:
     def __init__(self, llm_orchestrator: LLMOrchestrator):
         self.orchestrator = llm_orchestrator
         self.registry: Dict[str, Any] = self._register_agents()
+        self.router = IntentRouter(agent.__class__ for agent in self.registry.values())
     
     def _register_agents(self) -> Dict[str, Any]:
         from services.ollama_service import OllamaService
@@ -17,43 +25,112 @@ class AgentManager:
         
         fast_llm = OllamaService(model=os.getenv("OLLAMA_FAST_MODEL"))
         quality_llm = OllamaService(model=os.getenv("OLLAMA_MODEL"))
+        # Сервисы моделей агентов — их прогревает старт приложения
+        self.llm_services = [fast_llm, quality_llm]
         
+        # Реестр собирается один раз на процесс; агенты и сервисы общие для всех запросов
         registry = {}
         for agent_cls in AGENT_CLASSES:
             if agent_cls._NAME == "simple":
-                agent = agent_cls(llm_orchestrator=self.orchestrator)
+                agent = agent_cls(llm_orchestrator=self.orchestrator, agent_registry=registry)
             else:
-                agent = agent_cls(fast_llm, quality_llm, llm_orchestrator=self.orchestrator)
+                agent = agent_cls(fast_llm, quality_llm, llm_orchestrator=self.orchestrator, agent_registry=registry)
             registry[agent_cls._NAME] = agent
             logger.info(f"Registered agent: {agent_cls._NAME} - {agent_cls._DESCRIPTION}")
         
         return registry
     
+    def classify(self, query: str) -> Tuple[str, Dict[str, int]]:
+        """Тип агента и счёт совпадений; единая точка маршрутизации для /ask и /detect_type, с метрикой"""
+        # Скомпилированные шаблоны агентов; порядок AGENT_CLASSES (nutrition, planning), simple как fallback
+        started = time.perf_counter()
+        result = self.router.classify(query)
+        ROUTING_SECONDS.observe(time.perf_counter() - started)
+        return result
+    
     def _detect_agent_type(self, query: str) -> str:
-        query_lower = query.lower()
-        # Проверяем nutrition первым для точности
-        nutrition_agent = self.registry.get("nutrition")
-        if nutrition_agent and any(kw in query_lower for kw in nutrition_agent.__class__._KEYWORDS):
-            return "nutrition"
-        # Затем planning
-        planning_agent = self.registry.get("planning")
-        if planning_agent and any(kw in query_lower for kw in planning_agent.__class__._KEYWORDS):
-            return "planning"
-        # Simple как fallback
-        return "simple"
+        agent_type, _ = self.classify(query)
+        return agent_type
+    
+    def detect_agent_types(self, queries: List[str]) -> List[Tuple[str, Dict[str, int]]]:
+        """Пакетная классификация: тип агента и счёт совпадений для каждого запроса"""
+        return [self.classify(query) for query in queries]
     
-    async def route_request(self, user_query: str, agent_type: str = "auto") -> dict:
+    def _resolve_agent(self, user_query: str, agent_type: str, deadline: Optional[float] = None):
         if agent_type == "auto":
-            agent_type = self._detect_agent_type(user_query)
+            with span("agent.route") as route_span:
+                agent_type = self._detect_agent_type(user_query)
+                route_span.set(agent_type=agent_type)
         
         agent = self.registry.get(agent_type, self.registry["simple"])
         
         agent_name = agent.__class__._NAME
         logger.info(f"🔄 Передаю управление агенту: {agent_name} (тип: {agent_type})")
         logger.info(f"📝 Запрос: {user_query}")
+        request_priority.set(agent._PRIORITY)
+        if deadline is not None:
+            request_deadline.set(deadline)
+        return agent, agent_type, agent_name
+    
+    def _build_query(self, agent, user_query: str, profile: Optional[Dict], history: Optional[List[Dict]],
+                     summaries: Optional[Dict[str, str]] = None) -> str:
+        """Структурный запрос: маршрут уже выбран по самому сообщению, промпт собирает агент"""
+        if profile is None and history is None:
+            return user_query
+        agent_name = agent.__class__._NAME
+        turns = [turn for turn in history or [] if turn.get("topic") in (None, agent_name)]
+        return agent.build_query(
+            user_query, profile, turns[-ASK_HISTORY_TURNS:] if ASK_HISTORY_TURNS > 0 else [],
+            summary=(summaries or {}).get(agent_name, "")
+        )
+    
+    def _agent_timeout(self) -> Optional[float]:
+        """Время агенту: до дедлайна запроса минус запас на быстрый ответ"""
+        left = remaining()
+        return None if left is None else max(left - DEADLINE_RESERVE, 0.0)
+    
+    def _fast_answer(self, agent, user_query: str) -> str:
+        try:
+            return agent.fast_answer(user_query) or DEADLINE_FALLBACK_ANSWER
+        except Exception as e:
+            logger.exception(f"❌ Быстрый ответ агента не удался: {e}")
+            return DEADLINE_FALLBACK_ANSWER
+    
+    async def route_request(self, user_query: str, agent_type: str = "auto", deadline: Optional[float] = None,
+                            profile: Optional[Dict] = None, history: Optional[List[Dict]] = None,
+                            summaries: Optional[Dict[str, str]] = None) -> dict:
+        """
+        deadline — момент по time.monotonic(), после которого ответ клиенту уже не нужен.
+        С profile/history/summaries user_query — только текущее сообщение, промпт собирается после маршрутизации.
+        """
+        agent, agent_type, agent_name = self._resolve_agent(user_query, agent_type, deadline)
+        user_query = self._build_query(agent, user_query, profile, history, summaries)
         
-        answer = await agent.process_query(user_query)
+        started = time.monotonic()
+        timer = asyncio.timeout(self._agent_timeout())
+        with span("agent.process", agent=agent_name, mode="sync") as agent_span:
+            try:
+                async with timer:
+                    answer = await agent.process_query(user_query)
+            except TimeoutError:
+                if not timer.expired():
+                    raise
+                agent_span.set(outcome="timeout")
+                AGENT_SECONDS.labels(agent_name, "sync", "timeout").observe(time.monotonic() - started)
+                # Генерация отменена вместе с задачей; отдаём то, что считается без LLM
+                logger.warning(f"⏱️ Агент {agent_name} не уложился в дедлайн, отдаём быстрый ответ")
+                return {
+                    "answer": self._fast_answer(agent, user_query),
+                    "agent_type": agent_type,
+                    "agent_name": agent_name,
+                    "status": "timeout",
+                    "error": "deadline exceeded"
+                }
+            
+            status = "error" if answer.startswith("Ошибка:") else "success"
+            agent_span.set(outcome=status)
         
+        AGENT_SECONDS.labels(agent_name, "sync", status).observe(time.monotonic() - started)
         logger.info(f"✅ Агент {agent_name} завершил обработку")
         
         if answer.startswith("Ошибка:"):
@@ -65,4 +142,94 @@ class AgentManager:
             "agent_name": agent_name,
             "status": "error" if answer.startswith("Ошибка:") else "success",
             "error": answer if answer.startswith("Ошибка:") else ""
+        }
+    
+    async def route_request_stream(self, user_query: str, agent_type: str = "auto",
+                                   deadline: Optional[float] = None, profile: Optional[Dict] = None,
+                                   history: Optional[List[Dict]] = None,
+                                   summaries: Optional[Dict[str, str]] = None) -> AsyncIterator[dict]:
+        """
+        Потоковая маршрутизация: первый кадр {"agent_type": ..., "agent_name": ...} с выбранным агентом,
+        затем {"chunk": ...}, в конце {"done": True, ...}
+        """
+        agent, agent_type, agent_name = self._resolve_agent(user_query, agent_type, deadline)
+        user_query = self._build_query(agent, user_query, profile, history, summaries)
+        # Клиент узнаёт тему до первого токена и не ждёт отдельного /detect_type
+        yield {"agent_type": agent_type, "agent_name": agent_name}
+        
+        error = ""
+        sent = False
+        timed_out = False
+        status = "cancelled"
+        started = time.monotonic()
+        agent_span, token = start_span("agent.process", agent=agent_name, mode="stream")
+        chunks = agent.process_query_stream(user_query)
+        try:
+            while True:
+                # Дедлайн проверяем только на ожидании чанка, не на отдаче клиенту
+                timer = asyncio.timeout(self._agent_timeout())
+                try:
+                    async with timer:
+                        chunk = await anext(chunks)
+                except StopAsyncIteration:
+                    break
+                except TimeoutError:
+                    if not timer.expired():
+                        raise
+                    timed_out = True
+                    break
+                if not chunk:
+                    continue
+                if chunk.startswith("Ошибка:"):
+                    error = chunk
+                    logger.warning(f"❌ {chunk}")
+                    break
+                sent = True
+                yield {"chunk": chunk}
+        except SchedulerOverloaded as e:
+            status = "overloaded"
+            logger.warning(f"🚦 {e}")
+            yield {
+                "done": True,
+                "agent_type": agent_type,
+                "agent_name": agent_name,
+                "status": "overloaded",
+                "error": str(e),
+                "retry_after": e.retry_after
+            }
+            return
+        except Exception as e:
+            status = "error"
+            logger.exception(f"❌ Ошибка стриминга агента {agent_name}: {e}")
+            error = f"Ошибка: {e}"
+        else:
+            status = "timeout" if timed_out else "error" if error else "success"
+        finally:
+            await chunks.aclose()
+            AGENT_SECONDS.labels(agent_name, "stream", status).observe(time.monotonic() - started)
+            agent_span.set(outcome=status, sent=sent)
+            finish_span(agent_span, token)
+        
+        if timed_out:
+            # Отмена закрыла соединение с провайдером — генерация остановлена; уже отданное остаётся частичным ответом
+            logger.warning(f"⏱️ Агент {agent_name} не уложился в дедлайн (stream, отдано: {'да' if sent else 'нет'})")
+            if not sent:
+                yield {"chunk": self._fast_answer(agent, user_query)}
+            yield {
+                "done": True,
+                "agent_type": agent_type,
+                "agent_name": agent_name,
+                "status": "timeout",
+                "error": "deadline exceeded"
+            }
+            return
+        
+        logger.info(f"✅ Агент {agent_name} завершил обработку (stream)")
+        
+        yield {
+            "done": True,
+            "agent_type": agent_type,
+            "agent_name": agent_name,
+            "status": "error" if error else "success",
+            "error": error
         }
\ No newline at end of file
@@ -1,22 +1,42 @@
 # llm/agents/nutrition.py
 import asyncio
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 import logging
 import os
 import re  # для extract
 
-from .base import BaseAgent  # import
+from .base import BaseAgent, last_user_message  # import
+from .kbju import calculate_kbju, format_kbju, profile_from_text
+from .food_db import analyze_meal, format_meal, get_food_index, parse_meal
 
 logger = logging.getLogger("nutrition-llm")
 
+# Персонализация КБЖУ через LLM после мгновенного расчёта (0 — только цифры)
+KBJU_LLM_PERSONALIZATION = os.getenv("KBJU_LLM_PERSONALIZATION", "1") == "1"
+# Короткий комментарий LLM к посчитанному по базе приёму пищи (0 — только цифры)
+MEAL_LLM_COMMENT = os.getenv("MEAL_LLM_COMMENT", "1") == "1"
+
+# Признаки того, что пользователь описывает съеденное, а не спрашивает норму
+_MEAL_MARKERS = ("съел", "съела", "выпил", "выпила", "сколько калорий в", "калорийность", "бжу в", "проанализируй")
+# Вопрос о суточной норме по профилю: "80 кг" здесь — вес пользователя, а не порция
+_NEEDS_MARKERS = (
+    "мне нужно", "мне надо", "калорий нужно", "калорий надо", "калорий мне", "нужно в день", "в день нужно",
+    "норма калорий", "норму калорий", "моя норма", "мою норму", "суточн", "при весе", "при моем весе",
+    "при моём весе", "мой вес", "мой рост", "сколько мне", "чтобы похудеть", "чтобы набрать",
+    "для похудения", "для набора",
+)
+_MEAL_PLAN_SECTIONS = ("завтрак", "обед", "ужин", "перекус", "breakfast", "lunch", "dinner", "snack")
+
 class NutritionAgent(BaseAgent):
     _NAME = "nutrition"
     _DESCRIPTION = "Агент для вопросов по питанию, калориям, БЖУ, диетам, продуктам и БАДам."
     _KEYWORDS = ["питан", "калор", "рацион", "белк", "жир", "углевод", "бад", "протеин", "bcaa", "креатин", "продукт", "есть после", "на ночь", "утром", "днем"]
+    _PROFILE_FIELDS = ("gender", "age", "weight", "height", "goal", "diet", "activity")
     
     def __init__(self, fast_llm_service, quality_llm_service, **kwargs):
         self.fast_llm = fast_llm_service
         self.quality_llm = quality_llm_service
+        self.food_index = get_food_index()
         self.tools = self._setup_tools()
     
     def _setup_tools(self):
@@ -26,10 +46,30 @@ class NutritionAgent(BaseAgent):
             "analyze_nutrition": self.analyze_nutrition,
             "create_meal_plan": self.create_meal_plan
         }
+    def _is_needs_query(self, user_query: str) -> bool:
+        message = last_user_message(user_query).lower()
+        return any(marker in message for marker in _NEEDS_MARKERS)
+    
+    def _is_meal_query(self, user_query: str) -> bool:
+        message = last_user_message(user_query).lower()
+        # Норма по профилю проверяется раньше еды: её считает быстрый путь КБЖУ
+        if "план" in message or self._is_needs_query(user_query):
+            return False
+        if any(marker in message for marker in _MEAL_MARKERS):
+            return True
+        # Количество — признак еды, только если рядом продукт из базы
+        return any(
+            amount is not None and self.food_index.lookup(name) is not None
+            for name, amount, _ in parse_meal(message)
+        )
+    
     async def process_query(self, user_query: str) -> str:
         query_lower = user_query.lower()
         tools_to_run = []
         
+        if self._is_meal_query(user_query):
+            return await self.tools["analyze_nutrition"](user_query)
+        
         if "калор" in query_lower:
             tools_to_run.append(self.tools["calculate_calories"](user_query))
         if "рацион" in query_lower or "питан" in query_lower:
@@ -43,6 +83,29 @@ class NutritionAgent(BaseAgent):
         response = await self.quality_llm.ask(prompt)
         return response.get("answer", "")
     
+    async def process_query_stream(self, user_query: str) -> AsyncIterator[str]:
+        query_lower = user_query.lower()
+        streams = []
+        
+        if self._is_meal_query(user_query):
+            async for chunk in self.analyze_nutrition_stream(user_query):
+                yield chunk
+            return
+        
+        if "калор" in query_lower:
+            streams.append(self.calculate_calories_stream(user_query))
+        if "рацион" in query_lower or "питан" in query_lower:
+            streams.append(self.create_meal_plan_stream(user_query))
+        
+        if not streams:
+            streams.append(self.quality_llm.ask_stream(f"User: {user_query}"))
+        
+        for i, stream in enumerate(streams):
+            if i:
+                yield "\n"
+            async for chunk in stream:
+                yield chunk
+    
     async def _select_tools(self, query: str) -> List[str]:
         prompt = f"""..."""
         response = await self.fast_llm.ask(prompt)
@@ -50,55 +113,178 @@ class NutritionAgent(BaseAgent):
         tools = [tool.strip() for tool in response_text.split(",")]
         return [tool for tool in tools if tool in self.tools]
     
-    async def calculate_calories(self, query: str) -> str:
-        gender = self.extract_param("gender", query, 'м')
-        age = float(self.extract_param("age", query, 30))
-        weight = float(self.extract_param("weight", query, 70))
-        height = float(self.extract_param("height", query, 170))
-        goal = self.extract_param("goal", query, "maintain")
-        
-        if gender.lower() == 'м':
-            bmr = 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
-        else:
-            bmr = 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
-        
-        activity_factor = 1.55
-        calories = bmr * activity_factor
+    def compute_kbju(self, query: str) -> dict:
+        """Структурный расчёт КБЖУ по полям профиля из запроса — без LLM"""
+        return calculate_kbju(**profile_from_text(query))
+    
+    def _calories_prompt(self, query: str, kbju: dict) -> str:
+        kbju_text = (
+            f"Daily calories: {kbju['calories']}, Protein: {kbju['protein_g']}g, "
+            f"Carbs: {kbju['carbs_g']}g, Fats: {kbju['fat_g']}g"
+        )
+        return (
+            f"Based on KBJU {kbju_text}, suggest for query: {query}. "
+            f"Do not recalculate the numbers. Be brief."
+        )
+    
+    async def calculate_calories(self, query: str, personalize: bool = KBJU_LLM_PERSONALIZATION) -> str:
+        kbju = self.compute_kbju(query)
+        numbers = format_kbju(kbju)
+        if not personalize:
+            return numbers
         
-        if "похуд" in goal.lower():
-            calories -= 500
-        elif "набор" in goal.lower():
-            calories += 500
+        response = await self.quality_llm.ask(self._calories_prompt(query, kbju))
+        advice = response.get("answer", "")
+        return f"{numbers}\n\n{advice}" if advice else numbers
+    
+    async def calculate_calories_stream(self, query: str, personalize: bool = KBJU_LLM_PERSONALIZATION) -> AsyncIterator[str]:
+        # Цифры отдаём сразу, персональные советы стримятся следом
+        kbju = self.compute_kbju(query)
+        yield format_kbju(kbju)
         
-        kbju = f"Daily calories: {calories:.0f}, Protein: {weight*2:.0f}g, Carbs: {calories*0.5/4:.0f}g, Fats: {calories*0.3/9:.0f}g"
+        if not personalize:
+            return
         
-        personalize_prompt = f"Based on KBJU {kbju}, suggest for query: {query}. Be brief."
-        response = await self.quality_llm.ask(personalize_prompt)
-        return response.get("answer", "")
+        yield "\n\n"
+        async for chunk in self._stream_comment(self.quality_llm, self._calories_prompt(query, kbju)):
+            yield chunk
+    
+    async def _stream_comment(self, llm, prompt: str) -> AsyncIterator[str]:
+        """Текст LLM после уже отданных цифр"""
+        async for chunk in llm.ask_stream(prompt):
+            if chunk.startswith("Ошибка:"):
+                # Цифры уже у пользователя — ошибка комментария не портит ответ
+                logger.warning(f"⚠️ Комментарий LLM к расчёту не удался: {chunk}")
+                return
+            yield chunk
     
     async def suggest_workout(self, query: str) -> str:
         prompt = f"""..."""
         response = await self.fast_llm.ask(prompt)
         return response.get("answer", "") if isinstance(response, dict) else response
     
-    async def analyze_nutrition(self, query: str) -> str:
-        prompt = f"""..."""
-        response = await self.fast_llm.ask(prompt)
-        return response.get("answer", "") if isinstance(response, dict) else response
+    def compute_meal(self, query: str):
+        """КБЖУ съеденного по локальной базе продуктов — без LLM"""
+        return analyze_meal(self.food_index, last_user_message(query))
     
-    async def create_meal_plan(self, query: str) -> str:
-        prompt = f"""
+    def _meal_text(self, matched, unknown) -> str:
+        text = format_meal(matched)
+        if unknown:
+            text += f"\nНе нашёл в базе: {', '.join(unknown)}"
+        return text
+    
+    def _meal_comment_prompt(self, query: str, meal_text: str) -> str:
+        return (
+            f"The user ate:\n{meal_text}\n"
+            f"Give a short comment on this meal for query: {last_user_message(query)}. "
+            f"Do not recalculate the numbers. Be brief."
+        )
+    
+    def fast_answer(self, user_query: str) -> Optional[str]:
+        """Цифры без комментария LLM: еда по базе продуктов или КБЖУ по профилю"""
+        if self._is_meal_query(user_query):
+            matched, unknown = self.compute_meal(user_query)
+            return self._meal_text(matched, unknown) if matched else None
+        if "калор" in user_query.lower():
+            return format_kbju(self.compute_kbju(user_query))
+        return None
+    
+    async def analyze_nutrition(self, query: str, comment: bool = MEAL_LLM_COMMENT) -> str:
+        matched, unknown = self.compute_meal(query)
+        if not matched:
+            response = await self.fast_llm.ask(f"Estimate calories and macros of this meal. User: {last_user_message(query)}")
+            return response.get("answer", "") if isinstance(response, dict) else response
+        
+        numbers = self._meal_text(matched, unknown)
+        if not comment:
+            return numbers
+        
+        response = await self.fast_llm.ask(self._meal_comment_prompt(query, numbers))
+        advice = response.get("answer", "")
+        return f"{numbers}\n\n{advice}" if advice else numbers
+    
+    async def analyze_nutrition_stream(self, query: str, comment: bool = MEAL_LLM_COMMENT) -> AsyncIterator[str]:
+        matched, unknown = self.compute_meal(query)
+        if not matched:
+            async for chunk in self.fast_llm.ask_stream(f"Estimate calories and macros of this meal. User: {last_user_message(query)}"):
+                yield chunk
+            return
+        
+        numbers = self._meal_text(matched, unknown)
+        yield numbers
+        if not comment:
+            return
+        
+        yield "\n\n"
+        async for chunk in self._stream_comment(self.fast_llm, self._meal_comment_prompt(query, numbers)):
+            yield chunk
+    
+    def _meal_plan_prompt(self, query: str) -> str:
+        # КБЖУ модель не считает — его досчитываем по базе продуктов
+        return f"""
             Create a daily meal plan for the user's profile and goal.
             Structure:
-            - Breakfast: Food items, KBJU
-            - Lunch: Food items, KBJU
-            - Dinner: Food items, KBJU
-            - Snacks: Food items, KBJU
-            Total daily: Calories, protein, carbs, fats
+            Breakfast:
+            - food item — weight in grams
+            Lunch:
+            - food item — weight in grams
+            Dinner:
+            - food item — weight in grams
+            Snacks:
+            - food item — weight in grams
+            Use simple food names in Russian and give every item its weight in grams.
+            Do not calculate calories or macros.
             Make it varied, realistic for {query}.
             """
-        response = await self.fast_llm.ask(prompt)
-        return response.get("answer", "") if isinstance(response, dict) else response
+    
+    def _meal_plan_kbju(self, plan: str) -> str:
+        """КБЖУ по приёмам пищи и за день для плана, который написала модель"""
+        sections: List[tuple] = []
+        for line in plan.splitlines():
+            stripped = line.strip().strip("*#").strip()
+            lower = stripped.lower()
+            if not stripped:
+                continue
+            if lower.rstrip(":").startswith(_MEAL_PLAN_SECTIONS) and len(lower) < 40:
+                sections.append((stripped.rstrip(":"), []))
+            elif stripped[0] in "-•*" or stripped[0].isdigit():
+                matched, _ = analyze_meal(self.food_index, stripped.lstrip("-•*0123456789. "))
+                if not sections:
+                    sections.append(("План", []))
+                sections[-1][1].extend(matched)
+        
+        all_items = [m for _, items in sections for m in items]
+        if not all_items:
+            return ""
+        lines = ["КБЖУ по базе продуктов:"]
+        for title, items in sections:
+            if items:
+                kcal = sum(m.kcal for m in items)
+                protein = sum(m.protein for m in items)
+                fat = sum(m.fat for m in items)
+                carbs = sum(m.carbs for m in items)
+                lines.append(f"• {title}: {kcal:.0f} ккал, Б {protein:.1f} / Ж {fat:.1f} / У {carbs:.1f}")
+        lines.append(format_meal(all_items).splitlines()[-1])
+        return "\n".join(lines)
+    
+    async def create_meal_plan(self, query: str) -> str:
+        response = await self.fast_llm.ask(self._meal_plan_prompt(query))
+        plan = response.get("answer", "") if isinstance(response, dict) else response
+        kbju = self._meal_plan_kbju(plan)
+        return f"{plan}\n\n{kbju}" if kbju else plan
+    
+    async def create_meal_plan_stream(self, query: str) -> AsyncIterator[str]:
+        # План отдаём по мере генерации, КБЖУ досчитываем, когда он готов
+        parts = []
+        async for chunk in self.fast_llm.ask_stream(self._meal_plan_prompt(query)):
+            if chunk.startswith("Ошибка:"):
+                yield chunk
+                return
+            parts.append(chunk)
+            yield chunk
+        kbju = self._meal_plan_kbju("".join(parts))
+        if kbju:
+            yield f"\n\n{kbju}"
     
     async def _synthesize_response(self, original_query: str, tool_results: List[str]) -> str:
         prompt = f"""..."""
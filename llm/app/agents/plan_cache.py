@@ -0,0 +1,137 @@
+# llm/agents/plan_cache.py
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from .base import last_user_message
+from .food_db import normalize_name, stem
+
+logger = logging.getLogger("nutrition-llm")
+
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "1") == "1"
+# Отдельный каталог под изменяемые данные: в docker-compose на него смонтирован том llm_cache
+PLAN_CACHE_PATH = os.getenv(
+    "PLAN_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "plan_cache.json")
+)
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", str(7 * 24 * 3600)))
+PLAN_CACHE_SIMILARITY = float(os.getenv("PLAN_CACHE_SIMILARITY", "0.75"))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "256"))
+
+# Слова, не меняющие суть цели
+_GOAL_STOP_WORDS = {
+    "составь", "распиши", "сделай", "напиши", "подбери", "придумай", "дай", "мне", "для", "меня", "пожалуйста",
+    "хочу", "нужен", "нужна", "нужно", "please", "на", "в", "и", "с", "по", "мой", "моя", "мою",
+}
+
+def goal_tokens(goal: str) -> FrozenSet[str]:
+    """Нормализованная цель: основы значимых слов текущего сообщения"""
+    words = normalize_name(last_user_message(goal)).split()
+    return frozenset(stem(w) for w in words if w not in _GOAL_STOP_WORDS)
+
+def _similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    # Числа ("3 дня", "5 дней") должны совпадать точно — это другой план
+    if {t for t in a if t[0].isdigit()} != {t for t in b if t[0].isdigit()}:
+        return 0.0
+    union = a | b
+    return len(a & b) / len(union) if union else 0.0
+
+class PlanSkeletonCache:
+    """
+    Кэш шагов плана по нормализованной цели: точное совпадение или Жаккар по
+    основам слов не ниже PLAN_CACHE_SIMILARITY. Записи живут PLAN_CACHE_TTL
+    и сохраняются в JSON между перезапусками.
+    """
+
+    def __init__(self, path: str = PLAN_CACHE_PATH, enabled: bool = PLAN_CACHE_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._entries: Dict[FrozenSet[str], Tuple[float, List[str]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._save_task: Optional[asyncio.Task] = None
+        self._dirty = False
+
+    def load(self):
+        if not (self.enabled and os.path.exists(self.path)):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Не удалось прочитать кэш планов {self.path}: {e}")
+            return
+        now = time.time()
+        for item in data:
+            if item.get("created_at", 0) + PLAN_CACHE_TTL > now and item.get("steps"):
+                self._entries[frozenset(item["goal"])] = (item["created_at"], item["steps"])
+        logger.info(f"🗂️ Загружено шаблонов планов: {len(self._entries)}")
+
+    def _snapshot(self) -> list:
+        return [
+            {"goal": sorted(goal), "created_at": created_at, "steps": steps}
+            for goal, (created_at, steps) in self._entries.items()
+        ]
+
+    def _save(self, data: list):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось сохранить кэш планов {self.path}: {e}")
+
+    def get(self, goal: str) -> Optional[List[str]]:
+        if not self.enabled:
+            return None
+        tokens = goal_tokens(goal)
+        now = time.time()
+
+        best_steps, best_score = None, 0.0
+        for key, (created_at, steps) in list(self._entries.items()):
+            if created_at + PLAN_CACHE_TTL <= now:
+                del self._entries[key]
+                continue
+            score = 1.0 if key == tokens else _similarity(tokens, key)
+            if score > best_score:
+                best_steps, best_score = steps, score
+
+        if best_steps is not None and best_score >= PLAN_CACHE_SIMILARITY:
+            self.hits += 1
+            logger.info(f"🗂️ Шаблон плана из кэша (сходство {best_score:.2f})")
+            return list(best_steps)
+        self.misses += 1
+        return None
+
+    def put(self, goal: str, steps: List[str]):
+        if not (self.enabled and steps):
+            return
+        tokens = goal_tokens(goal)
+        if not tokens:
+            return
+        self._entries[tokens] = (time.time(), list(steps))
+        if len(self._entries) > PLAN_CACHE_MAX_ENTRIES:
+            oldest = min(self._entries, key=lambda key: self._entries[key][0])
+            del self._entries[oldest]
+        # Файл пишется в фоне и не задерживает ответ; записи, пришедшие во время сохранения, уйдут следующим проходом
+        self._dirty = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._dirty:
+            self._dirty = False
+            await asyncio.to_thread(self._save, self._snapshot())
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
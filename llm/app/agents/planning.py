@@ -1,21 +1,54 @@
 # llm/agents/planning.py
 import asyncio
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 from .base import BaseAgent
+from .plan_cache import PlanSkeletonCache
+from services.scheduler import request_priority, SchedulerOverloaded, PRIORITY_BACKGROUND
+from services.deadline import remaining
+from services.metrics import PLAN_STEP_SECONDS
+from services.tracing import span
 import logging
 import os
+import time
 
 logger = logging.getLogger("nutrition-llm")
 
+# Ограничения исполнения плана
+PLAN_MAX_STEPS = int(os.getenv("PLAN_MAX_STEPS", "6"))
+PLAN_MAX_PARALLEL = int(os.getenv("PLAN_MAX_PARALLEL", "3"))
+PLAN_TIME_BUDGET = float(os.getenv("PLAN_TIME_BUDGET", "180"))      # секунд на весь запрос
+PLAN_REPORT_RESERVE = float(os.getenv("PLAN_REPORT_RESERVE", "60"))  # из них оставляем на финальный отчет
+
+class PlanStep:
+    """Шаг плана и его исполнение: статус, время, результат"""
+    __slots__ = ("index", "title", "status", "started_at", "duration", "result")
+    
+    def __init__(self, index: int, title: str):
+        self.index = index
+        self.title = title
+        self.status = "pending"   # pending -> running -> done | failed | timeout | skipped
+        self.started_at: Optional[float] = None
+        self.duration: Optional[float] = None
+        self.result = ""
+    
+    def to_dict(self) -> dict:
+        return {
+            "step": self.title,
+            "status": self.status,
+            "duration_s": round(self.duration, 2) if self.duration is not None else None,
+        }
+
 class PlanningAgent(BaseAgent):
     _NAME = "planning"
     _DESCRIPTION = "Агент для создания планов, программ тренировок, многошаговых целей."
     _KEYWORDS = ["тренир", "программ", "план", "расход энерги", "пропуск", "составь", "распиш", "зал", "функциональн"]
+    _PROFILE_FIELDS = ("gender", "age", "weight", "goal", "activity")
     
     def __init__(self, fast_llm_service, quality_llm_service, **kwargs):
         self.fast_llm = fast_llm_service  # Для подзадач
         self.quality_llm = quality_llm_service  # Для финального ответа
-        self.conversation_history = []
+        self.plan_cache = PlanSkeletonCache()
+        self.plan_cache.load()
     
     async def process_query(self, user_query: str) -> str:
         """Основной метод обработки запроса для менеджера"""
@@ -25,35 +58,121 @@ class PlanningAgent(BaseAgent):
             # Используем существующую логику планирования
             result = await self.execute_plan(user_query)
             return result
+        except SchedulerOverloaded:
+            raise
         except Exception as e:
             logger.error(f"❌ Ошибка в PlanningAgent: {e}")
             return f"Ошибка: {str(e)}"
     
+    async def process_query_stream(self, user_query: str) -> AsyncIterator[str]:
+        """Потоковая обработка: шаги плана выполняются целиком, финальный отчет стримится"""
+        logger.info(f"📋 PlanningAgent обрабатывает запрос (stream): {user_query}")
+        
+        deadline = self._deadline()
+        try:
+            steps = await self._run_plan_steps(user_query, deadline)
+        except SchedulerOverloaded:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка в PlanningAgent: {e}")
+            yield f"Ошибка: {str(e)}"
+            return
+        
+        async for chunk in self.quality_llm.ask_stream(self._final_report_prompt(user_query, steps)):
+            yield chunk
+    
     async def execute_plan(self, user_goal: str) -> str:
-        """Выполнение многошагового плана"""
+        """Выполнение многошагового плана в пределах PLAN_TIME_BUDGET"""
+        deadline = self._deadline()
+        steps = await self._run_plan_steps(user_goal, deadline)
+        
+        # Шаг 3: Финальный синтез (качественная модель) из того, что успело выполниться
+        final_result = await self._create_final_report(user_goal, steps, deadline)
+        return final_result
+    
+    def _deadline(self) -> float:
+        """PLAN_TIME_BUDGET, но не позже дедлайна запроса"""
+        budget = PLAN_TIME_BUDGET
+        left = remaining()
+        if left is not None:
+            budget = min(budget, left)
+        return time.monotonic() + budget
+    
+    def fast_answer(self, user_query: str) -> Optional[str]:
+        """Шаги плана из кэша шаблонов — без их исполнения"""
+        plan = self.plan_cache.get(user_query)
+        if not plan:
+            return None
+        steps = "\n".join(f"{i}. {title}" for i, title in enumerate(plan[:PLAN_MAX_STEPS], 1))
+        return f"План по шагам:\n{steps}"
+    
+    async def _run_plan_steps(self, user_goal: str, deadline: float) -> List[PlanStep]:
+        """Создание плана и выполнение его шагов до дедлайна; возвращает шаги с результатами и таймингами"""
         logger.info(f"🎯 Начинаем выполнение цели: {user_goal}")
+        # При коротком дедлайне запроса резерв на отчет — не больше трети оставшегося
+        steps_deadline = deadline - min(PLAN_REPORT_RESERVE, (deadline - time.monotonic()) / 3)
         
-        # Шаг 1: Создание плана (быстрая модель)
-        plan = await self._create_plan(user_goal)
+        # Шаг 1: Создание плана (быстрая модель), для повторяющихся целей — шаблон из кэша
+        plan = self.plan_cache.get(user_goal)
+        if plan is None:
+            with span("plan.create", model=self.fast_llm.model):
+                plan = await self._create_plan(user_goal, timeout=max(steps_deadline - time.monotonic(), 1.0))
+            self.plan_cache.put(user_goal, plan)
+        if len(plan) > PLAN_MAX_STEPS:
+            logger.info(f"✂️ План сокращён с {len(plan)} до {PLAN_MAX_STEPS} шагов")
+            plan = plan[:PLAN_MAX_STEPS]
         logger.info(f"📋 План выполнения: {plan}")
         
-        # Шаг 2: ПАРАЛЛЕЛЬНОЕ выполнение шагов (быстрая модель)
-        tasks = [self._execute_step(step, user_goal) for step in plan]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Шаг 2: параллельное выполнение шагов (быстрая модель), не больше PLAN_MAX_PARALLEL одновременно
+        steps = [PlanStep(i, title) for i, title in enumerate(plan)]
+        semaphore = asyncio.Semaphore(PLAN_MAX_PARALLEL)
+        tasks = [asyncio.create_task(self._run_step(step, user_goal, semaphore, steps_deadline)) for step in steps]
         
-        # Фильтруем успешные результаты
-        valid_results = []
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                logger.error(f"Ошибка в шаге {plan[i]}: {result}")
-            else:
-                valid_results.append(result)
+        time_left = steps_deadline - time.monotonic()
+        if tasks and time_left > 0:
+            _, pending = await asyncio.wait(tasks, timeout=time_left)
+        else:
+            pending = set(tasks)
         
-        # Шаг 3: Финальный синтез (качественная модель)
-        final_result = await self._create_final_report(user_goal, valid_results)
-        return final_result
+        # Дедлайн: отменяем отставших, отчет строим по завершённым шагам
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        for step in steps:
+            if step.status == "running":
+                step.status = "timeout"
+                step.duration = time.monotonic() - step.started_at
+            elif step.status == "pending":
+                step.status = "skipped"
+            if step.duration is not None:
+                PLAN_STEP_SECONDS.labels(self.fast_llm.model, step.status).observe(step.duration)
+        
+        logger.info(f"⏱️ Шаги плана: {[step.to_dict() for step in steps]}")
+        return steps
+    
+    async def _run_step(self, step: PlanStep, context: str, semaphore: asyncio.Semaphore, deadline: float):
+        async with semaphore:
+            time_left = deadline - time.monotonic()
+            if time_left <= 0:
+                step.status = "skipped"
+                return
+            step.status = "running"
+            step.started_at = time.monotonic()
+            with span("plan.step", step=step.index, title=step.title, model=self.fast_llm.model) as step_span:
+                try:
+                    step.result = await self._execute_step(step.title, context, timeout=time_left)
+                    step.status = "done"
+                except asyncio.CancelledError:
+                    step_span.set(status="timeout")
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка в шаге {step.title}: {e}")
+                    step.status = "timeout" if isinstance(e, TimeoutError) else "failed"
+                step_span.set(status=step.status)
+            step.duration = time.monotonic() - step.started_at
     
-    async def _create_plan(self, goal: str) -> List[str]:
+    async def _create_plan(self, goal: str, timeout: Optional[float] = None) -> List[str]:
         """Создание плана выполнения цели (быстрая модель)"""
         prompt = f"""
         Пользователь хочет: {goal}
@@ -62,15 +181,17 @@ class PlanningAgent(BaseAgent):
         Верни только шаги в виде нумерованного списка.
         """
         
-        response = await self.fast_llm.ask(prompt)
+        response = await self.fast_llm.ask(prompt, timeout=timeout)
         response_text = response.get("answer", "") if isinstance(response, dict) else response
         
         # Парсим нумерованный список
         steps = [line.strip() for line in response_text.split('\n') if line.strip() and line[0].isdigit()]
         return [step[3:].strip() for step in steps if '. ' in step]  # Убираем нумерацию
     
-    async def _execute_step(self, step: str, context: str) -> str:
+    async def _execute_step(self, step: str, context: str, timeout: Optional[float] = None) -> str:
         """Выполнение одного шага плана (быстрая модель)"""
+        # Подшаги уступают очередь интерактивным запросам; задача gather имеет свой контекст
+        request_priority.set(PRIORITY_BACKGROUND)
         prompt = f"""
         Общая цель: {context}
         Текущий шаг: {step}
@@ -79,16 +200,23 @@ class PlanningAgent(BaseAgent):
         Будь максимально конкретным и практичным.
         """
         
-        response = await self.fast_llm.ask(prompt)
+        response = await self.fast_llm.ask(prompt, timeout=timeout)
+        if isinstance(response, dict) and "error" in response:
+            if response["error"].startswith("timeout"):
+                raise TimeoutError(response["error"])
+            raise RuntimeError(response["error"])
         return response.get("answer", "") if isinstance(response, dict) else response
     
-    async def _create_final_report(self, goal: str, step_results: List[str]) -> str:
-        """Создание финального отчета (качественная модель)"""
-        prompt = f"""
+    def _final_report_prompt(self, goal: str, steps: List[PlanStep]) -> str:
+        done = [step for step in steps if step.status == "done"]
+        missing = [step.title for step in steps if step.status != "done"]
+        missing_note = f"\n        Не успели выполниться шаги: {'; '.join(missing)}\n" if missing else ""
+        return f"""
         Исходная цель: {goal}
         
         Результаты выполнения шагов:
-        {chr(10).join([f"Шаг {i+1}: {result}" for i, result in enumerate(step_results)])}
+        {chr(10).join([f"Шаг {step.index + 1} ({step.title}): {step.result}" for step in done])}
+        {missing_note}
         
         Создай финальный отчет с:
         1. Кратким резюме достигнутых результатов
@@ -98,6 +226,10 @@ class PlanningAgent(BaseAgent):
         
         Отвечай на русском языке.
         """
-        
-        response = await self.quality_llm.ask(prompt)
+    
+    async def _create_final_report(self, goal: str, steps: List[PlanStep], deadline: float) -> str:
+        """Создание финального отчета (качественная модель)"""
+        timeout = max(deadline - time.monotonic(), PLAN_REPORT_RESERVE)
+        with span("plan.report", model=self.quality_llm.model):
+            response = await self.quality_llm.ask(self._final_report_prompt(goal, steps), timeout=timeout)
         return response.get("answer", "") if isinstance(response, dict) else response
\ No newline at end of file
@@ -0,0 +1,46 @@
+# llm/agents/router.py
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+class IntentRouter:
+    """
+    Скомпилированный классификатор запросов: по одному регулярному выражению
+    из `_KEYWORDS` на агента. Агент выбирается как раньше — первый по порядку
+    регистрации (nutrition, затем planning), у которого совпало хоть одно
+    ключевое слово; fallback — только когда не совпало ни у кого.
+    """
+
+    def __init__(self, agent_classes: Iterable, fallback: str = "simple"):
+        self.fallback = fallback
+        # Порядок регистрации агентов — приоритет маршрута
+        self._patterns: List[Tuple[str, Pattern]] = []
+
+        for agent_cls in agent_classes:
+            if any(name == agent_cls._NAME for name, _ in self._patterns):
+                continue
+            # Длинные ключевые слова первыми, чтобы "есть после" не перекрывалось короткими
+            keywords = sorted({kw.lower() for kw in agent_cls._KEYWORDS}, key=len, reverse=True)
+            if keywords:
+                self._patterns.append((agent_cls._NAME, re.compile("|".join(re.escape(kw) for kw in keywords))))
+
+    def score(self, query: str) -> Dict[str, int]:
+        """Количество совпавших ключевых слов по агентам (для диагностики в /detect_type)"""
+        query_lower = query.lower()
+        scores = {}
+        for agent_name, pattern in self._patterns:
+            count = sum(1 for _ in pattern.finditer(query_lower))
+            if count:
+                scores[agent_name] = count
+        return scores
+
+    def match(self, query: str) -> Optional[str]:
+        """Первый по приоритету агент, у которого совпало ключевое слово"""
+        query_lower = query.lower()
+        for agent_name, pattern in self._patterns:
+            if agent_name != self.fallback and pattern.search(query_lower):
+                return agent_name
+        return None
+
+    def classify(self, query: str) -> Tuple[str, Dict[str, int]]:
+        """Агент по приоритету и счёт по всем агентам; без совпадений — fallback"""
+        return self.match(query) or self.fallback, self.score(query)
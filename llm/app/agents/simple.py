@@ -1,5 +1,7 @@
 # llm/agents/simple.py
 from .base import BaseAgent
+from services.scheduler import PRIORITY_INTERACTIVE
+from typing import AsyncIterator, Optional
 import logging
 
 logger = logging.getLogger("nutrition-llm")
@@ -8,22 +10,37 @@ class SimpleAgent(BaseAgent):
     _NAME = "simple"
     _DESCRIPTION = "Агент для простых вопросов, общих консультаций, причин, рекомендаций."
     _KEYWORDS = ["причин", "рекомендац", "науч", "что будет если", "правда ли", "почему"]
+    _PRIORITY = PRIORITY_INTERACTIVE
     
-    def __init__(self, llm_orchestrator, **kwargs):
+    def __init__(self, llm_orchestrator, agent_registry=None, **kwargs):
         self.orchestrator = llm_orchestrator
+        self.agent_registry = agent_registry if agent_registry is not None else {}
     
     async def process_query(self, user_query: str) -> str:
         prompt = f"User: {user_query}"
         
         # Простые вопросы о калориях перенаправляем в nutrition
-        if "калор" in user_query.lower():
-            from agents.nutrition import NutritionAgent
-            from services.ollama_service import OllamaService
-            import os
-            fast_llm = OllamaService(model=os.getenv("OLLAMA_FAST_MODEL"))
-            quality_llm = OllamaService(model=os.getenv("OLLAMA_MODEL"))
-            nutrition_agent = NutritionAgent(fast_llm, quality_llm)
+        nutrition_agent = self.agent_registry.get("nutrition")
+        if nutrition_agent and "калор" in user_query.lower():
             return await nutrition_agent.calculate_calories(user_query)
         
         response = await self.orchestrator.ask(prompt)
-        return response.get("answer", "")
\ No newline at end of file
+        return response.get("answer", "")
+    
+    async def process_query_stream(self, user_query: str) -> AsyncIterator[str]:
+        prompt = f"User: {user_query}"
+        
+        nutrition_agent = self.agent_registry.get("nutrition")
+        if nutrition_agent and "калор" in user_query.lower():
+            async for chunk in nutrition_agent.calculate_calories_stream(user_query):
+                yield chunk
+            return
+        
+        async for chunk in self.orchestrator.ask_stream(prompt):
+            yield chunk
+    
+    def fast_answer(self, user_query: str) -> Optional[str]:
+        nutrition_agent = self.agent_registry.get("nutrition")
+        if nutrition_agent and "калор" in user_query.lower():
+            return nutrition_agent.fast_answer(user_query)
+        return None
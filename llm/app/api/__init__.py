@@ -7,6 +7,9 @@ from .ask import router as ask_router
 from .provider import router as provider_router
 from .status import router as status_router
 from .detect import router as detect_router
+from .kbju import router as kbju_router
+from .metrics import router as metrics_router
+from .summarize import router as summarize_router
 
 __all__ = [
     "health_router",
@@ -14,4 +17,7 @@ __all__ = [
     "provider_router",
     "status_router",
     "detect_router",
+    "kbju_router",
+    "metrics_router",
+    "summarize_router",
 ]
\ No newline at end of file
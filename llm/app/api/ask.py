@@ -1,18 +1,23 @@
 # llm/api/ask.py
 from fastapi import APIRouter, Request, HTTPException, Depends
 from fastapi.responses import StreamingResponse
-from services.llm_orchestrator import LLMOrchestrator
+from agents.manager import AgentManager
+from services.deadline import DEADLINE_HEADER, deadline_from_header
 from config import DEFAULT_PROMPT
 import os
 import json
-import asyncio
 
 router = APIRouter(tags=["ask"])
 INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
 
-def get_llm_orchestrator() -> LLMOrchestrator:
-    from main import llm_orchestrator
-    return llm_orchestrator
+def get_agent_manager() -> AgentManager:
+    from main import agent_manager
+    return agent_manager
+
+def _format_frame(frame: dict, sse: bool) -> str:
+    """NDJSON по умолчанию, SSE если клиент прислал Accept: text/event-stream"""
+    payload = json.dumps(frame, ensure_ascii=False)
+    return f"data: {payload}\n\n" if sse else f"{payload}\n"
 
 def verify_api_key(request: Request):
     key = request.headers.get("X-API-Key")
@@ -22,7 +27,7 @@ def verify_api_key(request: Request):
 @router.post("/ask")
 async def ask_agent(
     request: Request,
-    orchestrator: LLMOrchestrator = Depends(get_llm_orchestrator)
+    agent_manager: AgentManager = Depends(get_agent_manager)
 ):
     verify_api_key(request)
     
@@ -31,30 +36,56 @@ async def ask_agent(
     agent_type = data.get("agent_type", "auto")
     context = data.get("context", "")
     stream = data.get("stream", False)
+    # Дедлайн клиента: дальше него агенты, очереди и провайдеры не работают
+    deadline = deadline_from_header(request.headers.get(DEADLINE_HEADER))
     
-    from agents.manager import AgentManager
-    agent_manager = AgentManager(orchestrator)
-    
-    full_prompt = f"{context}\n{prompt}" if context else prompt
+    # Структурный запрос: сообщение, профиль и история отдельно — маршрут и промпт выбираются здесь
+    message = data.get("message")
+    profile = data.get("profile")
+    history = data.get("history")
+    # Резюме старых реплик по темам: агент возьмёт своё
+    summaries = data.get("summaries")
+    if message is not None:
+        if not isinstance(message, str) or not message.strip():
+            raise HTTPException(status_code=400, detail="Message must be a non-empty string")
+        if profile is not None and not isinstance(profile, dict):
+            raise HTTPException(status_code=400, detail="Profile must be an object")
+        if history is not None and not (isinstance(history, list) and all(isinstance(turn, dict) for turn in history)):
+            raise HTTPException(status_code=400, detail="History must be a list of objects")
+        if summaries is not None and not (isinstance(summaries, dict) and all(isinstance(text, str) for text in summaries.values())):
+            raise HTTPException(status_code=400, detail="Summaries must map topics to strings")
+        full_prompt = message
+        profile = profile or {}
+        history = history or []
+        summaries = summaries or {}
+    else:
+        full_prompt = f"{context}\n{prompt}" if context else prompt
+        profile = history = summaries = None
     
     if stream:
+        sse = "text/event-stream" in request.headers.get("accept", "")
+        
         async def stream_response():
-            result = await agent_manager.route_request(full_prompt, agent_type)
-            # Assuming agent_manager can handle stream internally
-            # For now, simulate stream from single response
-            answer = result.get("answer", "")
-            for i in range(0, len(answer), 50):  # chunk by ~50 chars
-                yield json.dumps({"chunk": answer[i:i+50]}) + "\n"
-                await asyncio.sleep(0.1)  # simulate
-            yield json.dumps({"done": True}) + "\n"
+            frames = agent_manager.route_request_stream(
+                full_prompt, agent_type, deadline=deadline, profile=profile, history=history, summaries=summaries
+            )
+            async for frame in frames:
+                yield _format_frame(frame, sse)
         
-        return StreamingResponse(stream_response(), media_type="text/event-stream")
+        return StreamingResponse(
+            stream_response(),
+            media_type="text/event-stream" if sse else "application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
     
-    result = await agent_manager.route_request(full_prompt, agent_type)
+    result = await agent_manager.route_request(
+        full_prompt, agent_type, deadline=deadline, profile=profile, history=history, summaries=summaries
+    )
     
     return {
         "answer": result.get("answer", ""),
         "agent_type": result.get("agent_type", "unknown"),
+        "agent_name": result.get("agent_name", ""),
         "status": result.get("status", "error"),
         "error": result.get("error", "")
     }
\ No newline at end of file
@@ -1,15 +1,16 @@
 # llm/api/detect.py
 from fastapi import APIRouter, Request, HTTPException, Depends
-from services.llm_orchestrator import LLMOrchestrator
+from agents.manager import AgentManager
 import os
 
 router = APIRouter(tags=["detect"])
 
 INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
+MAX_BATCH_SIZE = int(os.getenv("DETECT_MAX_BATCH_SIZE", "1000"))
 
-def get_llm_orchestrator() -> LLMOrchestrator:
-    from main import llm_orchestrator
-    return llm_orchestrator
+def get_agent_manager() -> AgentManager:
+    from main import agent_manager
+    return agent_manager
 
 def verify_api_key(request: Request):
     key = request.headers.get("X-API-Key")
@@ -19,7 +20,7 @@ def verify_api_key(request: Request):
 @router.post("/detect_type")
 async def detect_agent_type(
     request: Request,
-    orchestrator: LLMOrchestrator = Depends(get_llm_orchestrator)
+    agent_manager: AgentManager = Depends(get_agent_manager)
 ):
     verify_api_key(request)
     
@@ -29,8 +30,26 @@ async def detect_agent_type(
     if not query:
         raise HTTPException(status_code=400, detail="Query required")
     
-    from agents.manager import AgentManager
-    agent_manager = AgentManager(orchestrator)
-    agent_type = agent_manager._detect_agent_type(query)
+    agent_type, scores = agent_manager.classify(query)
     
-    return {"type": agent_type}
\ No newline at end of file
+    return {"type": agent_type, "scores": scores}
+
+@router.post("/detect_type/batch")
+async def detect_agent_types(
+    request: Request,
+    agent_manager: AgentManager = Depends(get_agent_manager)
+):
+    """Классификация множества запросов за один вызов (бэкфиллы, нагрузочные тесты)"""
+    verify_api_key(request)
+    
+    data = await request.json()
+    queries = data.get("queries", [])
+    
+    if not isinstance(queries, list) or not queries:
+        raise HTTPException(status_code=400, detail="Queries list required")
+    if len(queries) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Too many queries (max {MAX_BATCH_SIZE})")
+    
+    results = agent_manager.detect_agent_types([str(q) for q in queries])
+    
+    return {"results": [{"type": agent_type, "scores": scores} for agent_type, scores in results]}
\ No newline at end of file
@@ -5,6 +5,9 @@ from .ask import router as ask_router
 from .provider import router as provider_router
 from .status import router as status_router
 from .detect import router as detect_router  # new
+from .kbju import router as kbju_router
+from .metrics import router as metrics_router
+from .summarize import router as summarize_router
 
 router = APIRouter()
 
@@ -12,4 +15,7 @@ router.include_router(health_router)
 router.include_router(ask_router)
 router.include_router(provider_router)
 router.include_router(status_router)
-router.include_router(detect_router)  # add
\ No newline at end of file
+router.include_router(detect_router)  # add
+router.include_router(kbju_router)
+router.include_router(metrics_router)
+router.include_router(summarize_router)
\ No newline at end of file
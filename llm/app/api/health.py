@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
 from services.llm_orchestrator import LLMOrchestrator
+from services.warmup import ModelWarmup
 
 router = APIRouter(tags=["health"])
 
@@ -7,11 +9,21 @@ def get_llm_orchestrator() -> LLMOrchestrator:
     from main import llm_orchestrator
     return llm_orchestrator
 
+def get_model_warmup() -> ModelWarmup:
+    from main import model_warmup
+    return model_warmup
+
 @router.get("/health")
 async def health_check(orchestrator: LLMOrchestrator = Depends(get_llm_orchestrator)):
     """Проверка здоровья всех сервисов"""
     return await orchestrator.health_check()
 
+@router.get("/ready")
+async def ready(warmup: ModelWarmup = Depends(get_model_warmup)):
+    """Готовность к трафику: Ollama отвечает и все модели агентов загружены"""
+    status = warmup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 @router.get("/")
 async def root():
     """Корневой endpoint"""
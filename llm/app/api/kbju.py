@@ -0,0 +1,37 @@
+# llm/api/kbju.py
+from fastapi import APIRouter, Request, HTTPException
+from agents.kbju import calculate_kbju, format_kbju, ACTIVITY_FACTORS
+import os
+
+router = APIRouter(tags=["kbju"])
+
+INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
+
+def verify_api_key(request: Request):
+    key = request.headers.get("X-API-Key")
+    if key != INTERNAL_API_KEY:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+@router.post("/kbju")
+async def kbju(request: Request):
+    """Мгновенный расчёт суточных калорий и БЖУ по профилю, без LLM"""
+    verify_api_key(request)
+    
+    data = await request.json()
+    
+    try:
+        result = calculate_kbju(
+            gender=str(data.get("gender", "м")),
+            age=float(data["age"]),
+            weight=float(data["weight"]),
+            height=float(data.get("height", 170)),
+            goal=str(data.get("goal", "maintain")),
+            activity=str(data.get("activity", "moderate"))
+        )
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="age and weight are required numbers")
+    
+    if data.get("activity") and data["activity"] not in ACTIVITY_FACTORS:
+        raise HTTPException(status_code=400, detail=f"activity must be one of {list(ACTIVITY_FACTORS)}")
+    
+    return {**result, "text": format_kbju(result)}
@@ -0,0 +1,10 @@
+# llm/api/metrics.py
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics")
+async def metrics():
+    """Метрики Prometheus: задержки по этапам, токены в секунду, очередь, кэши"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
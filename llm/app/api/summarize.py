@@ -0,0 +1,65 @@
+# llm/api/summarize.py
+from fastapi import APIRouter, Request, HTTPException, Depends
+from services.llm_orchestrator import LLMOrchestrator
+from services.scheduler import request_priority, PRIORITY_BACKGROUND
+from services.deadline import DEADLINE_HEADER, deadline_from_header, request_deadline
+from services.tracing import current_span
+from config import SUMMARY_MAX_TURNS, SUMMARY_WORDS
+import logging
+import os
+
+router = APIRouter(tags=["summarize"])
+logger = logging.getLogger("nutrition-llm")
+
+INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
+
+def get_llm_orchestrator() -> LLMOrchestrator:
+    from main import llm_orchestrator
+    return llm_orchestrator
+
+def verify_api_key(request: Request):
+    key = request.headers.get("X-API-Key")
+    if key != INTERNAL_API_KEY:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+def summary_prompt(topic: str, summary: str, turns: list) -> str:
+    dialog = "\n".join(f"User: {turn.get('user', '')}\nAI: {turn.get('ai', '')}" for turn in turns)
+    previous = f"Current summary: {summary}\n\n" if summary else ""
+    return (
+        f"{previous}New messages:\n{dialog}\n\n"
+        f"Update the summary of this conversation in {SUMMARY_WORDS} words. "
+        f"Keep key facts about the user related to {topic}: goals, numbers, preferences, restrictions. "
+        f"Answer with the summary only."
+    )
+
+@router.post("/summarize")
+async def summarize(
+    request: Request,
+    orchestrator: LLMOrchestrator = Depends(get_llm_orchestrator)
+):
+    """Инкрементальное резюме диалога: прошлое резюме + новые реплики. Фоновая задача бота, не путь ответа"""
+    verify_api_key(request)
+    
+    data = await request.json()
+    topic = str(data.get("topic") or "simple")
+    summary = str(data.get("summary") or "")
+    turns = data.get("turns")
+    
+    if not isinstance(turns, list) or not turns or not all(isinstance(turn, dict) for turn in turns):
+        raise HTTPException(status_code=400, detail="Turns list required")
+    if len(turns) > SUMMARY_MAX_TURNS:
+        raise HTTPException(status_code=413, detail=f"Too many turns (max {SUMMARY_MAX_TURNS})")
+    
+    # Резюме никто не ждёт: уступаем очередь ответам пользователям
+    request_priority.set(PRIORITY_BACKGROUND)
+    request_deadline.set(deadline_from_header(request.headers.get(DEADLINE_HEADER)))
+    span = current_span()
+    if span is not None:
+        span.set(topic=topic, turns=len(turns))
+    
+    result = await orchestrator.ask(summary_prompt(topic, summary, turns), agent_type="summary")
+    if "error" in result or not result.get("answer", "").strip():
+        logger.warning(f"⚠️ Резюме диалога ({topic}) не обновлено: {result.get('error', 'empty answer')}")
+        raise HTTPException(status_code=502, detail=result.get("error") or "Empty summary")
+    
+    return {"summary": result["answer"].strip(), "topic": topic}
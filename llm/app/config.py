@@ -1,8 +1,5 @@
 # llm/config.py
 import os
-from agents.nutrition import NutritionAgent
-from agents.planning import PlanningAgent
-from agents.simple import SimpleAgent
 
 DEFAULT_PROMPT = "Привет! Я хочу совет по питанию и тренировкам."
 
@@ -19,11 +16,144 @@ You are a Nutrion - personal AI fitness assistant. Answer the user's query direc
 """
 
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5-mini")
+# OpenAI-совместимый API (OpenAI, vLLM, llama.cpp server...); без адреса провайдер выключен
+OPENAI_BASE_URL = (os.getenv("OPENAI_BASE_URL") or os.getenv("OPEN_AI_HOST") or "").rstrip("/")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "1") == "1"
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "32"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:1b")
 
 MAX_TOKENS = 800
 TEMPERATURE = 0.7
-OLLAMA_TIMEOUT = 30
+# Потолок одного непотокового вызова Ollama; внутри дедлайна запроса берётся меньшее из двух
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+
+# Дедлайн запроса: бот присылает X-Request-Deadline (unix-время в секундах), без заголовка — значение по умолчанию
+REQUEST_DEADLINE_DEFAULT = float(os.getenv("REQUEST_DEADLINE_DEFAULT", "300"))
+REQUEST_DEADLINE_MAX = float(os.getenv("REQUEST_DEADLINE_MAX", "600"))
+# Сколько секунд до дедлайна оставить на быстрый ответ вместо недоделанного
+DEADLINE_RESERVE = float(os.getenv("DEADLINE_RESERVE", "1"))
+DEADLINE_FALLBACK_ANSWER = (
+    "Не успел подготовить полный ответ вовремя. "
+    "Попробуй спросить короче или повтори вопрос чуть позже."
+)
+
+# Пул HTTP-соединений к Ollama (одна сессия на хост, общая для всех OllamaService)
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "32"))
+OLLAMA_KEEPALIVE_TIMEOUT = float(os.getenv("OLLAMA_KEEPALIVE_TIMEOUT", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_REQUEST_TIMEOUT = float(os.getenv("OLLAMA_REQUEST_TIMEOUT", "300"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "5"))
+OLLAMA_PULL_TIMEOUT = float(os.getenv("OLLAMA_PULL_TIMEOUT", "1800"))
+
+# Старт сервиса: ждём Ollama с backoff до дедлайна, затем докачиваем и прогреваем модели агентов
+STARTUP_READY_TIMEOUT = float(os.getenv("STARTUP_READY_TIMEOUT", "120"))
+STARTUP_BACKOFF_MAX = float(os.getenv("STARTUP_BACKOFF_MAX", "5"))
+OLLAMA_PULL_MISSING = os.getenv("OLLAMA_PULL_MISSING", "1") == "1"
+
+# Фоновая проверка доступности провайдеров
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "10"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+HEALTH_STALE_AFTER = float(os.getenv("HEALTH_STALE_AFTER", "30"))
+HEALTH_FAILURE_THRESHOLD = int(os.getenv("HEALTH_FAILURE_THRESHOLD", "2"))
+HEALTH_RECOVERY_THRESHOLD = int(os.getenv("HEALTH_RECOVERY_THRESHOLD", "1"))
+
+# Предохранители провайдеров и выбор по ожидаемой задержке
+CB_FAILURE_THRESHOLD = int(os.getenv("CB_FAILURE_THRESHOLD", "5"))
+CB_ERROR_RATE_THRESHOLD = float(os.getenv("CB_ERROR_RATE_THRESHOLD", "0.5"))
+CB_MIN_SAMPLES = int(os.getenv("CB_MIN_SAMPLES", "10"))
+CB_OPEN_SECONDS = float(os.getenv("CB_OPEN_SECONDS", "30"))
+CB_OPEN_MAX_SECONDS = float(os.getenv("CB_OPEN_MAX_SECONDS", "300"))
+CB_HALF_OPEN_MAX_CALLS = int(os.getenv("CB_HALF_OPEN_MAX_CALLS", "1"))
+# Оценка времени до первого токена для ещё не измеренного провайдера (только в статусе: в маршруте он идёт после измеренных)
+CB_DEFAULT_LATENCY_MS = float(os.getenv("CB_DEFAULT_LATENCY_MS", "3000"))
+# Бюджет повторов: доля от числа запросов плюс минимальный приток в секунду
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("RETRY_BUDGET_MIN_PER_SEC", "0.1"))
+RETRY_BUDGET_MAX_TOKENS = float(os.getenv("RETRY_BUDGET_MAX_TOKENS", "10"))
+
+# Хеджирование: если основной провайдер не дал первый токен за перцентиль его недавней задержки,
+# тот же запрос уходит второму, побеждает первый ответ
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "500"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+
+# Кэш ответов LLM: TTL в секундах по agent_type вызова оркестратора, формат "simple=3600,summary=600".
+# Через оркестратор (кэш, single-flight, переключение, хеджирование) ходят SimpleAgent и /summarize;
+# NutritionAgent и PlanningAgent вызывают свои модели Ollama напрямую и этим кэшем не пользуются
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+RESPONSE_CACHE_DEFAULT_TTL = int(os.getenv("RESPONSE_CACHE_DEFAULT_TTL", "600"))
+RESPONSE_CACHE_TTLS = {
+    name.strip(): int(ttl)
+    for name, ttl in (
+        item.split("=", 1)
+        for item in os.getenv("RESPONSE_CACHE_TTLS", "simple=3600").split(",")
+        if "=" in item
+    )
+}
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL", "")
+
+# Планировщик запросов к Ollama: лимит параллельных генераций на модель (как OLLAMA_NUM_PARALLEL)
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+SCHEDULER_MODEL_LIMITS = {
+    name.strip(): int(limit)
+    for name, limit in (
+        item.rsplit("=", 1)
+        for item in os.getenv("SCHEDULER_MODEL_LIMITS", "").split(",")
+        if "=" in item
+    )
+}
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "32"))
+SCHEDULER_QUEUE_TIMEOUT = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", "60"))
+
+# Сессионный режим Ollama: история передаётся настоящими messages за неизменным системным промптом,
+# чтобы Ollama переиспользовала KV-кэш общего префикса
+OLLAMA_SESSION_MODE = os.getenv("OLLAMA_SESSION_MODE", "1") == "1"
+
+def _model_settings(env_name: str) -> dict:
+    """Настройки по моделям, формат "llama3.2:1b=1h,qwen2.5:1.5b=30m" """
+    return {
+        name.strip(): value.strip()
+        for name, value in (
+            item.rsplit("=", 1)
+            for item in os.getenv(env_name, "").split(",")
+            if "=" in item
+        )
+    }
+
+# Сколько модель держится в памяти после запроса; по моделям — OLLAMA_KEEP_ALIVE_MODELS
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_KEEP_ALIVE_MODELS = _model_settings("OLLAMA_KEEP_ALIVE_MODELS")
+# Размер контекста и число потоков (0 — решает Ollama)
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+OLLAMA_NUM_CTX_MODELS = {name: int(value) for name, value in _model_settings("OLLAMA_NUM_CTX_MODELS").items()}
+OLLAMA_NUM_THREAD = int(os.getenv("OLLAMA_NUM_THREAD", "0"))
+OLLAMA_NUM_THREAD_MODELS = {name: int(value) for name, value in _model_settings("OLLAMA_NUM_THREAD_MODELS").items()}
+
+# Структурный /ask: сколько последних реплик истории по теме агента попадает в промпт
+ASK_HISTORY_TURNS = int(os.getenv("ASK_HISTORY_TURNS", "5"))
+
+# /summarize: бот в фоне сворачивает старые реплики в резюме по теме
+SUMMARY_MAX_TURNS = int(os.getenv("SUMMARY_MAX_TURNS", "50"))
+SUMMARY_WORDS = os.getenv("SUMMARY_WORDS", "50-100")
+
+# Трейсинг: log — JSON-строки в лог nutrition-trace, otlp — в локальный коллектор (OTLP/HTTP JSON), off — выключен
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "log")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "nutrition-llm")
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2"))
+TRACE_MAX_QUEUE = int(os.getenv("TRACE_MAX_QUEUE", "2048"))
+
+# Агенты импортируются после настроек: их модули сами читают значения из config
+from agents.nutrition import NutritionAgent
+from agents.planning import PlanningAgent
+from agents.simple import SimpleAgent
 
 AGENT_CLASSES = [
     NutritionAgent,
@@ -1,15 +1,24 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 import logging
 import sys
-import asyncio
 from services.llm_orchestrator import LLMOrchestrator
+from services.http_pool import ollama_pool
+from services.ollama_service import OLLAMA_HOST
+from services.scheduler import SchedulerOverloaded
+from services.warmup import ModelWarmup
+from services.metrics import register_cache_stats
+from agents.manager import AgentManager
+from services.tracing import TracingMiddleware, TraceIdFilter, exporter as span_exporter
 from api.endpoints import router
 
-# Настройка логгера
+# Настройка логгера: trace_id в каждой строке связывает логи с трейсом запроса
+log_handler = logging.StreamHandler(sys.stdout)
+log_handler.addFilter(TraceIdFilter())
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)],
+    format="%(asctime)s [%(levelname)s] %(name)s [%(trace_id)s]: %(message)s",
+    handlers=[log_handler],
 )
 
 logger = logging.getLogger("nutrition-llm")
@@ -24,18 +33,47 @@ app = FastAPI(
 # Инициализация оркестратора
 llm_orchestrator = LLMOrchestrator()
 
+# Реестр агентов: создаётся один раз на процесс и переиспользуется всеми запросами
+agent_manager = AgentManager(llm_orchestrator)
+
+# Готовность: ожидание Ollama и прогрев всех моделей агентов
+model_warmup = ModelWarmup([*agent_manager.llm_services, llm_orchestrator.services["ollama"]])
+
+# Попадания в кэши читаются из их счётчиков при каждом scrape /metrics
+register_cache_stats({
+    "response": llm_orchestrator.cache.stats,
+    "plan_skeleton": agent_manager.registry["planning"].plan_cache.stats,
+})
+
 # Подключение роутера
 app.include_router(router)
+# Отрезок на каждый HTTP-запрос; родитель — traceparent от бота
+app.add_middleware(TracingMiddleware)
+
+@app.exception_handler(SchedulerOverloaded)
+async def scheduler_overloaded_handler(request: Request, exc: SchedulerOverloaded):
+    """Очередь к Ollama переполнена: 429/503 с подсказкой Retry-After"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"status": "overloaded", "error": str(exc), "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
 
 @app.on_event("startup")
 async def startup_event():
     """Запуск при старте приложения"""
     logger.info("🚀 Starting Nutrition LLM Service...")
-    await asyncio.sleep(15)
+    await ollama_pool.open(OLLAMA_HOST)
     await llm_orchestrator.initialize()
-    await llm_orchestrator.ask("Warm-up test prompt")  # cold fix
+    span_exporter.start()
+    # Прогрев идёт в фоне, /ready отдаёт 503, пока он не закончится
+    model_warmup.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Очистка при завершении"""
-    logger.info("🛑 Shutting down Nutrition LLM Service...")
\ No newline at end of file
+    logger.info("🛑 Shutting down Nutrition LLM Service...")
+    await model_warmup.stop()
+    await llm_orchestrator.shutdown()
+    await ollama_pool.close()
+    await span_exporter.stop()
\ No newline at end of file
@@ -0,0 +1,55 @@
+# llm/services/chat_messages.py
+import re
+from typing import Dict, List
+from config import SYSTEM_PROMPT
+
+# Реплики в промпте, который собирает бот: "User: ..." и "AI: ..." с начала строки
+_TURN_RE = re.compile(r"^(User|AI|Assistant):\s?", re.M)
+_ROLES = {"User": "user", "AI": "assistant", "Assistant": "assistant"}
+
+def flat_messages(prompt: str, context: str = "") -> List[Dict[str, str]]:
+    """Прежний формат: вся история склеена в одно сообщение пользователя"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Контекст: {context}\n\nВопрос: {prompt}"},
+    ]
+
+def session_messages(prompt: str, context: str = "") -> List[Dict[str, str]]:
+    """
+    История диалога настоящими messages. Порядок от стабильного к изменчивому:
+    системный промпт, профиль/контекст, прошлые реплики, текущий вопрос —
+    так у соседних запросов пользователя совпадает максимально длинный префикс.
+    """
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if context.strip():
+        messages.append({"role": "system", "content": f"Контекст: {context.strip()}"})
+
+    # Служебные промпты агентов ("Based on KBJU ...") не разбираем — это одно сообщение
+    stripped = prompt.lstrip()
+    if not (stripped.startswith(("User profile:", "Summary of past")) or _TURN_RE.match(stripped)):
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    turns = list(_TURN_RE.finditer(stripped))
+    if not turns:
+        # Профиль или резюме без реплик — это и есть запрос
+        messages.append({"role": "user", "content": stripped.strip()})
+        return messages
+    preamble = stripped[:turns[0].start()].strip()
+    if preamble:
+        messages.append({"role": "system", "content": preamble})
+
+    for i, match in enumerate(turns):
+        end = turns[i + 1].start() if i + 1 < len(turns) else len(stripped)
+        content = stripped[match.end():end].strip()
+        if not content:
+            continue
+        role = _ROLES[match.group(1)]
+        # Подряд идущие реплики одной роли склеиваем, чтобы роли чередовались
+        if messages[-1]["role"] == role:
+            messages[-1]["content"] += f"\n{content}"
+        else:
+            messages.append({"role": role, "content": content})
+
+    # Промпт, закончившийся репликой ассистента, не дублируем целиком: модель продолжит последнюю реплику
+    return messages
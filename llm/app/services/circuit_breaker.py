@@ -0,0 +1,182 @@
+# llm/services/circuit_breaker.py
+import logging
+import time
+from typing import Optional
+from config import (
+    CB_FAILURE_THRESHOLD,
+    CB_ERROR_RATE_THRESHOLD,
+    CB_MIN_SAMPLES,
+    CB_OPEN_SECONDS,
+    CB_OPEN_MAX_SECONDS,
+    CB_HALF_OPEN_MAX_CALLS,
+    CB_DEFAULT_LATENCY_MS,
+    RETRY_BUDGET_RATIO,
+    RETRY_BUDGET_MIN_PER_SEC,
+    RETRY_BUDGET_MAX_TOKENS,
+)
+
+logger = logging.getLogger("nutrition-llm")
+
+EWMA_ALPHA = 0.2
+# Без новых запросов доля ошибок забывается, чтобы провайдер снова получил шанс
+ERROR_RATE_HALF_LIFE_S = 60.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    Предохранитель провайдера по реальным запросам: closed -> open при серии ошибок
+    или высокой доле ошибок, через паузу half-open с пробными запросами.
+    Заодно держит EWMA времени до первого токена и доли ошибок для выбора провайдера:
+    полная длительность зависит от длины ответа и сравнивать по ней провайдеров нельзя.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.latency_ms: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.last_sample_at = time.monotonic()
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.open_seconds = CB_OPEN_SECONDS
+        self.half_open_calls = 0
+        self.last_error = ""
+        self.trips = 0
+
+    def _maybe_half_open(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self.half_open_calls = 0
+            logger.info(f"🔌 {self.name}: предохранитель half-open, пробуем запрос")
+
+    def can_route(self) -> bool:
+        """Можно ли рассматривать провайдера (без резервирования пробного запроса)"""
+        self._maybe_half_open()
+        if self.state == OPEN:
+            return False
+        return self.state == CLOSED or self.half_open_calls < CB_HALF_OPEN_MAX_CALLS
+
+    def allow_request(self) -> bool:
+        """Резервирует право на запрос; в half-open — не больше CB_HALF_OPEN_MAX_CALLS одновременно"""
+        if not self.can_route():
+            return False
+        if self.state == HALF_OPEN:
+            self.half_open_calls += 1
+        return True
+
+    def release(self):
+        """Запрос не дошёл до провайдера (отмена, очередь) — вердикта нет"""
+        if self.state == HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def current_error_rate(self) -> float:
+        idle = time.monotonic() - self.last_sample_at
+        return self.error_rate * 0.5 ** (idle / ERROR_RATE_HALF_LIFE_S)
+
+    def measured(self) -> bool:
+        return self.latency_ms is not None
+
+    def expected_latency_ms(self) -> float:
+        """Ожидаемое время до первого токена успешного ответа: задержка с поправкой на долю ошибок"""
+        latency = self.latency_ms if self.latency_ms is not None else CB_DEFAULT_LATENCY_MS
+        return latency / max(1.0 - self.current_error_rate(), 0.05)
+
+    def _sample(self, failed: bool):
+        self.samples += 1
+        self.error_rate = self.current_error_rate()
+        self.error_rate += EWMA_ALPHA * (float(failed) - self.error_rate)
+        self.last_sample_at = time.monotonic()
+
+    def record_success(self, latency_ms: Optional[float] = None):
+        """latency_ms — время до первого токена; None, если провайдер его не сообщил"""
+        self._sample(failed=False)
+        if latency_ms is not None:
+            self.latency_ms = latency_ms if self.latency_ms is None else self.latency_ms + EWMA_ALPHA * (latency_ms - self.latency_ms)
+        self.consecutive_failures = 0
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self.open_seconds = CB_OPEN_SECONDS
+            logger.info(f"🔌 {self.name}: предохранитель закрыт, провайдер восстановился")
+
+    def record_failure(self, error: str = "", trip: bool = False):
+        self._sample(failed=True)
+        self.consecutive_failures += 1
+        self.last_error = error
+
+        if self.state == HALF_OPEN:
+            # Проба не удалась — следующая пауза длиннее
+            self._open(min(self.open_seconds * 2, CB_OPEN_MAX_SECONDS))
+        elif self.state == CLOSED and (
+            trip
+            or self.consecutive_failures >= CB_FAILURE_THRESHOLD
+            or (self.samples >= CB_MIN_SAMPLES and self.error_rate >= CB_ERROR_RATE_THRESHOLD)
+        ):
+            self._open(CB_OPEN_SECONDS)
+
+    def _open(self, seconds: float):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.open_seconds = seconds
+        self.half_open_calls = 0
+        self.trips += 1
+        logger.warning(f"🔌 {self.name}: предохранитель открыт на {seconds:.0f} с ({self.last_error})")
+
+    def to_dict(self) -> dict:
+        self._maybe_half_open()
+        return {
+            "state": self.state,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "error_rate": round(self.current_error_rate(), 3),
+            "expected_latency_ms": round(self.expected_latency_ms(), 1),
+            "consecutive_failures": self.consecutive_failures,
+            "trips": self.trips,
+            "last_error": self.last_error,
+        }
+
+class RetryBudget:
+    """
+    Бюджет повторов: каждый запрос добавляет RETRY_BUDGET_RATIO токена, каждый повтор
+    или переключение на другого провайдера тратит один. Во время аварии повторы
+    не умножают нагрузку больше чем на долю RETRY_BUDGET_RATIO.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_sec: float = RETRY_BUDGET_MIN_PER_SEC,
+                 max_tokens: float = RETRY_BUDGET_MAX_TOKENS):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._refilled_at = time.monotonic()
+        self.spent = 0
+        self.denied = 0
+
+    def _refill(self, amount: float = 0.0):
+        now = time.monotonic()
+        amount += (now - self._refilled_at) * self.min_per_sec
+        self._refilled_at = now
+        self.tokens = min(self.max_tokens, self.tokens + amount)
+
+    def record_request(self):
+        self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.spent += 1
+            return True
+        self.denied += 1
+        return False
+
+    def to_dict(self) -> dict:
+        self._refill()
+        return {
+            "tokens": round(self.tokens, 2),
+            "ratio": self.ratio,
+            "spent": self.spent,
+            "denied": self.denied,
+        }
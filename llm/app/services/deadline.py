@@ -0,0 +1,43 @@
+# llm/services/deadline.py
+import math
+import time
+from contextvars import ContextVar
+from typing import Optional
+from config import REQUEST_DEADLINE_DEFAULT, REQUEST_DEADLINE_MAX
+
+DEADLINE_HEADER = "X-Request-Deadline"
+
+# Дедлайн текущего запроса по time.monotonic(); выставляется менеджером агентов и наследуется дочерними задачами
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+def deadline_from_header(value: Optional[str]) -> float:
+    """
+    Дедлайн из заголовка X-Request-Deadline (unix-время); без заголовка или с мусором (NaN, inf) —
+    REQUEST_DEADLINE_DEFAULT. Прошедший дедлайн — «уже сейчас», слишком далёкий — не дальше REQUEST_DEADLINE_MAX.
+    """
+    seconds = REQUEST_DEADLINE_DEFAULT
+    if value:
+        try:
+            parsed = float(value)
+        except ValueError:
+            parsed = math.nan
+        if math.isfinite(parsed):
+            seconds = parsed - time.time()
+    return time.monotonic() + min(max(seconds, 0.0), REQUEST_DEADLINE_MAX)
+
+def remaining() -> Optional[float]:
+    """Сколько секунд осталось до дедлайна запроса; None — дедлайна нет"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+def budget(timeout: Optional[float]) -> Optional[float]:
+    """Таймаут вызова, урезанный до остатка дедлайна запроса"""
+    left = remaining()
+    if left is None:
+        return timeout
+    left = max(left, 0.0)
+    return left if timeout is None else min(timeout, left)
@@ -0,0 +1,152 @@
+# llm/services/health_monitor.py
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+from .llm_service import BaseLLMService
+from config import (
+    HEALTH_PROBE_INTERVAL,
+    HEALTH_PROBE_TIMEOUT,
+    HEALTH_STALE_AFTER,
+    HEALTH_FAILURE_THRESHOLD,
+    HEALTH_RECOVERY_THRESHOLD,
+)
+
+logger = logging.getLogger("nutrition-llm")
+
+LATENCY_EWMA_ALPHA = 0.3
+
+class ProviderHealth:
+    """Закэшированное состояние одного провайдера"""
+
+    __slots__ = ("available", "known", "latency_ms", "last_checked",
+                 "consecutive_failures", "consecutive_successes", "last_error")
+
+    def __init__(self):
+        self.available = False
+        self.known = False
+        self.latency_ms: Optional[float] = None
+        self.last_checked = 0.0
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.last_error = ""
+
+    def to_dict(self) -> dict:
+        age = time.monotonic() - self.last_checked if self.last_checked else None
+        return {
+            "available": self.available,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "checked_ago_s": round(age, 1) if age is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+class HealthMonitor:
+    """
+    Фоновая проверка доступности провайдеров.
+    Запросы читают закэшированное состояние, а не ходят в /api/tags на каждый вызов.
+    """
+
+    def __init__(self, services: Dict[str, BaseLLMService]):
+        self.services = services
+        self.state: Dict[str, ProviderHealth] = {name: ProviderHealth() for name in services}
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def start(self):
+        """Запуск фонового пробера"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🩺 Health prober запущен (интервал {HEALTH_PROBE_INTERVAL}s)")
+
+    async def stop(self):
+        """Остановка фонового пробера"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+            await self.probe_all()
+
+    async def probe_all(self):
+        await asyncio.gather(*(self.probe(name) for name in self.services))
+
+    async def probe(self, name: str) -> bool:
+        """Одна проверка провайдера; параллельные вызовы делят одну проверку"""
+        task = self._inflight.get(name)
+        if task is None:
+            task = asyncio.create_task(self._probe(name))
+            self._inflight[name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+        return await asyncio.shield(task)
+
+    async def _probe(self, name: str) -> bool:
+        start = time.monotonic()
+        try:
+            ok = await asyncio.wait_for(self.services[name].health_check(), HEALTH_PROBE_TIMEOUT)
+            error = "" if ok else "health check failed"
+        except Exception as e:
+            ok, error = False, str(e) or e.__class__.__name__
+        latency_ms = (time.monotonic() - start) * 1000
+        self._record(name, bool(ok), latency_ms if ok else None, error)
+        return self.state[name].available
+
+    def record_success(self, name: str, latency_ms: Optional[float] = None):
+        """Пассивный сигнал об успешном запросе"""
+        self._record(name, True, latency_ms)
+
+    def record_failure(self, name: str, error: str = ""):
+        """Пассивный сигнал об ошибке запроса"""
+        self._record(name, False, None, error)
+
+    def _record(self, name: str, ok: bool, latency_ms: Optional[float], error: str = ""):
+        state = self.state.get(name)
+        if state is None:
+            return
+        state.last_checked = time.monotonic()
+
+        if latency_ms is not None:
+            if state.latency_ms is None:
+                state.latency_ms = latency_ms
+            else:
+                state.latency_ms += LATENCY_EWMA_ALPHA * (latency_ms - state.latency_ms)
+
+        was_available = state.available
+        if ok:
+            state.consecutive_successes += 1
+            state.consecutive_failures = 0
+            state.last_error = ""
+            if not state.known or state.consecutive_successes >= HEALTH_RECOVERY_THRESHOLD:
+                state.available = True
+        else:
+            state.consecutive_failures += 1
+            state.consecutive_successes = 0
+            state.last_error = error
+            if not state.known or state.consecutive_failures >= HEALTH_FAILURE_THRESHOLD:
+                state.available = False
+        state.known = True
+
+        if was_available != state.available:
+            status = "✅ доступен" if state.available else f"❌ недоступен ({error})"
+            logger.info(f"🩺 {name}: {status}")
+
+    def is_fresh(self, name: str) -> bool:
+        state = self.state[name]
+        return state.known and time.monotonic() - state.last_checked <= HEALTH_STALE_AFTER
+
+    async def is_available(self, name: str) -> bool:
+        """Закэшированная доступность; проверка inline только если состояние устарело"""
+        if name not in self.state:
+            return False
+        if not self.is_fresh(name):
+            return await self.probe(name)
+        return self.state[name].available
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {name: state.to_dict() for name, state in self.state.items()}
@@ -0,0 +1,40 @@
+# llm/services/hedging.py
+import math
+from collections import deque
+from typing import Dict, Optional
+from config import HEDGE_PERCENTILE, HEDGE_MIN_DELAY_MS, HEDGE_MIN_SAMPLES, HEDGE_WINDOW
+
+class LatencyWindow:
+    """Последние задержки провайдера (до первого токена) для порога хеджирования"""
+
+    def __init__(self, size: int = HEDGE_WINDOW):
+        self.samples = deque(maxlen=size)
+
+    def add(self, latency_ms: float):
+        self.samples.append(latency_ms)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[idx]
+
+    def hedge_delay_ms(self) -> Optional[float]:
+        """Через сколько дублировать запрос; None — истории мало, не хеджируем"""
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY_MS, self.percentile(HEDGE_PERCENTILE))
+
+class HedgeStats:
+    """Счётчики хеджирования по провайдерам"""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[str, int]] = {}
+
+    def inc(self, provider: str, counter: str):
+        stats = self.counters.setdefault(provider, {"hedged": 0, "hedge_sent": 0, "wins": 0, "losses": 0})
+        stats[counter] += 1
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        return {provider: dict(stats) for provider, stats in self.counters.items()}
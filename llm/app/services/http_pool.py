@@ -0,0 +1,60 @@
+# llm/services/http_pool.py
+import logging
+from typing import Dict
+import aiohttp
+from config import (
+    OLLAMA_POOL_SIZE,
+    OLLAMA_KEEPALIVE_TIMEOUT,
+    OLLAMA_CONNECT_TIMEOUT,
+    OLLAMA_READ_TIMEOUT,
+    OLLAMA_REQUEST_TIMEOUT,
+)
+
+logger = logging.getLogger("nutrition-llm")
+
+class OllamaConnectionPool:
+    """
+    Долгоживущие aiohttp-сессии для Ollama: одна сессия со своим пулом
+    соединений на каждый хост. Открывается на старте приложения, закрывается на шатдауне.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=OLLAMA_POOL_SIZE,
+            limit_per_host=OLLAMA_POOL_SIZE,
+            keepalive_timeout=OLLAMA_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=OLLAMA_REQUEST_TIMEOUT,
+            connect=OLLAMA_CONNECT_TIMEOUT,
+            sock_connect=OLLAMA_CONNECT_TIMEOUT,
+            sock_read=OLLAMA_READ_TIMEOUT,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def open(self, host: str) -> aiohttp.ClientSession:
+        """Создание пула для хоста при старте приложения"""
+        return self.get_session(host)
+
+    def get_session(self, host: str) -> aiohttp.ClientSession:
+        """Сессия для хоста; создаётся лениво, если пул не был открыт заранее"""
+        session = self._sessions.get(host)
+        if session is None or session.closed:
+            session = self._create_session()
+            self._sessions[host] = session
+            logger.info(f"🔌 Открыт пул соединений к {host} (размер: {OLLAMA_POOL_SIZE})")
+        return session
+
+    async def close(self):
+        """Закрытие всех сессий"""
+        for host, session in self._sessions.items():
+            if not session.closed:
+                await session.close()
+                logger.info(f"🔌 Закрыт пул соединений к {host}")
+        self._sessions.clear()
+
+ollama_pool = OllamaConnectionPool()
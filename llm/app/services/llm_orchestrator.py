@@ -1,15 +1,26 @@
+import asyncio
 import logging
-from typing import Dict, AsyncIterator
+import time
+from typing import Callable, Dict, AsyncIterator, List, Optional, Tuple
 from .openai_service import OpenAIService
-from .ollama_service import OllamaService
-from tenacity import retry, stop_after_attempt, wait_exponential
+from .ollama_service import OllamaService, prompt_eval_stats
+from .health_monitor import HealthMonitor
+from .response_cache import ResponseCache
+from .single_flight import SingleFlight
+from .circuit_breaker import CircuitBreaker, RetryBudget
+from .hedging import LatencyWindow, HedgeStats
+from .deadline import expired
+from .tracing import current_span
+from config import TEMPERATURE, MAX_TOKENS, HEDGE_ENABLED, HEDGE_PERCENTILE
+from .scheduler import llm_scheduler, SchedulerOverloaded
 
 logger = logging.getLogger("nutrition-llm")
 
 class LLMOrchestrator:
     """
     Оркестратор для управления LLM провайдерами.
-    Автоматически переключается между сервисами при ошибках.
+    Выбирает провайдера с наименьшей ожидаемой задержкой среди тех, чей
+    предохранитель не разомкнут; повторы на другом провайдере — в рамках бюджета.
     """
     
     def __init__(self):
@@ -17,138 +28,421 @@ class LLMOrchestrator:
             "openai": OpenAIService(),
             "ollama": OllamaService()
         }
+        self.health = HealthMonitor(self.services)
+        self.cache = ResponseCache()
+        self.flights = SingleFlight()
+        self.breakers: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in self.services}
+        self.retry_budget = RetryBudget()
+        # Задержка до первого токена по провайдерам: (имя, stream) -> окно последних значений
+        self.latency: Dict[Tuple[str, bool], LatencyWindow] = {
+            (name, stream): LatencyWindow() for name in self.services for stream in (False, True)
+        }
+        self.hedge_stats = HedgeStats()
         self.current_provider = "ollama"
-        self.openai_errors_count = 0
-        self.MAX_OPENAI_ERRORS = 3
+        # Провайдер, выбранный вручную через /switch-provider; пробуется первым
+        self.pinned_provider: Optional[str] = None
     
     async def initialize(self):
         """Инициализация всех сервисов"""
         logger.info("🔧 Initializing LLM Orchestrator...")
         
-        for name, service in self.services.items():
-            is_available = await service.is_available()
+        await self.cache.connect()
+        
+        await self.health.probe_all()
+        for name in self.services:
+            is_available = await self.health.is_available(name)
             status = "✅" if is_available else "❌"
             logger.info(f"  {status} {name}: {'available' if is_available else 'unavailable'}")
+        
+        self.health.start()
+    
+    async def shutdown(self):
+        """Остановка фоновых задач"""
+        await self.health.stop()
+        await self.cache.close()
+        await self.services["openai"].close()
     
-    @retry(stop=stop_after_attempt(2), wait=wait_exponential(min=2, max=10))
-    async def ask(self, prompt: str, context: str = "") -> dict:
-        """Основной метод для запросов с автоматическим переключением"""
-        logger.info(f"📨 Запрос. Текущий провайдер: {self.current_provider}")
+    def _trace_cache(self, hit: bool):
+        """Попадание в кэш видно в отрезке агента: без вызова провайдера в трейсе"""
+        parent = current_span()
+        if parent is not None:
+            parent.set(response_cache="hit" if hit else "miss")
+    
+    def _cache_key(self, prompt: str, context: str, agent_type: str, model: str) -> str:
+        options = {"temperature": TEMPERATURE, "num_predict": MAX_TOKENS}
+        return self.cache.make_key(prompt, context, model, options, agent_type)
+    
+    def _route_model(self, routes: List[str]) -> str:
+        """Модель, которая ответит первой по маршруту: под ней ищем ответ в кэше"""
+        return self.services[routes[0] if routes else self.current_provider].model
+    
+    async def ask(self, prompt: str, context: str = "", agent_type: str = "simple") -> dict:
+        """Основной метод для запросов: кэш ответов перед провайдерами"""
+        routes = await self._route()
+        key = self._cache_key(prompt, context, agent_type, self._route_model(routes))
+        cached = await self.cache.get(key)
+        self._trace_cache(cached is not None)
+        if cached is not None:
+            logger.info(f"💾 Ответ из кэша ({agent_type})")
+            return cached
         
-        # Пробуем текущий провайдер
-        current_service = self.services[self.current_provider]
+        # Одинаковые конкурентные запросы делят одну генерацию
+        return await self.flights.do(key, lambda: self._ask_and_store(prompt, context, agent_type, routes))
+    
+    async def _ask_and_store(self, prompt: str, context: str, agent_type: str, routes: List[str]) -> dict:
+        result = await self._ask_provider(prompt, context, list(routes))
+        if "error" not in result:
+            # Ключ — по модели, которая реально ответила: ответ резервного провайдера не выдаётся за ответ основного
+            model = result.get("model") or self._route_model(routes)
+            await self.cache.set(self._cache_key(prompt, context, agent_type, model), result, agent_type)
+        return result
+    
+    async def _route(self) -> List[str]:
+        """
+        Провайдеры в порядке попыток: закреплённый вручную, затем по ожидаемому времени до первого токена.
+        Ещё не измеренные — после измеренных: их оценка по умолчанию не сравнима с реальной.
+        """
+        candidates = []
+        for name in self.services:
+            if self.breakers[name].can_route() and await self.health.is_available(name):
+                candidates.append(name)
+        # При равной оценке остаёмся на текущем провайдере
+        return sorted(candidates, key=lambda name: (
+            name != self.pinned_provider,
+            not self.breakers[name].measured(),
+            self.breakers[name].expected_latency_ms(),
+            name != self.current_provider,
+        ))
+    
+    def _record_failure(self, name: str, error: str):
+        logger.warning(f"⚠️ Ошибка {name}: {error}")
+        # Кончилась квота или нас ограничивают — сразу размыкаем, не дожидаясь серии ошибок
+        trip = any(keyword in error.lower() for keyword in ["quota", "429", "insufficient_quota"])
+        self.breakers[name].record_failure(error, trip=trip)
+        self.health.record_failure(name, error)
+    
+    def _record_success(self, name: str, ttft_ms: Optional[float]):
+        self.breakers[name].record_success(ttft_ms)
+        self.health.record_success(name)
+        if self.current_provider != name:
+            logger.info(f"🔄 Запросы обслуживает {name}")
+            self.current_provider = name
+    
+    async def _ask_provider(self, prompt: str, context: str = "", routes: Optional[List[str]] = None) -> dict:
+        """Запрос к лучшему провайдеру; при ошибке — к следующему, если позволяет бюджет повторов"""
+        self.retry_budget.record_request()
+        last_error = None
+        overloads: List[SchedulerOverloaded] = []
+        if routes is None:
+            routes = await self._route()
         
-        if await current_service.is_available():
-            result = await current_service.ask(prompt, context)
+        attempt = 0
+        while routes:
+            name = routes.pop(0)
+            if attempt and expired():
+                logger.warning("⏱️ Дедлайн запроса истёк, не переключаемся")
+                break
+            if attempt and not self.retry_budget.try_spend():
+                logger.warning("⛔ Бюджет повторов исчерпан, не переключаемся")
+                break
+            if not self.breakers[name].allow_request():
+                continue
+            attempt += 1
             
-            # Если успех от OpenAI - сбрасываем счетчик ошибок
-            if self.current_provider == "openai" and "error" not in result:
-                self.openai_errors_count = 0
-            
-            # Если ошибка - обрабатываем
-            if "error" in result:
-                return await self._handle_error(result, prompt, context)
-            
-            return result
-        else:
-            # Текущий провайдер недоступен, ищем альтернативу
-            return await self._switch_provider_and_retry(prompt, context)
+            logger.info(f"📨 Запрос к {name} (попытка {attempt})")
+            if HEDGE_ENABLED and routes:
+                result = await self._hedged(
+                    name, routes, False,
+                    lambda provider: self._call(provider, prompt, context),
+                    is_error=lambda result: "error" in result
+                )
+            else:
+                result = await self._call(name, prompt, context)
             
-    async def ask_stream(self, prompt: str, context: str = "") -> AsyncIterator[str]:
-        current_service = self.services[self.current_provider]
-        if await current_service.is_available():
-            async for chunk in current_service.ask_stream(prompt, context):  # ollama or openai stream
-                yield chunk
-        # Fallback logic similar
-        else:
-            # Текущий провайдер недоступен, ищем альтернативу
-            yield await self._switch_provider_and_retry(prompt, context)
-    
-    async def _handle_error(self, error_result: dict, prompt: str, context: str) -> dict:
-        """Обработка ошибок с автоматическим переключением"""
-        provider = error_result["provider"]
-        error_msg = error_result["error"]
+            if "error" not in result:
+                return result
+            if "overloaded" in result:
+                overloads.append(result.pop("overloaded"))
+            last_error = result
         
-        logger.warning(f"⚠️ Ошибка {provider}: {error_msg}")
-        
-        if provider == "openai":
-            return await self._handle_openai_error(error_msg, prompt, context)
-        elif provider == "ollama":
-            return await self._handle_ollama_error(error_msg, prompt, context)
+        # Очереди всех опробованных провайдеров полны — клиенту отказ с retry-after, а не ошибка
+        if overloads and len(overloads) == attempt:
+            raise overloads[-1]
+        return last_error or {"error": "Все LLM провайдеры недоступны", "provider": "none"}
+    
+    async def _call(self, name: str, prompt: str, context: str) -> dict:
+        """Один запрос к провайдеру; право на запрос у предохранителя уже получено"""
+        started = time.monotonic()
+        try:
+            result = await self.services[name].ask(prompt, context)
+        except SchedulerOverloaded as e:
+            # Очередь провайдера полна — не сбой: без вердикта предохранителю, пробуем следующего
+            self.breakers[name].release()
+            logger.warning(f"🚦 {e}")
+            return {"error": str(e), "provider": name, "overloaded": e}
+        except asyncio.CancelledError:
+            self.breakers[name].release()
+            raise
+        except Exception as e:
+            result = self.services[name]._format_error(str(e))
         
-        return error_result
+        if "error" in result and expired():
+            # Кончилось время клиента, а не терпение провайдера — вердикта нет
+            self.breakers[name].release()
+        elif "error" in result:
+            self._record_failure(name, result["error"])
+        else:
+            total_ms = (time.monotonic() - started) * 1000
+            self.latency[(name, False)].add(total_ms)
+            self._record_success(name, self._sync_ttft_ms(result, total_ms))
+        return result
+    
+    @staticmethod
+    def _sync_ttft_ms(result: dict, total_ms: float) -> Optional[float]:
+        """Время до первого токена у нестримингового ответа: всё, кроме генерации; без длительности генерации — неизвестно"""
+        eval_ms = result.get("usage", {}).get("eval_ms")
+        if eval_ms is None:
+            return None
+        return max(total_ms - eval_ms, 0.0)
+    
+    async def _hedged(self, primary: str, routes: List[str], stream: bool,
+                      start: Callable, is_error: Callable, discard: Optional[Callable] = None):
+        """
+        Запрос к основному провайдеру; если он не ответил за перцентиль своей недавней
+        задержки — тот же запрос следующему по маршруту. Побеждает первый успешный ответ,
+        проигравший отменяется.
+        """
+        tasks = {asyncio.create_task(start(primary)): primary}
+        try:
+            delay_ms = self.latency[(primary, stream)].hedge_delay_ms()
+            done, _ = await asyncio.wait(tasks, timeout=delay_ms / 1000 if delay_ms is not None else None)
+            if not done:
+                secondary = self._start_hedge(primary, routes, delay_ms)
+                if secondary is not None:
+                    tasks[asyncio.create_task(start(secondary))] = secondary
+            return await self._first_success(tasks, is_error, discard)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    def _start_hedge(self, primary: str, routes: List[str], delay_ms: float) -> Optional[str]:
+        secondary = routes[0]
+        if not self.breakers[secondary].allow_request():
+            return None
+        # Дубль — тоже повтор: без бюджета не умножаем нагрузку
+        if not self.retry_budget.try_spend():
+            self.breakers[secondary].release()
+            return None
+        routes.pop(0)
+        self.hedge_stats.inc(primary, "hedged")
+        self.hedge_stats.inc(secondary, "hedge_sent")
+        logger.info(f"🪞 {primary} молчит дольше {delay_ms:.0f} мс, дублируем запрос в {secondary}")
+        return secondary
     
-    async def _handle_openai_error(self, error: str, prompt: str, context: str) -> dict:
-        """Обработка ошибок OpenAI"""
-        self.openai_errors_count += 1
+    async def _first_success(self, tasks: Dict[asyncio.Task, str], is_error: Callable, discard: Optional[Callable]):
+        pending = set(tasks)
+        result = None
+        winner = None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Исключения разбираем последними: успешный ответ из той же пачки важнее
+            for task in sorted(done, key=lambda t: t.exception() is not None):
+                if task.exception() is not None:
+                    if pending or result is not None:
+                        continue
+                    raise task.exception()
+                value = task.result()
+                if winner is None and not is_error(value):
+                    winner, result = task, value
+                elif winner is None:
+                    result = value
+                elif discard is not None:
+                    await discard(value)
         
-        # Проверяем квоту
-        if any(keyword in str(error).lower() for keyword in ["quota", "429", "insufficient_quota"]):
-            self.services["openai"]._is_available = False
-            logger.error("💸 Закончилась квота OpenAI! Отключаем провайдер.")
+        if winner is not None and len(tasks) > 1:
+            for task, name in tasks.items():
+                self.hedge_stats.inc(name, "wins" if task is winner else "losses")
+        return result
+            
+    async def ask_stream(self, prompt: str, context: str = "", agent_type: str = "simple") -> AsyncIterator[str]:
+        routes = await self._route()
+        key = self._cache_key(prompt, context, agent_type, self._route_model(routes))
+        cached = await self.cache.get(key)
+        self._trace_cache(cached is not None)
+        if cached is not None:
+            logger.info(f"💾 Ответ из кэша ({agent_type}, stream)")
+            yield cached.get("answer", "")
+            return
         
-        # Переключаемся на Ollama при частых ошибках
-        if self.openai_errors_count >= self.MAX_OPENAI_ERRORS:
-            if await self.services["ollama"].is_available():
-                self.current_provider = "ollama"
-                logger.info("🔄 Переключились на Ollama из-за ошибок OpenAI")
-                return await self.services["ollama"].ask(prompt, context)
+        async for chunk in self.flights.stream(key, lambda: self._stream_and_store(prompt, context, agent_type, routes)):
+            yield chunk
+    
+    async def _stream_and_store(self, prompt: str, context: str, agent_type: str, routes: List[str]) -> AsyncIterator[str]:
+        served: Dict[str, str] = {}
+        pieces = []
+        failed = False
+        async for chunk in self._ask_stream_provider(prompt, context, list(routes), served):
+            if chunk.startswith("Ошибка:"):
+                failed = True
+            pieces.append(chunk)
+            yield chunk
         
-        return self.services["openai"]._format_error(error)
+        if not failed and pieces and served:
+            provider = served["provider"]
+            model = self.services[provider].model
+            await self.cache.set(self._cache_key(prompt, context, agent_type, model),
+                                 {"answer": "".join(pieces), "provider": provider, "model": model}, agent_type)
     
-    async def _handle_ollama_error(self, error: str, prompt: str, context: str) -> dict:
-        """Обработка ошибок Ollama"""
-        logger.error(f"❌ Ошибка Ollama: {error}")
+    async def _ask_stream_provider(self, prompt: str, context: str = "", routes: Optional[List[str]] = None,
+                                   served: Optional[Dict[str, str]] = None) -> AsyncIterator[str]:
+        """
+        Стрим от лучшего провайдера; переключение возможно, только пока ничего не отдано.
+        В served записывается провайдер, который дописал ответ до конца.
+        """
+        self.retry_budget.record_request()
+        last_error = None
+        overloads: List[SchedulerOverloaded] = []
+        if routes is None:
+            routes = await self._route()
         
-        # Пробуем вернуться к OpenAI
-        if await self.services["openai"].is_available():
-            self.current_provider = "openai"
-            logger.info("🔄 Пробуем вернуться к OpenAI...")
-            return await self.services["openai"].ask(prompt, context)
+        attempt = 0
+        while routes:
+            name = routes.pop(0)
+            if attempt and expired():
+                logger.warning("⏱️ Дедлайн запроса истёк, не переключаемся")
+                break
+            if attempt and not self.retry_budget.try_spend():
+                logger.warning("⛔ Бюджет повторов исчерпан, не переключаемся")
+                break
+            if not self.breakers[name].allow_request():
+                continue
+            attempt += 1
+            
+            if HEDGE_ENABLED and routes:
+                name, stream, first, ttft_ms = await self._hedged(
+                    name, routes, True,
+                    lambda provider: self._open_stream(provider, prompt, context),
+                    is_error=lambda opened: opened[1] is None,
+                    discard=self._discard_stream
+                )
+            else:
+                name, stream, first, ttft_ms = await self._open_stream(name, prompt, context)
+            if stream is None:
+                if isinstance(first, SchedulerOverloaded):
+                    overloads.append(first)
+                    first = f"Ошибка: {first}"
+                last_error = first
+                continue
+            
+            error = None
+            try:
+                if first:
+                    yield first
+                async for chunk in stream:
+                    if chunk.startswith("Ошибка:"):
+                        error = chunk
+                        break
+                    yield chunk
+            except (SchedulerOverloaded, asyncio.CancelledError, GeneratorExit):
+                self.breakers[name].release()
+                raise
+            finally:
+                await stream.aclose()
+            
+            if error is None:
+                self._record_success(name, ttft_ms)
+                if served is not None:
+                    served["provider"] = name
+                return
+            
+            self._record_failure(name, error)
+            # Часть ответа уже у пользователя — повторять поздно
+            yield error
+            return
         
-        return self.services["ollama"]._format_error(error)
+        if overloads and len(overloads) == attempt:
+            raise overloads[-1]
+        yield last_error or "Ошибка: Все LLM провайдеры недоступны"
     
-    async def _switch_provider_and_retry(self, prompt: str, context: str) -> dict:
-        """Переключение провайдера и повторная попытка"""
-        for provider_name, service in self.services.items():
-            if provider_name != self.current_provider and await service.is_available():
-                self.current_provider = provider_name
-                logger.info(f"🔄 Автоматическое переключение на {provider_name}")
-                return await service.ask(prompt, context)
+    async def _open_stream(self, name: str, prompt: str, context: str):
+        """
+        Открывает стрим и ждёт первый чанк: (провайдер, стрим или None при ошибке, первый чанк, мс до него).
+        Если очередь провайдера полна, вместо первого чанка — SchedulerOverloaded.
+        """
+        started = time.monotonic()
+        stream = self.services[name].ask_stream(prompt, context)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        except SchedulerOverloaded as e:
+            self.breakers[name].release()
+            await stream.aclose()
+            logger.warning(f"🚦 {e}")
+            return name, None, e, None
+        except BaseException:
+            self.breakers[name].release()
+            await stream.aclose()
+            raise
         
-        # Все провайдеры недоступны
-        return {"error": "Все LLM провайдеры недоступны", "provider": "none"}
+        if first.startswith("Ошибка:"):
+            self._record_failure(name, first)
+            await stream.aclose()
+            return name, None, first, None
+        ttft_ms = (time.monotonic() - started) * 1000
+        self.latency[(name, True)].add(ttft_ms)
+        return name, stream, first, ttft_ms
+    
+    async def _discard_stream(self, opened):
+        """Опоздавший участник гонки: закрываем без вердикта предохранителю"""
+        name, stream, _, _ = opened
+        self.breakers[name].release()
+        if stream is not None:
+            await stream.aclose()
     
     async def switch_provider(self, provider: str) -> bool:
         """Ручное переключение провайдера"""
-        if provider in self.services and await self.services[provider].is_available():
+        if provider in self.services and await self.health.is_available(provider):
             self.current_provider = provider
+            self.pinned_provider = provider
             logger.info(f"🔄 Ручное переключение на {provider}")
             return True
         return False
     
     async def health_check(self) -> dict:
-        """Проверка здоровья всех сервисов"""
+        """Проверка здоровья всех сервисов (из кэша фонового пробера)"""
         health_status = {}
         
-        for name, service in self.services.items():
-            is_healthy = await service.health_check()
-            health_status[name] = is_healthy
+        for name in self.services:
+            health_status[name] = await self.health.is_available(name)
         
         overall_health = any(health_status.values())
         
         return {
             "status": "healthy" if overall_health else "unhealthy",
             "current_provider": self.current_provider,
-            "services": health_status
+            "services": health_status,
+            "details": self.health.snapshot()
         }
     
     def get_status(self) -> dict:
         """Получение статуса системы"""
         return {
             "current_provider": self.current_provider,
-            "openai_errors_count": self.openai_errors_count,
-            "max_openai_errors": self.MAX_OPENAI_ERRORS,
+            "pinned_provider": self.pinned_provider,
+            "breakers": {name: breaker.to_dict() for name, breaker in self.breakers.items()},
+            "retry_budget": self.retry_budget.to_dict(),
+            "hedging": {
+                "enabled": HEDGE_ENABLED,
+                "percentile": HEDGE_PERCENTILE,
+                "providers": self.hedge_stats.to_dict(),
+            },
+            "cache": self.cache.stats(),
+            "coalescing": self.flights.stats(),
+            "scheduler": llm_scheduler.stats(),
+            "prompt_eval": prompt_eval_stats(),
+            "openai_usage": self.services["openai"].usage,
             "models": {
                 "openai": self.services["openai"].model,
                 "ollama": self.services["ollama"].model
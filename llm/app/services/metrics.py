@@ -0,0 +1,76 @@
+# llm/services/metrics.py
+from typing import Callable, Dict
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Бакеты под LLM: от быстрых ответов из кэша до долгих генераций на CPU
+LLM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+ROUTING_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 250)
+
+ROUTING_SECONDS = Histogram(
+    "nutrition_routing_seconds", "Классификация запроса по агентам",
+    buckets=ROUTING_BUCKETS,
+)
+AGENT_SECONDS = Histogram(
+    "nutrition_agent_seconds", "Обработка запроса агентом целиком",
+    ["agent", "mode", "status"], buckets=LLM_BUCKETS,
+)
+PLAN_STEP_SECONDS = Histogram(
+    "nutrition_plan_step_seconds", "Шаги PlanningAgent",
+    ["model", "status"], buckets=LLM_BUCKETS,
+)
+LLM_CALL_SECONDS = Histogram(
+    "nutrition_llm_call_seconds", "Вызов провайдера LLM, включая ожидание в очереди",
+    ["provider", "model", "mode", "outcome"], buckets=LLM_BUCKETS,
+)
+LLM_TTFT_SECONDS = Histogram(
+    "nutrition_llm_time_to_first_token_seconds", "Время до первого токена потокового ответа",
+    ["provider", "model"], buckets=LLM_BUCKETS,
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "nutrition_llm_tokens_per_second", "Скорость генерации по eval_count/eval_duration Ollama",
+    ["provider", "model"], buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "nutrition_llm_tokens", "Токены промпта и ответа",
+    ["provider", "model", "kind"],
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "nutrition_queue_wait_seconds", "Ожидание слота генерации в планировщике",
+    ["model", "priority"], buckets=LLM_BUCKETS,
+)
+
+def observe_generation(provider: str, model: str, prompt_tokens: int, completion_tokens: int, eval_seconds: float = 0.0):
+    """Токены одного ответа; скорость — только если провайдер сообщил время генерации"""
+    LLM_TOKENS.labels(provider, model, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(provider, model, "completion").inc(completion_tokens)
+    if eval_seconds > 0 and completion_tokens:
+        LLM_TOKENS_PER_SECOND.labels(provider, model).observe(completion_tokens / eval_seconds)
+
+class CacheStatsCollector:
+    """
+    Хиты кэшей читаются из их собственных счётчиков в момент scrape —
+    на горячем пути метрики кэшей ничего не стоят.
+    """
+
+    def __init__(self, sources: Dict[str, Callable[[], dict]]):
+        self.sources = sources
+
+    def collect(self):
+        requests = CounterMetricFamily(
+            "nutrition_cache_requests", "Обращения к кэшам с момента старта", labels=["cache", "result"]
+        )
+        ratio = GaugeMetricFamily("nutrition_cache_hit_ratio", "Доля попаданий в кэш", labels=["cache"])
+        for cache, stats in self.sources.items():
+            data = stats()
+            hits = data.get("hits", 0) + data.get("redis_hits", 0)
+            misses = data.get("misses", 0)
+            requests.add_metric([cache, "hit"], hits)
+            requests.add_metric([cache, "miss"], misses)
+            ratio.add_metric([cache], hits / (hits + misses) if hits + misses else 0.0)
+        yield requests
+        yield ratio
+
+def register_cache_stats(sources: Dict[str, Callable[[], dict]]):
+    REGISTRY.register(CacheStatsCollector(sources))
@@ -4,117 +4,255 @@ import asyncio
 import aiohttp
 import json
 import logging
-from typing import AsyncIterator
+import time
+from typing import AsyncIterator, Dict, List, Optional
 from .llm_service import BaseLLMService
-from config import SYSTEM_PROMPT, TEMPERATURE, MAX_TOKENS
+from .http_pool import ollama_pool
+from .scheduler import llm_scheduler, SchedulerOverloaded
+from .chat_messages import flat_messages, session_messages
+from .deadline import budget
+from .metrics import LLM_CALL_SECONDS, LLM_TTFT_SECONDS, observe_generation
+from .tracing import start_span, finish_span
+from config import (
+    OLLAMA_TIMEOUT,
+    TEMPERATURE,
+    MAX_TOKENS,
+    OLLAMA_HEALTH_TIMEOUT,
+    OLLAMA_PULL_TIMEOUT,
+    OLLAMA_READ_TIMEOUT,
+    OLLAMA_SESSION_MODE,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_KEEP_ALIVE_MODELS,
+    OLLAMA_NUM_CTX,
+    OLLAMA_NUM_CTX_MODELS,
+    OLLAMA_NUM_THREAD,
+    OLLAMA_NUM_THREAD_MODELS,
+)
 
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 
+# Сколько токенов промпта Ollama реально пересчитала — по моделям, для проверки переиспользования префикса
+_prompt_eval_stats: Dict[str, dict] = {}
+
+def prompt_eval_stats() -> Dict[str, dict]:
+    return {
+        model: {
+            **stats,
+            "avg_prompt_eval_count": round(stats["prompt_eval_count"] / stats["requests"], 1),
+            "avg_prompt_eval_ms": round(stats["prompt_eval_ms"] / stats["requests"], 1),
+        }
+        for model, stats in _prompt_eval_stats.items()
+        if stats["requests"]
+    }
+
+def _keep_alive_value(value: str):
+    # Ollama принимает длительность строкой ("30m") или число секунд (-1 — не выгружать)
+    return int(value) if value.lstrip("-").isdigit() else value
+
 class OllamaService(BaseLLMService):
     """Асинхронный сервис для работы с Ollama"""
     
-    def __init__(self, model: str = None):
+    def __init__(self, model: str = None, host: str = None):
         self.model = model or os.getenv("OLLAMA_MODEL", "qwen2.5:1.5b")
+        self.host = host or OLLAMA_HOST
         self._is_available = False
         self.logger = logging.getLogger("nutrition-llm")
-        self._buffer = ""
     
-    async def ask(self, prompt: str, context: str = "") -> dict:
-        self.logger.info(f"⚙️ Отправляем запрос к Ollama ({self.model}) через aiohttp")
+    def _payload(self, prompt: str, context: str, stream: bool) -> dict:
+        options = {
+            "temperature": TEMPERATURE,
+            "num_predict": MAX_TOKENS,
+            "num_ctx": OLLAMA_NUM_CTX_MODELS.get(self.model, OLLAMA_NUM_CTX),
+        }
+        num_thread = OLLAMA_NUM_THREAD_MODELS.get(self.model, OLLAMA_NUM_THREAD)
+        if num_thread > 0:
+            options["num_thread"] = num_thread
         
-        url = f"{OLLAMA_HOST}/api/chat"
-        payload = {
+        build = session_messages if OLLAMA_SESSION_MODE else flat_messages
+        return {
             "model": self.model,
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},  # Здесь остаётся
-                {"role": "user", "content": f"Контекст: {context}\n\nВопрос: {prompt}"},
-            ],
-            "options": {
-                "temperature": TEMPERATURE,
-                "num_predict": MAX_TOKENS
-            },
-            "stream": False  # for non-stream
+            "messages": build(prompt, context),
+            "options": options,
+            "keep_alive": _keep_alive_value(OLLAMA_KEEP_ALIVE_MODELS.get(self.model, OLLAMA_KEEP_ALIVE)),
+            "stream": stream,
         }
+    
+    def _record_usage(self, data: dict) -> dict:
+        """Счётчики из финального ответа Ollama; малый prompt_eval_count на длинной истории — префикс взят из кэша"""
+        usage = {
+            "prompt_eval_count": data.get("prompt_eval_count", 0),
+            "prompt_eval_ms": round(data.get("prompt_eval_duration", 0) / 1e6, 1),
+            "eval_count": data.get("eval_count", 0),
+            "eval_ms": round(data.get("eval_duration", 0) / 1e6, 1),
+        }
+        stats = _prompt_eval_stats.setdefault(
+            self.model, {"requests": 0, "prompt_eval_count": 0, "prompt_eval_ms": 0.0, "last": {}}
+        )
+        stats["requests"] += 1
+        stats["prompt_eval_count"] += usage["prompt_eval_count"]
+        stats["prompt_eval_ms"] += usage["prompt_eval_ms"]
+        stats["last"] = usage
+        observe_generation("ollama", self.model, usage["prompt_eval_count"], usage["eval_count"],
+                           data.get("eval_duration", 0) / 1e9)
+        self.logger.info(
+            f"🧠 {self.model}: prompt_eval {usage['prompt_eval_count']} ток. за {usage['prompt_eval_ms']} мс, "
+            f"генерация {usage['eval_count']} ток. за {usage['eval_ms']} мс"
+        )
+        return usage
+    
+    async def ask(self, prompt: str, context: str = "", timeout: Optional[float] = None) -> dict:
+        """timeout — бюджет в секундах на весь вызов, включая ожидание слота в очереди; не дольше дедлайна запроса"""
+        timeout = budget(timeout if timeout is not None else OLLAMA_TIMEOUT)
+        self.logger.info(f"⚙️ Отправляем запрос к Ollama ({self.model}) через aiohttp")
+        
+        url = f"{self.host}/api/chat"
+        payload = self._payload(prompt, context, stream=False)
         
         text_accum = ""
+        started = time.monotonic()
+        outcome = "cancelled"
+        call_span, token = start_span("llm.call", provider="ollama", model=self.model, mode="sync")
         try:
-            async with aiohttp.ClientSession() as session:
-                timeout = aiohttp.ClientTimeout(total=300)
-                async with session.post(url, json=payload, timeout=timeout) as resp:
-                    if resp.status != 200:
-                        error_text = await resp.text()
-                        self.logger.error(f"Ошибка HTTP {resp.status}: {error_text}")
-                        return self._format_error(f"HTTP {resp.status}: {error_text}")
-                    
-                    response_data = await resp.json()
-                    text_accum = response_data.get("message", {}).get("content", "")
-                    self.logger.info(f"✅ Получен ответ длиной {len(text_accum)} символов")
-                    return self._format_response(text_accum, self.model)
+            session = ollama_pool.get_session(self.host)
+            async with asyncio.timeout(timeout):
+                async with llm_scheduler.slot(self.model) as waited:
+                    call_span.set(queue_wait_ms=round(waited * 1000, 1))
+                    async with session.post(url, json=payload) as resp:
+                        if resp.status != 200:
+                            outcome = "error"
+                            error_text = await resp.text()
+                            self.logger.error(f"Ошибка HTTP {resp.status}: {error_text}")
+                            return self._format_error(f"HTTP {resp.status}: {error_text}")
+                        
+                        response_data = await resp.json()
+                        text_accum = response_data.get("message", {}).get("content", "")
+                        self.logger.info(f"✅ Получен ответ длиной {len(text_accum)} символов")
+                        result = self._format_response(text_accum, self.model)
+                        result["usage"] = self._record_usage(response_data)
+                        call_span.set(**result["usage"])
+                        outcome = "success"
+                        return result
+        except SchedulerOverloaded:
+            outcome = "overloaded"
+            raise
+        except TimeoutError:
+            outcome = "timeout"
+            self.logger.warning(f"⏱️ {self.model}: запрос не уложился в {timeout:.1f} с")
+            return self._format_error(f"timeout after {timeout:.1f}s")
         except Exception as e:
+            outcome = "error"
             self.logger.exception(f"Неожиданная ошибка: {e}")
             return self._format_error(str(e))
+        finally:
+            LLM_CALL_SECONDS.labels("ollama", self.model, "sync", outcome).observe(time.monotonic() - started)
+            call_span.set(outcome=outcome)
+            finish_span(call_span, token)
     
     async def ask_stream(self, prompt: str, context: str = "") -> AsyncIterator[str]:
-        url = f"{OLLAMA_HOST}/api/chat"
-        payload = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},  # Здесь остаётся
-                {"role": "user", "content": f"Контекст: {context}\n\nВопрос: {prompt}"},
-            ],
-            "options": {
-                "temperature": TEMPERATURE,
-                "num_predict": MAX_TOKENS
-            },
-            "stream": True
-        }
-        text_accum = ""
+        url = f"{self.host}/api/chat"
+        payload = self._payload(prompt, context, stream=True)
+        buffer = ""
+        started = time.monotonic()
+        first_token = True
+        outcome = "cancelled"
+        call_span, token = start_span("llm.call", provider="ollama", model=self.model, mode="stream")
         try:
-            async with aiohttp.ClientSession() as session:
-                timeout = aiohttp.ClientTimeout(total=300)
-                async with session.post(url, json=payload, timeout=timeout) as resp:
+            session = ollama_pool.get_session(self.host)
+            async with llm_scheduler.slot(self.model) as waited:
+                call_span.set(queue_wait_ms=round(waited * 1000, 1))
+                async with session.post(url, json=payload) as resp:
+                    if resp.status != 200:
+                        outcome = "error"
+                        error_text = await resp.text()
+                        self.logger.error(f"Ошибка HTTP {resp.status}: {error_text}")
+                        yield f"Ошибка: {self._format_error(f'HTTP {resp.status}: {error_text}')}"
+                        return
+                    
                     async for chunk_bytes in resp.content.iter_any():
                         chunk_text = chunk_bytes.decode('utf-8')
-                        self._buffer += chunk_text
-                        while '\n' in self._buffer:
-                            line, self._buffer = self._buffer.split('\n', 1)
+                        buffer += chunk_text
+                        while '\n' in buffer:
+                            line, buffer = buffer.split('\n', 1)
                             if not line.strip(): continue
                             try:
                                 chunk_data = json.loads(line)
                                 if "message" in chunk_data and "content" in chunk_data["message"]:
                                     piece = chunk_data["message"]["content"]
+                                    if first_token and piece:
+                                        first_token = False
+                                        ttft = time.monotonic() - started
+                                        LLM_TTFT_SECONDS.labels("ollama", self.model).observe(ttft)
+                                        call_span.set(ttft_ms=round(ttft * 1000, 1))
                                     yield piece
-                                    text_accum += piece
                                 if chunk_data.get("done", False):
-                                    self._last_full_response = text_accum
+                                    call_span.set(**self._record_usage(chunk_data))
+                                    outcome = "success"
                                     return
                             except json.JSONDecodeError as e:
                                 self.logger.warning(f"Не удалось распарсить JSON: {line}, ошибка: {e}")
                                 continue
+        except SchedulerOverloaded:
+            outcome = "overloaded"
+            raise
         except Exception as e:
+            outcome = "error"
             self.logger.exception(f"Неожиданная ошибка: {e}")
             err = self._format_error(str(e))
             yield f"Ошибка: {err}"
+        finally:
+            LLM_CALL_SECONDS.labels("ollama", self.model, "stream", outcome).observe(time.monotonic() - started)
+            call_span.set(outcome=outcome)
+            finish_span(call_span, token)
              
-    def get_last_full_response(self) -> str:
-        return getattr(self, '_last_full_response', '')
+    async def list_models(self) -> List[str]:
+        """Установленные в Ollama модели; исключение, если Ollama не отвечает"""
+        session = ollama_pool.get_session(self.host)
+        timeout = aiohttp.ClientTimeout(total=OLLAMA_HEALTH_TIMEOUT)
+        async with session.get(f"{self.host}/api/tags", timeout=timeout) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        return [model.get("name", "") for model in data.get("models", [])]
+    
+    async def pull_model(self):
+        """Скачивание модели; ждём окончания загрузки"""
+        self.logger.info(f"⬇️ Загружаем модель {self.model}...")
+        session = ollama_pool.get_session(self.host)
+        timeout = aiohttp.ClientTimeout(total=OLLAMA_PULL_TIMEOUT)
+        async with session.post(f"{self.host}/api/pull", json={"name": self.model, "stream": False}, timeout=timeout) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"pull {self.model}: HTTP {resp.status}: {await resp.text()}")
+        self.logger.info(f"✅ Модель {self.model} загружена")
+    
+    async def preload(self):
+        """Загрузка модели в память: пустой generate без генерации, с тем же keep_alive"""
+        session = ollama_pool.get_session(self.host)
+        timeout = aiohttp.ClientTimeout(total=OLLAMA_READ_TIMEOUT)
+        payload = {
+            "model": self.model,
+            "keep_alive": _keep_alive_value(OLLAMA_KEEP_ALIVE_MODELS.get(self.model, OLLAMA_KEEP_ALIVE)),
+        }
+        async with session.post(f"{self.host}/api/generate", json=payload, timeout=timeout) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"preload {self.model}: HTTP {resp.status}: {await resp.text()}")
+            await resp.read()
     
     async def health_check(self) -> bool:
         """Проверка здоровья Ollama"""
-        url = f"{OLLAMA_HOST}/api/tags"
-        self.logger.info(f"Проверка доступности Ollama...")
+        url = f"{self.host}/api/tags"
+        self.logger.debug(f"Проверка доступности Ollama...")
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                    if resp.status == 200:
-                        self._is_available = True
-                        self.logger.info(f"✅ Ollama доступен")
-                        return True
-                    else:
-                        self.logger.warning(f"❌ Ollama недоступен, статус: {resp.status}")
-                        self._is_available = False
-                        return False
+            session = ollama_pool.get_session(self.host)
+            timeout = aiohttp.ClientTimeout(total=OLLAMA_HEALTH_TIMEOUT)
+            async with session.get(url, timeout=timeout) as resp:
+                if resp.status == 200:
+                    self._is_available = True
+                    self.logger.debug(f"✅ Ollama доступен")
+                    return True
+                else:
+                    self.logger.warning(f"❌ Ollama недоступен, статус: {resp.status}")
+                    self._is_available = False
+                    return False
         except Exception as e:
             self.logger.warning(f"❌ Ollama недоступен: {e}")
             self._is_available = False
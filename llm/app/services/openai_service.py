@@ -1,47 +1,211 @@
+import asyncio
 import httpx
-import os
+import json
 import logging
+import time
+from typing import AsyncIterator, Optional
 from .llm_service import BaseLLMService
+from .chat_messages import session_messages
+from .deadline import budget
+from .metrics import LLM_CALL_SECONDS, LLM_TTFT_SECONDS, observe_generation
+from .tracing import start_span, finish_span
+from config import (
+    OPENAI_MODEL,
+    OPENAI_BASE_URL,
+    OPENAI_API_KEY,
+    OPENAI_HTTP2,
+    OPENAI_POOL_SIZE,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_TIMEOUT,
+    TEMPERATURE,
+    MAX_TOKENS,
+    HEALTH_PROBE_TIMEOUT,
+)
 
-INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
+try:
+    import h2  # noqa: F401  HTTP/2 для httpx
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+# Reasoning-модели OpenAI не принимают temperature и max_tokens
+_REASONING_PREFIXES = ("gpt-5", "o1", "o3", "o4")
 
 class OpenAIService(BaseLLMService):
-    """Сервис для работы с OpenAI API"""
+    """Сервис для OpenAI-совместимого Chat Completions API"""
     
-    def __init__(self):
-        self.client = os.getenv("OPEN_AI_HOST")
-        self._is_available = True
-        self.headers = {"X-API-Key": INTERNAL_API_KEY, "Content-Type": "application/json"}
+    def __init__(self, model: str = None, base_url: str = None, api_key: str = None):
+        self.model = model or OPENAI_MODEL
+        self.base_url = (base_url or OPENAI_BASE_URL).rstrip("/")
+        self.api_key = api_key if api_key is not None else OPENAI_API_KEY
+        self._is_available = False
+        self._client: Optional[httpx.AsyncClient] = None
+        self.usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
         self.logger = logging.getLogger("nutrition-llm")
     
+    @property
+    def configured(self) -> bool:
+        return bool(self.base_url)
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Один клиент с пулом соединений на процесс; HTTP/2 мультиплексирует запросы в одном соединении"""
+        if self._client is None or self._client.is_closed:
+            http2 = OPENAI_HTTP2 and _HTTP2_AVAILABLE
+            if OPENAI_HTTP2 and not _HTTP2_AVAILABLE:
+                self.logger.warning("⚠️ OPENAI_HTTP2 включен, но пакет h2 не установлен — используем HTTP/1.1")
+            headers = {"Content-Type": "application/json"}
+            if self.api_key:
+                headers["Authorization"] = f"Bearer {self.api_key}"
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                http2=http2,
+                limits=httpx.Limits(max_connections=OPENAI_POOL_SIZE, max_keepalive_connections=OPENAI_POOL_SIZE),
+                timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            )
+            self.logger.info(f"🔌 Открыт пул соединений к {self.base_url} (HTTP/{'2' if http2 else '1.1'})")
+        return self._client
+    
+    async def close(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            self.logger.info(f"🔌 Закрыт пул соединений к {self.base_url}")
+        self._client = None
+    
+    def _payload(self, prompt: str, context: str, stream: bool) -> dict:
+        payload = {
+            "model": self.model,
+            "messages": session_messages(prompt, context),
+            "stream": stream,
+        }
+        if self.model.startswith(_REASONING_PREFIXES):
+            payload["max_completion_tokens"] = MAX_TOKENS
+        else:
+            payload["temperature"] = TEMPERATURE
+            payload["max_tokens"] = MAX_TOKENS
+        if stream:
+            # Последний чанк стрима придёт с usage
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+    
+    def _record_usage(self, usage: Optional[dict]) -> dict:
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens", 0) or 0
+        completion_tokens = usage.get("completion_tokens", 0) or 0
+        self.usage["requests"] += 1
+        self.usage["prompt_tokens"] += prompt_tokens
+        self.usage["completion_tokens"] += completion_tokens
+        self.logger.info(f"🧾 {self.model}: {prompt_tokens} ток. промпта, {completion_tokens} ток. ответа")
+        observe_generation("openai", self.model, prompt_tokens, completion_tokens)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+    
     async def ask(self, prompt: str, context: str = "") -> dict:
         """Запрос к OpenAI"""
+        if not self.configured:
+            return self._format_error("OPENAI_BASE_URL не задан")
+        
+        # Таймауты httpx — на каждую операцию чтения, общий лимит вызова держим сами
+        timeout = budget(OPENAI_TIMEOUT)
+        started = time.monotonic()
+        outcome = "cancelled"
+        call_span, token = start_span("llm.call", provider="openai", model=self.model, mode="sync")
         try:
+            async with asyncio.timeout(timeout):
+                resp = await self._get_client().post("/chat/completions", json=self._payload(prompt, context, stream=False))
+            if resp.status_code != 200:
+                outcome = "error"
+                self.logger.error(f"Ошибка HTTP {resp.status_code}: {resp.text}")
+                return self._format_error(f"HTTP {resp.status_code}: {resp.text}")
             
-            async with httpx.AsyncClient(timeout=60) as client:
-                resp = await client.post(
-                    f"{LLM_URL}/ask",
-                    json={"prompt": prompt, "context": context},
-                    headers=self.headers
-                )
-                
-                resp.raise_for_status()
+            data = resp.json()
+            answer = data["choices"][0]["message"].get("content") or ""
+            result = self._format_response(answer, data.get("model", self.model))
+            result["usage"] = self._record_usage(data.get("usage"))
+            call_span.set(**result["usage"])
+            outcome = "success"
+            return result
+        except TimeoutError:
+            outcome = "timeout"
+            self.logger.warning(f"⏱️ {self.model}: запрос не уложился в {timeout:.1f} с")
+            return self._format_error(f"timeout after {timeout:.1f}s")
+        except Exception as e:
+            outcome = "error"
+            self.logger.exception(f"Неожиданная ошибка: {e}")
+            return self._format_error(str(e) or e.__class__.__name__)
+        finally:
+            LLM_CALL_SECONDS.labels("openai", self.model, "sync", outcome).observe(time.monotonic() - started)
+            call_span.set(outcome=outcome)
+            finish_span(call_span, token)
+    
+    async def ask_stream(self, prompt: str, context: str = "") -> AsyncIterator[str]:
+        """Потоковый ответ: SSE-чанки Chat Completions"""
+        if not self.configured:
+            yield f"Ошибка: {self._format_error('OPENAI_BASE_URL не задан')}"
+            return
+        
+        usage = None
+        started = time.monotonic()
+        first_token = True
+        outcome = "cancelled"
+        call_span, token = start_span("llm.call", provider="openai", model=self.model, mode="stream")
+        try:
+            payload = self._payload(prompt, context, stream=True)
+            async with self._get_client().stream("POST", "/chat/completions", json=payload) as resp:
+                if resp.status_code != 200:
+                    outcome = "error"
+                    error_text = (await resp.aread()).decode("utf-8", "replace")
+                    self.logger.error(f"Ошибка HTTP {resp.status_code}: {error_text}")
+                    yield f"Ошибка: {self._format_error(f'HTTP {resp.status_code}: {error_text}')}"
+                    return
                 
-                return resp
-            
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except json.JSONDecodeError as e:
+                        self.logger.warning(f"Не удалось распарсить JSON: {data}, ошибка: {e}")
+                        continue
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                    for choice in chunk.get("choices") or []:
+                        piece = (choice.get("delta") or {}).get("content")
+                        if piece:
+                            if first_token:
+                                first_token = False
+                                ttft = time.monotonic() - started
+                                LLM_TTFT_SECONDS.labels("openai", self.model).observe(ttft)
+                                call_span.set(ttft_ms=round(ttft * 1000, 1))
+                            yield piece
+            call_span.set(**self._record_usage(usage))
+            outcome = "success"
         except Exception as e:
-            # Проверяем квоту
-            if any(keyword in str(e).lower() for keyword in ["quota", "429", "insufficient_quota"]):
-                self._is_available = False
-            
-            self.logger.exception(e)
-            
-            return self._format_error(str(e))
+            outcome = "error"
+            self.logger.exception(f"Неожиданная ошибка: {e}")
+            yield f"Ошибка: {self._format_error(str(e) or e.__class__.__name__)}"
+        finally:
+            LLM_CALL_SECONDS.labels("openai", self.model, "stream", outcome).observe(time.monotonic() - started)
+            call_span.set(outcome=outcome)
+            finish_span(call_span, token)
     
     async def is_available(self) -> bool:
         """Проверка доступности OpenAI"""
-        return self._is_available
+        return await self.health_check()
     
     async def health_check(self) -> bool:
-        """Проверка здоровья OpenAI"""
-        return true
\ No newline at end of file
+        """Проверка здоровья OpenAI: список моделей отвечает"""
+        if not self.configured:
+            self._is_available = False
+            return False
+        try:
+            resp = await self._get_client().get("/models", timeout=HEALTH_PROBE_TIMEOUT)
+            self._is_available = resp.status_code == 200
+            if not self._is_available:
+                self.logger.warning(f"❌ OpenAI недоступен, статус: {resp.status_code}")
+        except Exception as e:
+            self.logger.warning(f"❌ OpenAI недоступен: {e}")
+            self._is_available = False
+        return self._is_available
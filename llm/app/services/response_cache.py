@@ -0,0 +1,135 @@
+# llm/services/response_cache.py
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_DEFAULT_TTL,
+    RESPONSE_CACHE_TTLS,
+    RESPONSE_CACHE_REDIS_URL,
+)
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis-уровень опционален
+    aioredis = None
+
+logger = logging.getLogger("nutrition-llm")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для ключа кэша: регистр и пробелы не влияют на попадание"""
+    return _WHITESPACE_RE.sub(" ", (text or "").strip().lower())
+
+class ResponseCache:
+    """
+    Кэш ответов LLM: in-process LRU с TTL и опциональный общий уровень в Redis.
+    Ключ — нормализованный промпт, контекст, модель и параметры сэмплирования.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, enabled: bool = RESPONSE_CACHE_ENABLED):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._redis = None
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def connect(self):
+        """Подключение Redis-уровня, если он настроен"""
+        if not (self.enabled and RESPONSE_CACHE_REDIS_URL):
+            return
+        if aioredis is None:
+            logger.warning("⚠️ RESPONSE_CACHE_REDIS_URL задан, но пакет redis не установлен")
+            return
+        self._redis = aioredis.Redis.from_url(RESPONSE_CACHE_REDIS_URL)
+        logger.info("🗄️ Redis-уровень кэша ответов подключен")
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    @staticmethod
+    def ttl_for(agent_type: str) -> int:
+        return RESPONSE_CACHE_TTLS.get(agent_type, RESPONSE_CACHE_DEFAULT_TTL)
+
+    @staticmethod
+    def make_key(prompt: str, context: str, model: str, options: dict, agent_type: str = "simple") -> str:
+        raw = json.dumps(
+            [normalize_text(prompt), normalize_text(context), model, options],
+            ensure_ascii=False, sort_keys=True
+        )
+        return f"llm:resp:{agent_type}:{hashlib.sha256(raw.encode()).hexdigest()}"
+
+    async def get(self, key: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(value, cached=True)
+            del self._entries[key]
+
+        if self._redis is not None:
+            try:
+                raw = await self._redis.get(key)
+                ttl = await self._redis.ttl(key) if raw is not None else -2
+            except Exception as e:
+                logger.warning(f"⚠️ Redis-кэш недоступен: {e}")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._put(key, value, ttl if ttl > 0 else RESPONSE_CACHE_DEFAULT_TTL)
+                self.redis_hits += 1
+                return dict(value, cached=True)
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: dict, agent_type: str = "simple"):
+        if not self.enabled:
+            return
+        ttl = self.ttl_for(agent_type)
+        if ttl <= 0:
+            return
+        self._put(key, value, ttl)
+
+        if self._redis is not None:
+            try:
+                await self._redis.set(key, json.dumps(value, ensure_ascii=False), ex=ttl)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось записать в Redis-кэш: {e}")
+
+    def _put(self, key: str, value: dict, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, object]:
+        total = self.hits + self.redis_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "redis": self._redis is not None,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.redis_hits) / total, 3) if total else 0.0,
+        }
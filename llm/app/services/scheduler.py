@@ -0,0 +1,181 @@
+# llm/services/scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from .metrics import QUEUE_WAIT_SECONDS
+from config import (
+    OLLAMA_NUM_PARALLEL,
+    SCHEDULER_MODEL_LIMITS,
+    SCHEDULER_MAX_QUEUE,
+    SCHEDULER_QUEUE_TIMEOUT,
+)
+
+logger = logging.getLogger("nutrition-llm")
+
+# Классы приоритета: меньше — важнее
+PRIORITY_INTERACTIVE = 0   # простые ответы пользователю
+PRIORITY_STANDARD = 1      # nutrition, план и финальный отчет planning
+PRIORITY_BACKGROUND = 2    # подшаги planning
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_STANDARD: "standard",
+    PRIORITY_BACKGROUND: "background",
+}
+
+# Приоритет текущего запроса; выставляется агентами и наследуется дочерними задачами
+request_priority: ContextVar[int] = ContextVar("request_priority", default=PRIORITY_STANDARD)
+
+SERVICE_TIME_EWMA_ALPHA = 0.2
+
+class SchedulerOverloaded(Exception):
+    """Очередь к модели переполнена или ожидание слота превысило лимит"""
+
+    def __init__(self, model: str, retry_after: int, status_code: int = 429, reason: str = "queue full"):
+        super().__init__(f"LLM scheduler overloaded for {model}: {reason}")
+        self.model = model
+        self.retry_after = retry_after
+        self.status_code = status_code
+        self.reason = reason
+
+class _ModelQueue:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.avg_service_s = 5.0
+        self.rejected = 0
+        self.served = 0
+
+    def pending(self) -> int:
+        return sum(1 for _, _, fut in self.waiters if not fut.done())
+
+class LLMScheduler:
+    """
+    Допуск запросов к моделям Ollama: не больше `limit` параллельных генераций на модель,
+    ограниченная очередь ожидания с приоритетами и отказ с retry-after при переполнении.
+    """
+
+    def __init__(self, default_limit: int = OLLAMA_NUM_PARALLEL, max_queue: int = SCHEDULER_MAX_QUEUE,
+                 queue_timeout: float = SCHEDULER_QUEUE_TIMEOUT):
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._seq = itertools.count()
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = _ModelQueue(SCHEDULER_MODEL_LIMITS.get(model, self.default_limit))
+            self._queues[model] = queue
+        return queue
+
+    def _retry_after(self, queue: _ModelQueue) -> int:
+        return max(1, math.ceil(queue.avg_service_s * (queue.pending() + 1) / queue.limit))
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: Optional[int] = None):
+        """Занять слот генерации для модели на время блока"""
+        if priority is None:
+            priority = request_priority.get()
+        started = time.monotonic()
+        await self.acquire(model, priority)
+        acquired = time.monotonic()
+        QUEUE_WAIT_SECONDS.labels(model, PRIORITY_NAMES.get(priority, str(priority))).observe(acquired - started)
+        try:
+            yield acquired - started
+        finally:
+            self.release(model, time.monotonic() - acquired)
+
+    async def acquire(self, model: str, priority: Optional[int] = None):
+        if priority is None:
+            priority = request_priority.get()
+        queue = self._queue(model)
+
+        if queue.active < queue.limit and not queue.pending():
+            queue.active += 1
+            return
+
+        if queue.pending() >= self.max_queue:
+            self._make_room(model, queue, priority)
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), fut)
+        heapq.heappush(queue.waiters, entry)
+
+        try:
+            await asyncio.wait_for(fut, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(queue, entry)
+            # release() мог передать слот в той же итерации цикла, где истёк таймаут: слот уже наш
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                return
+            queue.rejected += 1
+            raise SchedulerOverloaded(model, self._retry_after(queue), status_code=503, reason="queue timeout")
+        except asyncio.CancelledError:
+            self._discard(queue, entry)
+            # Слот уже был передан нам, но вызывающий ушёл — возвращаем его
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self.release(model)
+            raise
+
+    def _make_room(self, model: str, queue: _ModelQueue, priority: int):
+        """Полная очередь: вытесняем наименее важного ожидающего, если новый запрос важнее"""
+        worst = max((w for w in queue.waiters if not w[2].done()), default=None)
+        if worst is not None and worst[0] > priority:
+            self._discard(queue, worst)
+            queue.rejected += 1
+            worst[2].set_exception(SchedulerOverloaded(model, self._retry_after(queue), reason="preempted"))
+            logger.warning(f"⏏️ {model}: запрос с приоритетом {PRIORITY_NAMES.get(worst[0])} вытеснен из очереди")
+            return
+        queue.rejected += 1
+        logger.warning(f"🚦 {model}: очередь переполнена ({self.max_queue}), запрос отклонён")
+        raise SchedulerOverloaded(model, self._retry_after(queue))
+
+    def _discard(self, queue: _ModelQueue, entry):
+        try:
+            queue.waiters.remove(entry)
+            heapq.heapify(queue.waiters)
+        except ValueError:
+            pass
+
+    def release(self, model: str, service_s: Optional[float] = None):
+        queue = self._queue(model)
+        if service_s is not None:
+            queue.served += 1
+            queue.avg_service_s += SERVICE_TIME_EWMA_ALPHA * (service_s - queue.avg_service_s)
+
+        # Передаём слот самому приоритетному живому ожидающему
+        while queue.waiters:
+            _, _, fut = heapq.heappop(queue.waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        queue.active = max(0, queue.active - 1)
+
+    def stats(self) -> dict:
+        return {
+            model: {
+                "limit": queue.limit,
+                "active": queue.active,
+                "queued": queue.pending(),
+                "queued_by_priority": {
+                    name: sum(1 for p, _, fut in queue.waiters if p == level and not fut.done())
+                    for level, name in PRIORITY_NAMES.items()
+                },
+                "max_queue": self.max_queue,
+                "avg_service_s": round(queue.avg_service_s, 2),
+                "served": queue.served,
+                "rejected": queue.rejected,
+            }
+            for model, queue in self._queues.items()
+        }
+
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,123 @@
+# llm/services/single_flight.py
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("nutrition-llm")
+
+class _StreamFlight:
+    """Одна upstream-генерация, чанки которой раздаются всем подписчикам"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def pump(self, stream: AsyncIterator[str]):
+        try:
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except BaseException as e:
+            self.error = e
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            self.finished = True
+            self._notify()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        # Поздний подписчик сначала получает уже сгенерированные чанки
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+class SingleFlight:
+    """
+    Склейка одинаковых запросов в полёте: конкурентные вызовы с одним ключом
+    делят одну upstream-генерацию (и обычную, и потоковую).
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self.leaders_total = 0
+        self.coalesced_total = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[dict]]) -> dict:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._forget_call(key, t))
+            self.leaders_total += 1
+        else:
+            self.coalesced_total += 1
+            logger.info(f"🔗 Запрос присоединён к уже выполняющейся генерации ({self._waiters[key] + 1} ожидающих)")
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+                # Все ожидающие ушли — генерация больше никому не нужна
+                if self._waiters[key] == 0 and not task.done():
+                    task.cancel()
+
+    def _forget_call(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._waiters[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Single-flight задача завершилась ошибкой: {task.exception()}")
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight()
+            flight.task = asyncio.create_task(flight.pump(factory()))
+            flight.task.add_done_callback(lambda t: self._forget_stream(key, flight))
+            self._streams[key] = flight
+            self.leaders_total += 1
+        else:
+            self.coalesced_total += 1
+            logger.info(f"🔗 Стрим присоединён к уже выполняющейся генерации ({flight.subscribers + 1} подписчиков)")
+
+        flight.subscribers += 1
+        try:
+            async for chunk in flight.subscribe():
+                yield chunk
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.finished:
+                flight.task.cancel()
+
+    def _forget_stream(self, key: str, flight: _StreamFlight):
+        if self._streams.get(key) is flight:
+            del self._streams[key]
+
+    def stats(self) -> dict:
+        return {
+            "inflight_calls": len(self._calls),
+            "inflight_streams": len(self._streams),
+            "waiters": sum(self._waiters.values()) + sum(f.subscribers for f in self._streams.values()),
+            "leaders_total": self.leaders_total,
+            "coalesced_total": self.coalesced_total,
+        }
@@ -0,0 +1,234 @@
+# llm/services/tracing.py
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Dict, List, Optional, Tuple
+import aiohttp
+from config import TRACE_EXPORT, TRACE_OTLP_ENDPOINT, TRACE_SERVICE_NAME, TRACE_FLUSH_INTERVAL, TRACE_MAX_QUEUE
+
+logger = logging.getLogger("nutrition-llm")
+trace_logger = logging.getLogger("nutrition-trace")
+
+# Пробы и scrape не трейсим — они только зашумляют лог
+_UNTRACED_PATHS = {"/", "/health", "/ready", "/metrics"}
+
+# W3C Trace Context: 00-<trace_id>-<parent_span_id>-<flags>
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+class Span:
+    """Отрезок времени одного этапа запроса; trace_id общий для всего пути от апдейта Telegram до Ollama"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "_started", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self._started = time.perf_counter()
+        self.error = ""
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error: BaseException):
+        self.error = repr(error)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def end(self):
+        self.end_ns = self.start_ns + int((time.perf_counter() - self._started) * 1e9)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": TRACE_SERVICE_NAME,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round(self.duration_ms, 2),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def current_trace_id() -> str:
+    span = _current_span.get()
+    return span.trace_id if span is not None else "-"
+
+def start_span(name: str, traceparent: Optional[str] = None, **attributes) -> Tuple[Span, Token]:
+    """Начало отрезка: дочерний к текущему или к traceparent из другого сервиса"""
+    parent = _current_span.get()
+    match = _TRACEPARENT_RE.match(traceparent or "")
+    if match:
+        trace_id, parent_id = match.group(1), match.group(2)
+    elif parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+
+    current = Span(name, trace_id, parent_id, attributes)
+    return current, _current_span.set(current)
+
+def finish_span(current: Span, token: Token, error: Optional[BaseException] = None):
+    if error is not None and not isinstance(error, GeneratorExit):
+        current.fail(error)
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Асинхронный генератор закрыли из другого контекста — восстанавливать нечего
+        pass
+    current.end()
+    exporter.export(current)
+
+@contextmanager
+def span(name: str, traceparent: Optional[str] = None, **attributes):
+    """Отрезок на время блока; исключение помечает его ошибкой"""
+    current, token = start_span(name, traceparent, **attributes)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        finish_span(current, token, error)
+
+def traceparent() -> Optional[str]:
+    span = _current_span.get()
+    return f"00-{span.trace_id}-{span.span_id}-01" if span is not None else None
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет trace_id текущего запроса в каждую запись лога"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id()
+        return True
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_span(span: Span) -> dict:
+    data = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        data["parentSpanId"] = span.parent_id
+    return data
+
+class SpanExporter:
+    """
+    Экспорт отрезков: "log" — JSON-строка в лог nutrition-trace, "otlp" — пачками
+    в локальный коллектор по OTLP/HTTP JSON, "off" — никуда. Запрос не ждёт экспорта.
+    """
+
+    def __init__(self, mode: str = TRACE_EXPORT, endpoint: str = TRACE_OTLP_ENDPOINT):
+        self.mode = mode
+        self.endpoint = endpoint
+        self._queue: List[Span] = []
+        self._task: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.dropped = 0
+
+    def export(self, span: Span):
+        if self.mode == "log":
+            trace_logger.info(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+        elif self.mode == "otlp":
+            if len(self._queue) >= TRACE_MAX_QUEUE:
+                self.dropped += 1
+                return
+            self._queue.append(span)
+
+    def start(self):
+        if self.mode == "otlp" and self._task is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🛰️ Трейсы отправляются в {self.endpoint}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(TRACE_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        if not self._queue or self._session is None:
+            return
+        batch, self._queue = self._queue, []
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "nutrition"}, "spans": [_otlp_span(span) for span in batch]}],
+        }]}
+        try:
+            async with self._session.post(self.endpoint, json=payload) as resp:
+                if resp.status >= 300:
+                    logger.warning(f"⚠️ Коллектор трейсов ответил {resp.status}: {await resp.text()}")
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning(f"⚠️ Не удалось отправить {len(batch)} отрезков трейса: {e}")
+
+exporter = SpanExporter()
+
+class TracingMiddleware:
+    """
+    ASGI-обёртка: серверный отрезок на весь HTTP-запрос, включая стриминг тела ответа.
+    Родитель берётся из traceparent, X-Request-ID возвращается клиенту.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in _UNTRACED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        with span(f"{scope['method']} {scope['path']}", traceparent=headers.get("traceparent")) as server_span:
+            request_id = headers.get("x-request-id") or server_span.trace_id
+            server_span.set(request_id=request_id)
+
+            async def send_with_request_id(message):
+                if message["type"] == "http.response.start":
+                    server_span.set(status_code=message["status"])
+                    message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+                await send(message)
+
+            await self.app(scope, receive, send_with_request_id)
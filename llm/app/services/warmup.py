@@ -0,0 +1,119 @@
+# llm/services/warmup.py
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+from .ollama_service import OllamaService
+from config import STARTUP_READY_TIMEOUT, STARTUP_BACKOFF_MAX, OLLAMA_PULL_MISSING
+
+logger = logging.getLogger("nutrition-llm")
+
+def _installed(model: str, installed: List[str]) -> bool:
+    # Ollama показывает "llama3" как "llama3:latest"
+    return model in installed or f"{model}:latest" in installed
+
+class ModelWarmup:
+    """
+    Готовность сервиса: ждём, пока Ollama начнёт отвечать (backoff до дедлайна),
+    докачиваем отсутствующие модели и параллельно загружаем их в память.
+    До окончания прогрева /ready отдаёт 503.
+    """
+
+    def __init__(self, services: Iterable[OllamaService]):
+        # Одна модель — один прогрев, даже если её используют несколько агентов
+        self.services: Dict[str, OllamaService] = {}
+        for service in services:
+            self.services.setdefault(service.model, service)
+        self.state = "starting"   # starting -> waiting_ollama -> warming -> ready | failed
+        self.error = ""
+        self.models: Dict[str, dict] = {model: {"status": "pending"} for model in self.services}
+        self.started_at = time.monotonic()
+        self.ready_after: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self):
+        deadline = time.monotonic() + STARTUP_READY_TIMEOUT
+        try:
+            self.state = "waiting_ollama"
+            installed = await self._wait_for_ollama(deadline)
+
+            self.state = "warming"
+            results = await asyncio.gather(
+                *(self._warm_model(service, installed) for service in self.services.values()),
+                return_exceptions=True
+            )
+            failed = [model for model, result in zip(self.services, results) if isinstance(result, Exception)]
+            if failed:
+                raise RuntimeError(f"не удалось прогреть модели: {', '.join(failed)}")
+
+            self.state = "ready"
+            self.ready_after = time.monotonic() - self.started_at
+            logger.info(f"✅ Сервис готов за {self.ready_after:.1f} с, модели: {', '.join(self.services)}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"❌ Прогрев не завершён: {e}")
+
+    async def _wait_for_ollama(self, deadline: float) -> List[str]:
+        service = next(iter(self.services.values()))
+        delay = 0.5
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                installed = await service.list_models()
+                logger.info(f"🟢 Ollama отвечает (попытка {attempt}), установлено моделей: {len(installed)}")
+                return installed
+            except Exception as e:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Ollama не ответила за {STARTUP_READY_TIMEOUT:.0f} с: {e}")
+                logger.info(f"⏳ Ollama ещё не готова (попытка {attempt}): {e}")
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, STARTUP_BACKOFF_MAX)
+
+    async def _warm_model(self, service: OllamaService, installed: List[str]):
+        status = self.models[service.model]
+        started = time.monotonic()
+        try:
+            if not _installed(service.model, installed):
+                if not OLLAMA_PULL_MISSING:
+                    raise RuntimeError(f"модель {service.model} не установлена")
+                status["status"] = "pulling"
+                await service.pull_model()
+            status["status"] = "loading"
+            await service.preload()
+            status["status"] = "ready"
+            logger.info(f"🔥 Модель {service.model} загружена в память")
+        except Exception as e:
+            status["status"] = "failed"
+            status["error"] = str(e)
+            logger.error(f"❌ Модель {service.model}: {e}")
+            raise
+        finally:
+            status["duration_s"] = round(time.monotonic() - started, 2)
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "state": self.state,
+            "error": self.error,
+            "ready_after_s": round(self.ready_after, 2) if self.ready_after is not None else None,
+            "models": self.models,
+        }
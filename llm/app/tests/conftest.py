@@ -0,0 +1,8 @@
+# llm/app/tests/conftest.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config импортирует агентов в конце — грузим его первым, как main.py
+import config  # noqa: E402,F401
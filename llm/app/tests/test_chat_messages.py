@@ -0,0 +1,42 @@
+# llm/app/tests/test_chat_messages.py
+from config import SYSTEM_PROMPT
+from services.chat_messages import flat_messages, session_messages
+
+def _roles(messages):
+    return [m["role"] for m in messages]
+
+def test_plain_prompt_is_single_user_message():
+    messages = session_messages("Сколько белка в яйце?")
+    assert messages == [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": "Сколько белка в яйце?"},
+    ]
+
+def test_turns_become_alternating_messages():
+    prompt = "User profile:\n- Age: 30\n\nUser: привет\nAI: здравствуйте\nUser: что съесть?"
+    messages = session_messages(prompt, context="ctx")
+    assert _roles(messages) == ["system", "system", "system", "user", "assistant", "user"]
+    assert messages[1]["content"] == "Контекст: ctx"
+    assert messages[2]["content"] == "User profile:\n- Age: 30"
+    assert messages[-1]["content"] == "что съесть?"
+
+def test_consecutive_same_role_turns_are_merged():
+    messages = session_messages("User: раз\nUser: два\nAI: ок\nAssistant: ещё\nUser: три")
+    assert _roles(messages) == ["system", "user", "assistant", "user"]
+    assert messages[1]["content"] == "раз\nдва"
+    assert messages[2]["content"] == "ок\nещё"
+
+def test_trailing_assistant_turn_does_not_repeat_prompt():
+    prompt = "User: привет\nAI: здравствуйте"
+    messages = session_messages(prompt)
+    assert _roles(messages) == ["system", "user", "assistant"]
+    assert all(m["content"] != prompt for m in messages)
+
+def test_preamble_without_turns_is_the_question():
+    prompt = "User profile:\n- Goal: похудеть"
+    messages = session_messages(prompt)
+    assert messages[1:] == [{"role": "user", "content": prompt}]
+
+def test_flat_messages_keep_legacy_shape():
+    messages = flat_messages("вопрос", "история")
+    assert messages[1] == {"role": "user", "content": "Контекст: история\n\nВопрос: вопрос"}
@@ -0,0 +1,21 @@
+# llm/app/tests/test_deadline.py
+import time
+import pytest
+from config import REQUEST_DEADLINE_DEFAULT, REQUEST_DEADLINE_MAX
+from services.deadline import deadline_from_header
+
+def _budget(value):
+    return deadline_from_header(value) - time.monotonic()
+
+def test_header_sets_budget():
+    assert _budget(f"{time.time() + 30:.3f}") == pytest.approx(30, abs=0.5)
+
+@pytest.mark.parametrize("value", [None, "", "soon", "nan", "NaN", "inf", "-inf", "1e400"])
+def test_missing_or_non_finite_header_uses_default(value):
+    assert _budget(value) == pytest.approx(REQUEST_DEADLINE_DEFAULT, abs=0.5)
+
+def test_past_deadline_is_already_expired():
+    assert 0 >= _budget(f"{time.time() - 100:.3f}") > -0.5
+
+def test_far_deadline_is_capped():
+    assert _budget(f"{time.time() + 10 ** 9:.3f}") == pytest.approx(REQUEST_DEADLINE_MAX, abs=0.5)
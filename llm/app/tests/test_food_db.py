@@ -0,0 +1,40 @@
+# llm/app/tests/test_food_db.py
+import pytest
+from agents.food_db import FoodIndex, analyze_meal, parse_meal, stem, get_food_index
+
+@pytest.fixture(scope="module")
+def index() -> FoodIndex:
+    return get_food_index()
+
+def test_stem_drops_case_endings():
+    assert stem("гречки") == stem("гречка") == "гречк"
+    assert stem("грудкой") == "грудк"
+    assert stem("рис") == "рис"
+
+def test_parse_meal_quantities_and_units():
+    items = parse_meal("съел 200 г гречки, 1.5 кг курицы и 2 банана")
+    assert items == [("гречки", 200.0, "г"), ("курицы", 1.5, "кг"), ("банана", 2.0, "")]
+
+def test_parse_meal_keeps_fat_percentage_in_name():
+    assert parse_meal("200 мл молока 2.5%") == [("молока 2.5%", 200.0, "мл")]
+
+def test_lookup_exact_stem_and_fuzzy(index):
+    assert index.names[index.lookup("банан")[0]] == "банан"
+    food_id, score = index.lookup("гречки")
+    assert index.names[food_id].startswith("гречка") and score == 0.9
+    assert index.lookup("абракадабра") is None
+
+def test_grams_by_unit(index):
+    assert index.match("гречка вареная", 1, "кг").grams == 1000
+    assert index.match("банан", 2, "").grams == 240  # 2 штуки по 120 г
+    assert index.match("банан").grams == 120
+
+def test_analyze_meal_reports_unknown_items_with_quantity(index):
+    matched, unknown = analyze_meal(index, "200 г гречки вареной и 100 г абракадабры")
+    assert [m.name for m in matched] == ["гречка вареная"]
+    assert round(matched[0].kcal) == 220
+    assert unknown == ["абракадабры"]
+
+def test_small_index_prefix_search():
+    index = FoodIndex([("сыр твердый", 350, 25, 27, 0, 0), ("сырники", 220, 15, 10, 20, 0)])
+    assert [index.names[i] for i in index.prefix("сыр")] == ["сыр твердый", "сырники"]
@@ -0,0 +1,36 @@
+# llm/app/tests/test_kbju.py
+from agents.kbju import calculate_kbju, detect_activity, profile_from_text
+
+PROFILE = "User profile:\n- Gender: м\n- Age: 30 years\n- Weight: 80 kg\n- Goal: похудеть\n\n"
+
+def test_harris_benedict_male_moderate():
+    kbju = calculate_kbju("м", 30, 80, 180, "maintain", "moderate")
+    assert kbju["bmr"] == 1854
+    assert kbju["calories"] == 2873
+    assert (kbju["protein_g"], kbju["fat_g"], kbju["carbs_g"]) == (160, 96, 359)
+
+def test_goal_adjusts_calories():
+    base = calculate_kbju("ж", 25, 60)["calories"]
+    assert calculate_kbju("ж", 25, 60, goal="Похудеть")["calories"] == base - 500
+    assert calculate_kbju("ж", 25, 60, goal="Набрать массу")["calories"] == base + 500
+
+def test_unknown_activity_falls_back_to_moderate():
+    assert calculate_kbju("м", 30, 80, activity="couch")["activity"] == "moderate"
+
+def test_profile_from_text_reads_profile_block():
+    profile = profile_from_text(PROFILE + "User: сколько калорий мне нужно")
+    assert profile == {
+        "gender": "м", "age": 30.0, "weight": 80.0, "height": 170, "goal": "похудеть", "activity": "moderate",
+    }
+
+def test_activity_ignores_history_and_assistant_turns():
+    text = (
+        PROFILE
+        + "User: я много работаю\nAI: тренируйтесь ежедневно, тяжелые веса\n"
+        + "User: сколько калорий мне нужно"
+    )
+    assert detect_activity(text) == "moderate"
+
+def test_activity_from_current_message_or_explicit_field():
+    assert detect_activity(PROFILE + "AI: офис\nUser: тренируюсь каждый день") == "high"
+    assert detect_activity("Activity: light\nUser: тренируюсь каждый день") == "light"
@@ -0,0 +1,29 @@
+# llm/app/tests/test_nutrition_agent.py
+import pytest
+from agents.nutrition import NutritionAgent
+
+@pytest.fixture(scope="module")
+def agent() -> NutritionAgent:
+    return NutritionAgent(None, None)
+
+@pytest.mark.parametrize("query", [
+    "съел 200 г гречки",
+    "200 г гречки и банан",
+    "2 банана",
+    "User profile:\n- Weight: 80 kg\n\nUser: 150 г куриной грудки",
+])
+def test_meal_queries(agent, query):
+    assert agent._is_meal_query(query)
+
+@pytest.mark.parametrize("query", [
+    "Сколько калорий мне нужно при весе 80 кг?",
+    "у меня 80 кг, рост 180",
+    "составь план питания на 2000 ккал",
+])
+def test_weight_is_not_a_meal(agent, query):
+    assert not agent._is_meal_query(query)
+
+def test_calorie_needs_take_kbju_fast_path(agent):
+    query = "User profile:\n- Gender: м\n- Age: 30 years\n- Weight: 80 kg\n\nUser: Сколько калорий мне нужно при весе 80 кг?"
+    assert agent._is_needs_query(query)
+    assert agent.fast_answer(query).startswith("Твоя суточная норма")
@@ -0,0 +1,105 @@
+# llm/app/tests/test_orchestrator.py
+import asyncio
+import pytest
+from services.llm_orchestrator import LLMOrchestrator
+from services.response_cache import ResponseCache
+from services.scheduler import SchedulerOverloaded
+
+class FakeService:
+    def __init__(self, name, answer=None, overloaded=False):
+        self.model = f"{name}-model"
+        self.answer = answer
+        self.overloaded = overloaded
+        self.calls = 0
+
+    def _format_error(self, error):
+        return {"error": error}
+
+    async def ask(self, prompt, context=""):
+        self.calls += 1
+        if self.overloaded:
+            raise SchedulerOverloaded(self.model, retry_after=7)
+        return {"answer": self.answer, "model": self.model}
+
+    async def ask_stream(self, prompt, context=""):
+        self.calls += 1
+        if self.overloaded:
+            raise SchedulerOverloaded(self.model, retry_after=7)
+        for word in self.answer.split():
+            yield word
+
+def _orchestrator(**services):
+    orchestrator = LLMOrchestrator()
+    orchestrator.services = services
+
+    async def available(name):
+        return True
+
+    orchestrator.health.is_available = available
+    orchestrator.health.record_success = lambda name: None
+    orchestrator.health.record_failure = lambda name, error: None
+    orchestrator.current_provider = "ollama"
+    orchestrator.pinned_provider = "ollama"
+    return orchestrator
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+def test_overloaded_provider_fails_over_without_breaker_verdict():
+    orchestrator = _orchestrator(ollama=FakeService("ollama", overloaded=True), openai=FakeService("openai", "ok"))
+    result = asyncio.run(orchestrator._ask_provider("q"))
+    assert result == {"answer": "ok", "model": "openai-model"}
+    assert orchestrator.breakers["ollama"].samples == 0
+    assert orchestrator.breakers["openai"].samples == 1
+
+def test_all_providers_overloaded_raises_with_retry_after():
+    orchestrator = _orchestrator(ollama=FakeService("ollama", overloaded=True),
+                                 openai=FakeService("openai", overloaded=True))
+    with pytest.raises(SchedulerOverloaded) as exc:
+        asyncio.run(orchestrator._ask_provider("q"))
+    assert exc.value.retry_after == 7
+    assert orchestrator.services["openai"].calls == 1
+
+def test_stream_fails_over_from_overloaded_provider():
+    orchestrator = _orchestrator(ollama=FakeService("ollama", overloaded=True), openai=FakeService("openai", "a b"))
+    assert asyncio.run(_collect(orchestrator._ask_stream_provider("q"))) == ["a", "b"]
+    assert orchestrator.breakers["ollama"].samples == 0
+
+def test_stream_raises_when_every_provider_is_overloaded():
+    orchestrator = _orchestrator(ollama=FakeService("ollama", overloaded=True),
+                                 openai=FakeService("openai", overloaded=True))
+    with pytest.raises(SchedulerOverloaded):
+        asyncio.run(_collect(orchestrator._ask_stream_provider("q")))
+
+def test_routes_rank_by_time_to_first_token_and_put_unmeasured_last():
+    orchestrator = _orchestrator(ollama=FakeService("ollama", "ok"), openai=FakeService("openai", "ok"))
+    orchestrator.pinned_provider = None
+    orchestrator.breakers["ollama"].record_success(4000)
+    assert asyncio.run(orchestrator._route()) == ["ollama", "openai"]
+    orchestrator.breakers["openai"].record_success(800)
+    assert asyncio.run(orchestrator._route()) == ["openai", "ollama"]
+
+def test_sync_call_records_latency_without_generation_time():
+    assert LLMOrchestrator._sync_ttft_ms({"usage": {"eval_ms": 7000.0}}, 9000.0) == 2000.0
+    assert LLMOrchestrator._sync_ttft_ms({"usage": {"completion_tokens": 10}}, 9000.0) is None
+
+def _failed_over_orchestrator():
+    orchestrator = _orchestrator(ollama=FakeService("ollama", overloaded=True), openai=FakeService("openai", "ok"))
+    orchestrator.cache = ResponseCache(enabled=True)
+    return orchestrator
+
+def test_fallback_answer_is_cached_under_the_serving_model():
+    orchestrator = _failed_over_orchestrator()
+    asyncio.run(orchestrator.ask("q"))
+    primary_key = orchestrator._cache_key("q", "", "simple", "ollama-model")
+    served_key = orchestrator._cache_key("q", "", "simple", "openai-model")
+    assert asyncio.run(orchestrator.cache.get(primary_key)) is None
+    assert asyncio.run(orchestrator.cache.get(served_key))["answer"] == "ok"
+
+def test_fallback_stream_is_cached_under_the_serving_model():
+    orchestrator = _failed_over_orchestrator()
+    orchestrator.services["openai"].answer = "a b"
+    assert asyncio.run(_collect(orchestrator.ask_stream("q"))) == ["a", "b"]
+    assert asyncio.run(orchestrator.cache.get(orchestrator._cache_key("q", "", "simple", "ollama-model"))) is None
+    cached = asyncio.run(orchestrator.cache.get(orchestrator._cache_key("q", "", "simple", "openai-model")))
+    assert (cached["answer"], cached["provider"], cached["model"]) == ("ab", "openai", "openai-model")
@@ -0,0 +1,63 @@
+# llm/app/tests/test_plan_cache.py
+import asyncio
+import json
+import agents.plan_cache as plan_cache
+from agents.plan_cache import PlanSkeletonCache, goal_tokens, _similarity
+
+STEPS = ["Рацион", "Тренировки", "Контроль"]
+
+def test_goal_tokens_use_stems_of_current_message_only():
+    tokens = goal_tokens("User: прошлый вопрос\nAI: ответ\nUser: Составь мне план похудения на 3 дня")
+    assert tokens == goal_tokens("план похудения 3 дня")
+    assert "составь" not in tokens and "прошл" not in tokens
+
+def test_similarity_requires_equal_numbers():
+    assert _similarity(goal_tokens("план питания на 3 дня"), goal_tokens("план питания на 5 дней")) == 0.0
+    assert _similarity(goal_tokens("план питания на 3 дня"), goal_tokens("план питания 3 дня")) == 1.0
+
+def test_similar_goal_hits_and_different_goal_misses(tmp_path):
+    cache = PlanSkeletonCache(path=str(tmp_path / "plans.json"), enabled=True)
+
+    async def run():
+        cache.put("Составь план похудения для офисного работника", STEPS)
+        await cache._save_task
+
+    asyncio.run(run())
+    assert cache.get("план похудения для офисного работника, пожалуйста") == STEPS
+    assert cache.get("план набора массы") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = PlanSkeletonCache(path=str(tmp_path / "plans.json"), enabled=True)
+    cache._entries[goal_tokens("план похудения")] = (0.0, STEPS)
+    assert cache.get("план похудения") is None
+    assert cache.stats()["entries"] == 0
+
+def test_put_saves_in_background_and_reloads(tmp_path):
+    path = tmp_path / "nested" / "plans.json"
+    cache = PlanSkeletonCache(path=str(path), enabled=True)
+
+    async def run():
+        cache.put("план похудения", STEPS)
+        cache.put("план набора массы", STEPS[:2])
+        assert not path.exists()
+        await cache._save_task
+
+    asyncio.run(run())
+    assert len(json.loads(path.read_text(encoding="utf-8"))) == 2
+    reloaded = PlanSkeletonCache(path=str(path), enabled=True)
+    reloaded.load()
+    assert reloaded.get("план набора массы") == STEPS[:2]
+
+def test_entry_limit_evicts_oldest(tmp_path, monkeypatch):
+    monkeypatch.setattr(plan_cache, "PLAN_CACHE_MAX_ENTRIES", 1)
+    cache = PlanSkeletonCache(path=str(tmp_path / "plans.json"), enabled=True)
+
+    async def run():
+        cache.put("план похудения", STEPS)
+        cache.put("план набора массы", STEPS)
+        await cache._save_task
+
+    asyncio.run(run())
+    assert cache.get("план похудения") is None
+    assert cache.get("план набора массы") == STEPS
@@ -0,0 +1,38 @@
+# llm/app/tests/test_router.py
+from config import AGENT_CLASSES
+from agents.router import IntentRouter
+
+class _Food:
+    _NAME = "food"
+    _KEYWORDS = ["есть", "есть после", "калор"]
+
+class _Gym:
+    _NAME = "gym"
+    _KEYWORDS = ["зал", "программ", "тренир"]
+
+class _Simple:
+    _NAME = "simple"
+    _KEYWORDS = ["почему"]
+
+def test_first_registered_agent_with_any_match_wins_over_higher_score():
+    router = IntentRouter([_Food, _Gym, _Simple])
+    assert router.classify("программа тренировок в зал и калории") == ("food", {"food": 1, "gym": 3})
+
+def test_fallback_keywords_do_not_override_specialised_agents():
+    router = IntentRouter([_Food, _Gym, _Simple])
+    assert router.classify("почему нельзя есть ночью")[0] == "food"
+    assert router.classify("почему небо синее") == ("simple", {"simple": 1})
+
+def test_no_match_falls_back():
+    router = IntentRouter([_Food, _Gym], fallback="simple")
+    assert router.classify("привет") == ("simple", {})
+    assert IntentRouter([]).classify("что угодно") == ("simple", {})
+
+def test_registered_agents_keep_baseline_routing():
+    router = IntentRouter(AGENT_CLASSES)
+    assert router.classify("Составь план питания на неделю")[0] == "nutrition"
+    assert router.classify("почему нельзя есть на ночь, какие причины")[0] == "nutrition"
+    assert router.classify("Сколько калорий и белка в твороге?")[0] == "nutrition"
+    assert router.classify("Составь программу тренировок в зал")[0] == "planning"
+    assert router.classify("Почему нельзя пить кофе? Научные причины")[0] == "simple"
+    assert router.classify("Как дела?")[0] == "simple"
@@ -0,0 +1,109 @@
+# llm/app/tests/test_scheduler.py
+import asyncio
+import pytest
+from services.scheduler import (
+    LLMScheduler, SchedulerOverloaded,
+    PRIORITY_INTERACTIVE, PRIORITY_STANDARD, PRIORITY_BACKGROUND,
+)
+
+MODEL = "test-model"
+
+def test_free_slots_are_granted_immediately():
+    async def run():
+        scheduler = LLMScheduler(default_limit=2, max_queue=4, queue_timeout=1)
+        await scheduler.acquire(MODEL, PRIORITY_STANDARD)
+        await scheduler.acquire(MODEL, PRIORITY_STANDARD)
+        stats = scheduler.stats()[MODEL]
+        assert (stats["active"], stats["queued"]) == (2, 0)
+    asyncio.run(run())
+
+def test_released_slot_goes_to_most_important_waiter():
+    async def run():
+        scheduler = LLMScheduler(default_limit=1, max_queue=4, queue_timeout=1)
+        await scheduler.acquire(MODEL)
+        order = []
+
+        async def wait(priority):
+            await scheduler.acquire(MODEL, priority)
+            order.append(priority)
+            scheduler.release(MODEL)
+
+        tasks = [asyncio.create_task(wait(p)) for p in (PRIORITY_BACKGROUND, PRIORITY_STANDARD, PRIORITY_INTERACTIVE)]
+        await asyncio.sleep(0)
+        assert scheduler.stats()[MODEL]["queued"] == 3
+        scheduler.release(MODEL)
+        await asyncio.gather(*tasks)
+        assert order == [PRIORITY_INTERACTIVE, PRIORITY_STANDARD, PRIORITY_BACKGROUND]
+        assert scheduler.stats()[MODEL]["active"] == 0
+    asyncio.run(run())
+
+def test_full_queue_preempts_less_important_waiter():
+    async def run():
+        scheduler = LLMScheduler(default_limit=1, max_queue=1, queue_timeout=1)
+        await scheduler.acquire(MODEL)
+        background = asyncio.create_task(scheduler.acquire(MODEL, PRIORITY_BACKGROUND))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(scheduler.acquire(MODEL, PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerOverloaded) as exc:
+            await background
+        assert exc.value.reason == "preempted" and exc.value.retry_after >= 1
+
+        scheduler.release(MODEL)
+        await interactive
+        assert scheduler.stats()[MODEL]["rejected"] == 1
+    asyncio.run(run())
+
+def test_full_queue_rejects_equal_or_lower_priority():
+    async def run():
+        scheduler = LLMScheduler(default_limit=1, max_queue=1, queue_timeout=1)
+        await scheduler.acquire(MODEL)
+        waiter = asyncio.create_task(scheduler.acquire(MODEL, PRIORITY_STANDARD))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerOverloaded) as exc:
+            await scheduler.acquire(MODEL, PRIORITY_BACKGROUND)
+        assert exc.value.status_code == 429
+        scheduler.release(MODEL)
+        await waiter
+    asyncio.run(run())
+
+def test_queue_timeout_is_reported_as_503():
+    async def run():
+        scheduler = LLMScheduler(default_limit=1, max_queue=2, queue_timeout=0.01)
+        await scheduler.acquire(MODEL)
+        with pytest.raises(SchedulerOverloaded) as exc:
+            await scheduler.acquire(MODEL)
+        assert (exc.value.status_code, exc.value.reason) == (503, "queue timeout")
+        assert scheduler.stats()[MODEL]["queued"] == 0
+    asyncio.run(run())
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def run():
+        scheduler = LLMScheduler(default_limit=1, max_queue=2, queue_timeout=1)
+        await scheduler.acquire(MODEL)
+        waiter = asyncio.create_task(scheduler.acquire(MODEL))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        scheduler.release(MODEL)
+        assert scheduler.stats()[MODEL]["active"] == 0
+    asyncio.run(run())
+
+def test_slot_granted_at_timeout_is_kept(monkeypatch):
+    async def run():
+        scheduler = LLMScheduler(default_limit=1, max_queue=2, queue_timeout=1)
+        await scheduler.acquire(MODEL)
+
+        async def grant_then_time_out(fut, timeout):
+            # Слот передан в той же итерации, в которой сработал таймаут
+            scheduler.release(MODEL)
+            raise asyncio.TimeoutError
+
+        monkeypatch.setattr(asyncio, "wait_for", grant_then_time_out)
+        await scheduler.acquire(MODEL)
+        assert scheduler.stats()[MODEL]["active"] == 1
+        scheduler.release(MODEL)
+        assert scheduler.stats()[MODEL]["active"] == 0
+        assert scheduler.stats()[MODEL]["rejected"] == 0
+    asyncio.run(run())
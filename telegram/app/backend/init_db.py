@@ -1,7 +1,15 @@
+from sqlalchemy import text
 from backend.models import metadata
 from backend.db import engine
 
 # создаем все таблицы
 metadata.create_all(bind=engine)
 
+# create_all не добавляет индексы в уже существующие таблицы
+with engine.begin() as conn:
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_user_memory_chat_user_topic_id "
+        "ON user_memory (chat_id, user_id, topic, id)"
+    ))
+
 print("Таблицы созданы!")
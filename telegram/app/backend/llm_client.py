@@ -0,0 +1,94 @@
+# backend/llm_client.py
+import httpx
+import logging
+import os
+import time
+from typing import Optional
+from backend.tracing import trace_headers
+
+try:
+    import h2  # noqa: F401  HTTP/2 для httpx
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+LLM_URL = os.getenv("LLM_URL")
+INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
+# Сколько пользователь ждёт ответа; LLM-сервис получает дедлайн и не работает дольше
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "120"))
+# Запас сверх дедлайна, чтобы дождаться быстрого ответа, который сервис отдаёт на дедлайне
+LLM_DEADLINE_GRACE = float(os.getenv("LLM_DEADLINE_GRACE", "5"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_SUMMARY_TIMEOUT = float(os.getenv("LLM_SUMMARY_TIMEOUT", "60"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Потолок ожидания ответа по каждому эндпоинту LLM-сервиса; внутри него — остаток до дедлайна
+ENDPOINT_TIMEOUTS = {
+    "/ask": LLM_REQUEST_TIMEOUT,
+    "/summarize": LLM_SUMMARY_TIMEOUT,
+}
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+
+async def open_llm_client():
+    """Пул соединений к LLM-сервису на всё время жизни бота: keep-alive вместо нового TCP на каждый запрос"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        return
+    http2 = LLM_HTTP2 and _HTTP2_AVAILABLE
+    if LLM_HTTP2 and not _HTTP2_AVAILABLE:
+        logger.warning("LLM_HTTP2 включен, но пакет h2 не установлен — используем HTTP/1.1")
+    _client = httpx.AsyncClient(
+        base_url=LLM_URL,
+        headers={"X-API-Key": INTERNAL_API_KEY, "Content-Type": "application/json"},
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_SIZE,
+            max_keepalive_connections=LLM_POOL_SIZE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+    logger.info(f"Открыт пул соединений к LLM-сервису {LLM_URL} (HTTP/{'2' if http2 else '1.1'})")
+
+async def close_llm_client():
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("Закрыт пул соединений к LLM-сервису")
+    _client = None
+
+async def get_llm_client() -> httpx.AsyncClient:
+    # Клиент открывается на старте приложения; здесь — на случай вызова вне FastAPI
+    if _client is None or _client.is_closed:
+        await open_llm_client()
+    return _client
+
+def make_deadline() -> float:
+    """Дедлайн ответа пользователю (unix-время), общий для всех вызовов LLM по одному сообщению"""
+    return time.time() + LLM_REQUEST_TIMEOUT
+
+def llm_headers(deadline: float) -> dict:
+    """Заголовки конкретного запроса: дедлайн и контекст трейса текущего отрезка"""
+    return {
+        "X-Request-Deadline": f"{deadline:.3f}",
+        **trace_headers(),
+    }
+
+def remaining_timeout(deadline: float, limit: Optional[float] = None) -> float:
+    """Таймаут HTTP-вызова: остаток до дедлайна (не больше limit) плюс запас на ответ сервиса"""
+    left = max(deadline - time.time(), 0.0)
+    if limit is not None:
+        left = min(left, limit)
+    return left + LLM_DEADLINE_GRACE
+
+def endpoint_timeout(path: str, deadline: float) -> httpx.Timeout:
+    """Таймаут запроса к эндпоинту: соединение — быстро, ответ — в пределах потолка эндпоинта и дедлайна"""
+    return httpx.Timeout(
+        remaining_timeout(deadline, limit=ENDPOINT_TIMEOUTS.get(path)),
+        connect=LLM_CONNECT_TIMEOUT,
+    )
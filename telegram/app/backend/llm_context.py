@@ -0,0 +1,290 @@
+# backend/llm_context.py
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+from redis.exceptions import RedisError, WatchError
+import redis.asyncio as redis
+from backend.db import database
+from backend.models import user_memory, conversation_summaries
+from backend.llm_memory import make_key, summarize_turns
+from backend.tracing import span
+
+REDIS_URL = os.getenv("REDIS_URL")
+# Сколько последних реплик каждой темы Redis держит всегда, даже уже свёрнутых в резюме
+CONTEXT_TURNS = int(os.getenv("CONTEXT_TURNS", "5"))
+# Более старые реплики остаются в списке, пока их не покроет резюме; потолок — на случай долгого сбоя /summarize
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", "50"))
+# Контекст неактивного пользователя уходит из Redis; следующий запрос поднимет его из Postgres
+CONTEXT_TTL = int(os.getenv("CONTEXT_TTL", str(7 * 24 * 3600)))
+# Последние реплики темы остаются дословными, более старые сворачиваются в резюме пачками
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "3"))
+SUMMARY_MIN_BATCH = int(os.getenv("SUMMARY_MIN_BATCH", "3"))
+SUMMARY_MAX_BATCH = int(os.getenv("SUMMARY_MAX_BATCH", "20"))
+
+logger = logging.getLogger(__name__)
+redis = redis.Redis.from_url(REDIS_URL)
+
+# Ссылки на фоновые задачи, чтобы их не собрал GC; ключи, резюме по которым уже обновляется
+_tasks: Set[asyncio.Task] = set()
+_refreshing: Set[Tuple[str, str, str]] = set()
+
+# Ключи контекста пользователя в Redis:
+#   ready           — контекст загружен из Postgres, списки полные
+#   topics          — SET тем, по которым есть реплики
+#   turns:{topic}   — LIST реплик темы (JSON): последние CONTEXT_TURNS и все ещё не свёрнутые в резюме
+#   summaries       — HASH тема -> {"summary", "last_memory_id"}
+def _context_key(chat_id: int, user_id: int, part: str) -> str:
+    return f"ctx:{chat_id}:{user_id}:{part}"
+
+def _turn(memory_id: int, user_message: str, ai_response: str, topic: Optional[str]) -> dict:
+    return {"id": memory_id, "user": user_message, "ai": ai_response, "topic": topic}
+
+async def load_context(chat_id: int, user_id: int) -> Tuple[List[Dict], Dict[str, str]]:
+    """
+    Контекст для /ask: ещё не свёрнутые реплики по всем темам и резюме тем.
+    Читается из Redis за два обращения и всегда включает последнюю реплику; Postgres — только при холодном старте.
+    """
+    with span("context.load") as context_span:
+        try:
+            turns_by_topic, summaries = await _read_context(chat_id, user_id)
+            context_span.set(cache="hit" if turns_by_topic is not None else "miss")
+            if turns_by_topic is None:
+                turns_by_topic, summaries = await _backfill_context(chat_id, user_id)
+        except RedisError as e:
+            logger.warning(f"Redis недоступен для контекста, читаем из Postgres: {e}")
+            context_span.set(cache="error")
+            turns_by_topic, summaries = await _fetch_context(chat_id, user_id)
+
+        history = _unfolded_history(turns_by_topic, summaries)
+        context_span.set(turns=len(history), summaries=len(summaries))
+        return history, {topic: data["summary"] for topic, data in summaries.items()}
+
+def _unfolded_history(turns_by_topic: Dict[str, List[Dict]], summaries: Dict[str, Dict]) -> List[Dict]:
+    # Реплики, уже свёрнутые в резюме своей темы, второй раз не отправляем
+    return [
+        {"user": turn["user"], "ai": turn["ai"], "topic": turn["topic"]}
+        for turns in turns_by_topic.values()
+        for turn in turns
+        if turn["id"] > summaries.get(turn["topic"], {}).get("last_memory_id", 0)
+    ]
+
+async def _read_context(chat_id: int, user_id: int):
+    """(реплики по темам, резюме) из Redis; (None, None), если контекст ещё не загружен"""
+    ready, topics = await redis.pipeline(transaction=False) \
+        .exists(_context_key(chat_id, user_id, "ready")) \
+        .smembers(_context_key(chat_id, user_id, "topics")) \
+        .execute()
+    if not ready:
+        return None, None
+
+    topics = sorted(topic.decode() for topic in topics)
+    pipe = redis.pipeline(transaction=False)
+    for topic in topics:
+        pipe.lrange(_context_key(chat_id, user_id, f"turns:{topic}"), 0, -1)
+    pipe.hgetall(_context_key(chat_id, user_id, "summaries"))
+    *lists, raw_summaries = await pipe.execute()
+    if not all(lists):
+        # Тема есть в topics, а её список истёк или потерян — контекст неполный, поднимаем заново
+        logger.info(f"Контекст {user_id} в Redis неполный, перечитываем из Postgres")
+        return None, None
+
+    turns_by_topic = {topic: [json.loads(item) for item in items] for topic, items in zip(topics, lists)}
+    summaries = {topic.decode(): json.loads(data) for topic, data in raw_summaries.items()}
+    return turns_by_topic, summaries
+
+async def _fetch_context(chat_id: int, user_id: int) -> Tuple[Dict[str, List[Dict]], Dict[str, Dict]]:
+    """Реплики каждой темы (последние CONTEXT_TURNS и не свёрнутые) и резюме тем из Postgres"""
+    key = make_key(chat_id, user_id)
+    summary_query = conversation_summaries.select().where(
+        (conversation_summaries.c.chat_id == key["chat_id"]) &
+        (conversation_summaries.c.user_id == key["user_id"])
+    )
+    ranked = select(
+        user_memory,
+        func.row_number().over(partition_by=user_memory.c.topic, order_by=user_memory.c.id.desc()).label("rank")
+    ).where(
+        (user_memory.c.chat_id == key["chat_id"]) &
+        (user_memory.c.user_id == key["user_id"])
+    ).subquery()
+    history_query = select(ranked).where(ranked.c.rank <= CONTEXT_MAX_TURNS).order_by(ranked.c.id.asc())
+    with span("context.db"):
+        summary_rows = await database.fetch_all(summary_query)
+        rows = await database.fetch_all(history_query)
+
+    summaries = {
+        r["topic"]: {"summary": r["summary"], "last_memory_id": r["last_memory_id"]}
+        for r in summary_rows
+    }
+    turns_by_topic: Dict[str, List[Dict]] = {}
+    for r in rows:
+        folded = r["id"] <= summaries.get(r["topic"], {}).get("last_memory_id", 0)
+        if folded and r["rank"] > CONTEXT_TURNS:
+            continue
+        turns_by_topic.setdefault(r["topic"] or "-", []).append(
+            _turn(r["id"], r["user_message"], r["ai_response"], r["topic"])
+        )
+    return turns_by_topic, summaries
+
+async def _backfill_context(chat_id: int, user_id: int):
+    turns_by_topic, summaries = await _fetch_context(chat_id, user_id)
+
+    pipe = redis.pipeline(transaction=True)
+    for topic, turns in turns_by_topic.items():
+        list_key = _context_key(chat_id, user_id, f"turns:{topic}")
+        pipe.delete(list_key)
+        pipe.rpush(list_key, *(json.dumps(turn, ensure_ascii=False) for turn in turns))
+        pipe.expire(list_key, CONTEXT_TTL)
+    if turns_by_topic:
+        pipe.sadd(_context_key(chat_id, user_id, "topics"), *turns_by_topic)
+        pipe.expire(_context_key(chat_id, user_id, "topics"), CONTEXT_TTL)
+    if summaries:
+        pipe.hset(_context_key(chat_id, user_id, "summaries"),
+                  mapping={topic: json.dumps(data, ensure_ascii=False) for topic, data in summaries.items()})
+        pipe.expire(_context_key(chat_id, user_id, "summaries"), CONTEXT_TTL)
+    pipe.set(_context_key(chat_id, user_id, "ready"), 1, ex=CONTEXT_TTL)
+    await pipe.execute()
+
+    logger.info(f"Контекст {user_id} загружен из Postgres: {sum(map(len, turns_by_topic.values()))} реплик")
+    return turns_by_topic, summaries
+
+async def record_turn(chat_id: int, user_id: int, memory_id: int, user_message: str, ai_response: str, topic: str):
+    """
+    Реплика уже в Postgres: дописываем её в список темы и в фоне обновляем резюме темы.
+    Из списка реплики уходят, когда их покрыло резюме (или по потолку CONTEXT_MAX_TURNS).
+    """
+    try:
+        ready, topics = await redis.pipeline(transaction=False) \
+            .exists(_context_key(chat_id, user_id, "ready")) \
+            .smembers(_context_key(chat_id, user_id, "topics")) \
+            .execute()
+        if ready:
+            list_key = _context_key(chat_id, user_id, f"turns:{topic}")
+            turn = _turn(memory_id, user_message, ai_response, topic)
+            pipe = redis.pipeline(transaction=True) \
+                .rpush(list_key, json.dumps(turn, ensure_ascii=False)) \
+                .ltrim(list_key, -CONTEXT_MAX_TURNS, -1) \
+                .sadd(_context_key(chat_id, user_id, "topics"), topic)
+            # Все ключи контекста живут одинаково: списки других тем не истекают раньше ready и topics
+            for key in {list_key, *(_context_key(chat_id, user_id, f"turns:{t.decode()}") for t in topics)}:
+                pipe.expire(key, CONTEXT_TTL)
+            await pipe \
+                .expire(_context_key(chat_id, user_id, "topics"), CONTEXT_TTL) \
+                .expire(_context_key(chat_id, user_id, "summaries"), CONTEXT_TTL) \
+                .expire(_context_key(chat_id, user_id, "ready"), CONTEXT_TTL) \
+                .execute()
+        # Без ready контекста в Redis нет: следующее чтение поднимет его из Postgres вместе с этой репликой
+    except RedisError as e:
+        # Список мог не получить реплику — сбрасываем, чтобы не отдавать устаревший контекст
+        logger.warning(f"Не удалось дописать реплику в Redis: {e}")
+        await _drop_context(chat_id, user_id)
+
+    schedule_summary_refresh(chat_id, user_id, topic)
+
+async def _drop_context(chat_id: int, user_id: int):
+    try:
+        await redis.delete(_context_key(chat_id, user_id, "ready"))
+    except RedisError:
+        pass
+
+def schedule_summary_refresh(chat_id: int, user_id: int, topic: str):
+    """Обновить резюме темы после сохранения реплики — в фоне, ответ пользователю его не ждёт"""
+    task = asyncio.create_task(refresh_summary(chat_id, user_id, topic))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+async def refresh_summary(chat_id: int, user_id: int, topic: str):
+    key = make_key(chat_id, user_id)
+    running_key = (key["chat_id"], key["user_id"], topic)
+    if running_key in _refreshing:
+        # Уже сворачивается; новые реплики попадут в следующий проход
+        return
+    _refreshing.add(running_key)
+    try:
+        with span("summary.refresh", topic=topic) as refresh_span:
+            folded = await _fold_turns(chat_id, user_id, topic)
+            refresh_span.set(folded=folded)
+    except Exception as e:
+        # Реплики остаются в списке темы и уйдут в следующую свёртку
+        logger.exception(f"Не удалось обновить резюме ({topic}) для {user_id}: {e}")
+    finally:
+        _refreshing.discard(running_key)
+
+async def _fold_turns(chat_id: int, user_id: int, topic: str) -> int:
+    """Сворачивает накопившиеся старые реплики темы в резюме; возвращает, сколько свернуто"""
+    key = make_key(chat_id, user_id)
+    row = await database.fetch_one(conversation_summaries.select().where(
+        (conversation_summaries.c.chat_id == key["chat_id"]) &
+        (conversation_summaries.c.user_id == key["user_id"]) &
+        (conversation_summaries.c.topic == topic)
+    ))
+    summary = row["summary"] if row else ""
+    last_id = row["last_memory_id"] if row else 0
+
+    rows = await database.fetch_all(
+        user_memory.select()
+        .where((user_memory.c.chat_id == key["chat_id"]) &
+               (user_memory.c.user_id == key["user_id"]) &
+               (user_memory.c.topic == topic) &
+               (user_memory.c.id > last_id))
+        .order_by(user_memory.c.id.asc())
+        .limit(SUMMARY_MAX_BATCH + SUMMARY_KEEP_RECENT)
+    )
+    fold = rows[:len(rows) - SUMMARY_KEEP_RECENT] if SUMMARY_KEEP_RECENT > 0 else rows
+    if len(fold) < SUMMARY_MIN_BATCH:
+        return 0
+
+    turns = [{"user": r["user_message"], "ai": r["ai_response"]} for r in fold]
+    new_summary = await summarize_turns(topic, summary, turns)
+    new_last_id = fold[-1]["id"]
+
+    # Параллельный экземпляр мог свернуть дальше — более старое резюме не перезаписывает новое
+    query = insert(conversation_summaries).values(
+        chat_id=key["chat_id"],
+        user_id=key["user_id"],
+        topic=topic,
+        summary=new_summary,
+        last_memory_id=new_last_id
+    )
+    query = query.on_conflict_do_update(
+        index_elements=["chat_id", "user_id", "topic"],
+        set_={"summary": new_summary, "last_memory_id": new_last_id, "updated_at": func.now()},
+        where=conversation_summaries.c.last_memory_id < new_last_id
+    )
+    await database.execute(query)
+
+    # Резюме в Redis обновляем только если контекст там есть; иначе его поднимет следующее чтение
+    summary_data = json.dumps({"summary": new_summary, "last_memory_id": new_last_id}, ensure_ascii=False)
+    try:
+        if await redis.exists(_context_key(chat_id, user_id, "ready")):
+            await redis.hset(_context_key(chat_id, user_id, "summaries"), topic, summary_data)
+            await _trim_folded(chat_id, user_id, topic, new_last_id)
+    except RedisError as e:
+        logger.warning(f"Не удалось обновить резюме в Redis: {e}")
+        await _drop_context(chat_id, user_id)
+
+    logger.info(f"Резюме темы {topic} обновлено: +{len(fold)} реплик")
+    return len(fold)
+
+async def _trim_folded(chat_id: int, user_id: int, topic: str, last_memory_id: int):
+    """Убирает из списка темы реплики, покрытые резюме, оставляя последние CONTEXT_TURNS"""
+    list_key = _context_key(chat_id, user_id, f"turns:{topic}")
+    async with redis.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(list_key)
+            items = await pipe.lrange(list_key, 0, -1)
+            ids = [json.loads(item)["id"] for item in items]
+            folded = next((i for i, memory_id in enumerate(ids) if memory_id > last_memory_id), len(ids))
+            drop = min(folded, max(len(ids) - CONTEXT_TURNS, 0))
+            if not drop:
+                return
+            pipe.multi()
+            pipe.ltrim(list_key, drop, -1)
+            await pipe.execute()
+        except WatchError:
+            # Список изменился параллельно — обрежем при следующей свёртке
+            pass
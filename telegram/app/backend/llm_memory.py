@@ -1,23 +1,26 @@
 # backend/llm_memory.py
-import httpx
 import logging
-from typing import AsyncIterator
+import time
+from typing import AsyncIterator, Dict, List, Optional
 from backend.db import database
 from backend.models import user_memory
-from backend.llm_profile import get_profile
-from config.errors import get_random_error_phrase
-import os
+from backend.llm_client import get_llm_client, make_deadline, llm_headers, endpoint_timeout, LLM_SUMMARY_TIMEOUT
+from backend.tracing import span, start_span, finish_span
 import json
 
-LLM_URL = os.getenv("LLM_URL")
-INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
-
 logger = logging.getLogger(__name__)
 
+class LLMOverloaded(Exception):
+    """LLM-сервис не принял запрос в очередь; retry_after — через сколько секунд повторить"""
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
 def make_key(chat_id: int, user_id: int) -> dict:
     return {"chat_id": str(chat_id), "user_id": str(user_id)}
 
-async def add_to_memory(chat_id: int, user_id: int, user_message: str, ai_response: str, topic: str):
+async def add_to_memory(chat_id: int, user_id: int, user_message: str, ai_response: str, topic: str) -> int:
+    """Сохраняет реплику в Postgres и возвращает её id"""
     key = make_key(chat_id, user_id)
     ins = user_memory.insert().values(
         chat_id=key["chat_id"],
@@ -25,45 +28,95 @@ async def add_to_memory(chat_id: int, user_id: int, user_message: str, ai_respon
         user_message=user_message,
         ai_response=ai_response,
         topic=topic
-    )
-    await database.execute(ins)
+    ).returning(user_memory.c.id)
+    with span("memory.save", topic=topic):
+        return await database.execute(ins)
 
-async def ask_llm(prompt: str, topic: str) -> str:
-    headers = {"X-API-Key": INTERNAL_API_KEY, "Content-Type": "application/json"}
-    
-    async with httpx.AsyncClient(timeout=300) as client:
-        resp = await client.post(
-            f"{LLM_URL}/ask",
-            json={"prompt": prompt, "agent_type": topic},
-            headers=headers
-        )
-        resp.raise_for_status()
-        data = resp.json()
-    
-    ai_text = data.get("answer", "")
+async def summarize_turns(topic: str, summary: str, turns: List[Dict]) -> str:
+    """Новое резюме темы: прошлое резюме плюс свёрнутые реплики. Вызывается в фоне, не на пути ответа"""
+    deadline = time.time() + LLM_SUMMARY_TIMEOUT
+    client = await get_llm_client()
     
-    if data.get("status") == "error":
-        ai_text = get_random_error_phrase()
-    
-    return ai_text
+    resp = await client.post(
+        "/summarize",
+        json={"topic": topic, "summary": summary, "turns": turns},
+        headers=llm_headers(deadline),
+        timeout=endpoint_timeout("/summarize", deadline)
+    )
+    resp.raise_for_status()
+    return resp.json()["summary"]
+
+# Поля профиля, которые уходят в LLM-сервис; какие из них попадут в промпт, решает агент
+PROFILE_FIELDS = ("gender", "age", "weight", "goal", "diet")
+
+def profile_payload(profile: Optional[dict]) -> dict:
+    return {field: profile[field] for field in PROFILE_FIELDS if profile and profile.get(field) is not None}
+
+async def ask_llm_routed_stream(message: str, profile: Optional[dict], history: List[Dict],
+                                deadline: Optional[float] = None,
+                                summaries: Optional[Dict[str, str]] = None) -> AsyncIterator[dict]:
+    """
+    Один запрос вместо /detect_type + /ask: сервис сам выбирает агента и собирает промпт.
+    Первый кадр — {"agent_type": ..., "agent_name": ...}, дальше {"chunk": ...}.
+    """
+    body = {
+        "message": message,
+        "profile": profile_payload(profile),
+        "history": history,
+        "summaries": summaries or {},
+        "agent_type": "auto",
+        "stream": True,
+    }
+    async for frame in _stream_frames(body, "auto", deadline):
+        yield frame
 
-async def ask_llm_stream(prompt: str, topic: str) -> AsyncIterator[str]:
-    headers = {"X-API-Key": INTERNAL_API_KEY, "Content-Type": "application/json"}
+async def _stream_frames(body: dict, topic: str, deadline: Optional[float]) -> AsyncIterator[dict]:
+    deadline = deadline or make_deadline()
     
-    async with httpx.AsyncClient(timeout=300) as client:
+    # Генератор: отрезок закрывается вручную, когда стрим дочитан или брошен
+    ask_span, token = start_span("llm.ask", topic=topic, stream=True)
+    started = time.monotonic()
+    chunks = 0
+    error = None
+    try:
+        client = await get_llm_client()
         async with client.stream(
             "POST",
-            f"{LLM_URL}/ask",
-            json={"prompt": prompt, "agent_type": topic, "stream": True},
-            headers=headers
+            "/ask",
+            json=body,
+            headers=llm_headers(deadline),
+            timeout=endpoint_timeout("/ask", deadline)
         ) as resp:
             resp.raise_for_status()
-            async for chunk in resp.aiter_text():
-                if chunk:
-                    try:
-                        data = json.loads(chunk)
-                        if "chunk" in data:
-                            yield data["chunk"]  # Extract text from JSON
-                    except json.JSONDecodeError:
-                        logger.warning(f"Invalid JSON chunk: {chunk}")
-                        continue
\ No newline at end of file
+            # NDJSON: один JSON-кадр на строку
+            async for line in resp.aiter_lines():
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Invalid JSON chunk: {line}")
+                    continue
+                if "chunk" in data:
+                    if not chunks:
+                        ask_span.set(ttft_ms=round((time.monotonic() - started) * 1000, 1))
+                    chunks += 1
+                    yield data
+                elif data.get("done"):
+                    # Финальный кадр: success/timeout завершают стрим (при timeout отданное — частичный ответ)
+                    status = data.get("status", "")
+                    ask_span.set(status=status, agent=data.get("agent_name", ""))
+                    if status == "overloaded":
+                        raise LLMOverloaded(data.get("error") or "LLM overloaded", int(data.get("retry_after") or 0))
+                    if status == "error":
+                        raise RuntimeError(data.get("error") or "LLM stream error")
+                    return
+                elif "agent_name" in data:
+                    ask_span.set(agent=data["agent_name"])
+                    yield data
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        ask_span.set(chunks=chunks)
+        finish_span(ask_span, token, error)
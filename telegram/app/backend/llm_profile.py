@@ -1,6 +1,57 @@
+from collections import OrderedDict
+from typing import Optional
 from sqlalchemy.dialects.postgresql import insert
 from backend.models import profiles
 from backend.db import database
+from backend.tracing import span
+import redis.asyncio as redis
+import logging
+import json
+import time
+import os
+
+REDIS_URL = os.getenv("REDIS_URL")
+# Профиль меняется только анкетой: Redis держит его долго, локальный LRU — коротко,
+# чтобы другие экземпляры бота увидели новую анкету не позже PROFILE_LOCAL_TTL
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_LOCAL_TTL = float(os.getenv("PROFILE_LOCAL_TTL", "60"))
+PROFILE_REDIS_TTL = int(os.getenv("PROFILE_REDIS_TTL", "86400"))
+
+logger = logging.getLogger(__name__)
+redis = redis.Redis.from_url(REDIS_URL)
+
+# (chat_id, user_id) -> (профиль или None, момент протухания)
+_local: "OrderedDict[tuple, tuple]" = OrderedDict()
+# Счётчик сохранений анкет в процессе: чтение, во время которого была запись, не кладёт результат в LRU
+_saves = 0
+
+def _cache_key(chat_id: int, user_id: int) -> str:
+    return f"profile:{chat_id}:{user_id}"
+
+def _remember(chat_id: int, user_id: int, profile: Optional[dict]):
+    _local[(chat_id, user_id)] = (profile, time.monotonic() + PROFILE_LOCAL_TTL)
+    _local.move_to_end((chat_id, user_id))
+    while len(_local) > PROFILE_CACHE_SIZE:
+        _local.popitem(last=False)
+
+async def _write_through(chat_id: int, user_id: int, profile: dict):
+    """Новая анкета сразу во все уровни кэша: запись поверх, а не сброс с ленивым заполнением"""
+    global _saves
+    _saves += 1
+    _remember(chat_id, user_id, profile)
+    try:
+        await redis.set(_cache_key(chat_id, user_id), json.dumps(profile, ensure_ascii=False), ex=PROFILE_REDIS_TTL)
+    except Exception as e:
+        logger.warning(f"Не удалось записать профиль в Redis: {e}")
+        await invalidate_profile(chat_id, user_id, local=False)
+
+async def invalidate_profile(chat_id: int, user_id: int, local: bool = True):
+    if local:
+        _local.pop((chat_id, user_id), None)
+    try:
+        await redis.delete(_cache_key(chat_id, user_id))
+    except Exception as e:
+        logger.warning(f"Не удалось сбросить профиль в Redis: {e}")
 
 # --- Сохранение или обновление профиля ---
 async def save_profile(chat_id: int, user_id: int, data: dict):
@@ -25,12 +76,45 @@ async def save_profile(chat_id: int, user_id: int, data: dict):
             'goal': data['goal'],
             'diet': data['diet']
         }
-    )
-    await database.execute(query)
+    ).returning(*profiles.c)
+    row = await database.fetch_one(query)
+    # Синхронно, после коммита и до ответа пользователю: следующее сообщение уже видит новую анкету
+    await _write_through(chat_id, user_id, dict(row))
 
 
 # --- Получение профиля пользователя ---
 async def get_profile(chat_id: int, user_id: int):
+    """Профиль через кэш: LRU процесса, затем Redis, затем Postgres. Отсутствие профиля тоже кэшируется"""
+    cached = _local.get((chat_id, user_id))
+    if cached is not None and cached[1] > time.monotonic():
+        _local.move_to_end((chat_id, user_id))
+        return dict(cached[0]) if cached[0] else None
+    
+    saves = _saves
+    with span("profile.load") as profile_span:
+        key = _cache_key(chat_id, user_id)
+        try:
+            raw = await redis.get(key)
+        except Exception as e:
+            logger.warning(f"Redis недоступен для профиля: {e}")
+            raw = None
+        if raw is not None:
+            profile_span.set(cache="redis")
+            profile = json.loads(raw)
+        else:
+            profile_span.set(cache="miss")
+            profile = await _fetch_profile(chat_id, user_id)
+            try:
+                # NX: параллельный save_profile уже записал новую анкету — прочитанная из базы её не затирает
+                await redis.set(key, json.dumps(profile, ensure_ascii=False), ex=PROFILE_REDIS_TTL, nx=True)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить профиль в Redis: {e}")
+    
+    if saves == _saves:
+        _remember(chat_id, user_id, profile)
+    return dict(profile) if profile else None
+
+async def _fetch_profile(chat_id: int, user_id: int):
     query = profiles.select().where(
         (profiles.c.chat_id == chat_id) & (profiles.c.user_id == user_id)
     )
@@ -1,6 +1,6 @@
 # backend/models.py
 import sqlalchemy
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Index
 from sqlalchemy.sql import func
 from backend.db import database
 
@@ -25,6 +25,8 @@ user_memory = sqlalchemy.Table(
     Column("ai_response", Text, nullable=False),
     Column("created_at", DateTime, server_default=func.now()),
     Column("topic", String, nullable=True),  # new
+    # Контекст и свёртка резюме читают реплики пользователя по теме в порядке id
+    Index("ix_user_memory_chat_user_topic_id", "chat_id", "user_id", "topic", "id"),
 )
 
 profiles = sqlalchemy.Table(
@@ -37,4 +39,16 @@ profiles = sqlalchemy.Table(
     Column("weight", Float, nullable=False),
     Column("goal", String, nullable=False),
     Column("diet", String, nullable=False),
-)
\ No newline at end of file
+)
+
+# Сворачиваемое резюме старых реплик по теме; last_memory_id — последняя учтённая запись user_memory
+conversation_summaries = sqlalchemy.Table(
+    "conversation_summaries",
+    metadata,
+    Column("chat_id", String, primary_key=True),
+    Column("user_id", String, primary_key=True),
+    Column("topic", String, primary_key=True),
+    Column("summary", Text, nullable=False),
+    Column("last_memory_id", Integer, nullable=False),
+    Column("updated_at", DateTime, server_default=func.now(), onupdate=func.now()),
+)
@@ -0,0 +1,206 @@
+# backend/tracing.py
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Dict, List, Optional, Tuple
+import httpx
+
+# log — JSON-строки в лог nutrition-trace, otlp — в локальный коллектор (OTLP/HTTP JSON), off — выключен
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "log")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "nutrition-bot")
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2"))
+TRACE_MAX_QUEUE = int(os.getenv("TRACE_MAX_QUEUE", "2048"))
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("nutrition-trace")
+
+# W3C Trace Context: 00-<trace_id>-<parent_span_id>-<flags>
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+class Span:
+    """Этап обработки апдейта; trace_id уходит в LLM-сервис в заголовке traceparent"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "_started", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self._started = time.perf_counter()
+        self.error = ""
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error: BaseException):
+        self.error = repr(error)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def end(self):
+        self.end_ns = self.start_ns + int((time.perf_counter() - self._started) * 1e9)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": TRACE_SERVICE_NAME,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round(self.duration_ms, 2),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def current_trace_id() -> str:
+    span = _current_span.get()
+    return span.trace_id if span is not None else "-"
+
+def start_span(name: str, traceparent: Optional[str] = None, **attributes) -> Tuple[Span, Token]:
+    """Начало отрезка: дочерний к текущему или к traceparent из другого сервиса"""
+    parent = _current_span.get()
+    match = _TRACEPARENT_RE.match(traceparent or "")
+    if match:
+        trace_id, parent_id = match.group(1), match.group(2)
+    elif parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+
+    current = Span(name, trace_id, parent_id, attributes)
+    return current, _current_span.set(current)
+
+def finish_span(current: Span, token: Token, error: Optional[BaseException] = None):
+    if error is not None and not isinstance(error, GeneratorExit):
+        current.fail(error)
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Асинхронный генератор закрыли из другого контекста — восстанавливать нечего
+        pass
+    current.end()
+    exporter.export(current)
+
+@contextmanager
+def span(name: str, traceparent: Optional[str] = None, **attributes):
+    """Отрезок на время блока; исключение помечает его ошибкой"""
+    current, token = start_span(name, traceparent, **attributes)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        finish_span(current, token, error)
+
+def trace_headers() -> Dict[str, str]:
+    """traceparent и X-Request-ID для исходящего запроса: LLM-сервис продолжит тот же трейс"""
+    span = _current_span.get()
+    if span is None:
+        return {}
+    return {"traceparent": f"00-{span.trace_id}-{span.span_id}-01", "X-Request-ID": span.trace_id}
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_span(span: Span) -> dict:
+    data = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        data["parentSpanId"] = span.parent_id
+    return data
+
+class SpanExporter:
+    """
+    Экспорт отрезков: "log" — JSON-строка в лог nutrition-trace, "otlp" — пачками
+    в локальный коллектор по OTLP/HTTP JSON, "off" — никуда. Запрос не ждёт экспорта.
+    """
+
+    def __init__(self, mode: str = TRACE_EXPORT, endpoint: str = TRACE_OTLP_ENDPOINT):
+        self.mode = mode
+        self.endpoint = endpoint
+        self._queue: List[Span] = []
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self.dropped = 0
+
+    def export(self, span: Span):
+        if self.mode == "log":
+            trace_logger.info(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+        elif self.mode == "otlp":
+            if len(self._queue) >= TRACE_MAX_QUEUE:
+                self.dropped += 1
+                return
+            self._queue.append(span)
+
+    def start(self):
+        if self.mode == "otlp" and self._task is None:
+            self._client = httpx.AsyncClient(timeout=5)
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Трейсы отправляются в {self.endpoint}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(TRACE_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        if not self._queue or self._client is None:
+            return
+        batch, self._queue = self._queue, []
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "nutrition"}, "spans": [_otlp_span(span) for span in batch]}],
+        }]}
+        try:
+            resp = await self._client.post(self.endpoint, json=payload)
+            if resp.status_code >= 300:
+                logger.warning(f"Коллектор трейсов ответил {resp.status_code}: {resp.text}")
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning(f"Не удалось отправить {len(batch)} отрезков трейса: {e}")
+
+exporter = SpanExporter()
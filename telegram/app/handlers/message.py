@@ -1,30 +1,22 @@
 # handlers/message.py
 from aiogram import Router, types, F, Bot
-from typing import Tuple
+from typing import Optional
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ChatAction
-from backend.llm_memory import ask_llm, ask_llm_stream, add_to_memory, make_key
+from backend.llm_memory import ask_llm_routed_stream, add_to_memory, LLMOverloaded
+from backend.llm_context import load_context, record_turn
+from backend.llm_client import make_deadline
 from backend.llm_profile import get_profile
 from handlers.profile import start_profile_flow
 from config.thinking import get_random_phrase
 from config.errors import get_random_error_phrase
-from backend.models import user_memory
-from backend.db import database
-import redis.asyncio as redis
+from backend.tracing import start_span, finish_span
 import logging
 import asyncio
 import time
-import os
-import json
-import httpx
-
-LLM_URL = os.getenv("LLM_URL")
-INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
-REDIS_URL = os.getenv("REDIS_URL")
 
 message_router = Router()
 logger = logging.getLogger(__name__)
-redis = redis.Redis.from_url(REDIS_URL)
 
 @message_router.message(~F.text.startswith("/"))
 async def handle_message(msg: types.Message, state: FSMContext):
@@ -47,7 +39,8 @@ async def handle_message(msg: types.Message, state: FSMContext):
                 bot=msg.bot,
                 chat_id=chat_id,
                 user_id=user_id,
-                user_input=user_input
+                user_input=user_input,
+                profile=profile
             )
         )
         
@@ -58,19 +51,31 @@ async def handle_message(msg: types.Message, state: FSMContext):
         await msg.answer(error_text)
         logger.exception(e)
 
-async def process_llm_background(bot: Bot, chat_id: int, user_id: int, user_input: str):
+async def process_llm_background(bot: Bot, chat_id: int, user_id: int, user_input: str, profile: Optional[dict] = None):
     stop_event = asyncio.Event()
     typing_task = asyncio.create_task(keep_typing(bot, chat_id, stop_event))
     
+    # Один дедлайн на всё сообщение: и маршрутизация, и генерация укладываются в него
+    deadline = make_deadline()
+    # Продолжение трейса апдейта: вебхук уже ответил, ответ пользователю собирается в фоне
+    reply_span, token = start_span("telegram.reply", chat_id=chat_id, user_id=user_id)
     try:
-        prompt, topic = await build_prompt_and_topic(chat_id, user_id, user_input)
+        # Профиль уже загружен в handle_message; повторно читаем только при вызове без него
+        if profile is None:
+            profile = await get_profile(chat_id, user_id)
+        history, summaries = await load_context(chat_id, user_id)
+        topic = "simple"
         stream_msg = await bot.send_message(chat_id=chat_id, text="...")
         current_text = ""
         buffer = ""
         start_time = time.time()
         
-        async for chunk in ask_llm_stream(prompt, topic):
-            buffer += chunk
+        # Тему выбирает LLM-сервис и присылает первым кадром, до текста ответа
+        async for frame in ask_llm_routed_stream(user_input, profile, history, deadline, summaries):
+            if "chunk" not in frame:
+                topic = frame.get("agent_name") or topic
+                continue
+            buffer += frame["chunk"]
             if len(buffer) > 50 or (time.time() - start_time > 5):
                 current_text += buffer
                 await bot.edit_message_text(chat_id=chat_id, message_id=stream_msg.message_id, text=current_text)
@@ -85,16 +90,38 @@ async def process_llm_background(bot: Bot, chat_id: int, user_id: int, user_inpu
         stop_event.set()
         await typing_task
         
-        await add_to_memory(chat_id, user_id, user_input, current_text, topic)
+        reply_span.set(topic=topic, answer_chars=len(current_text))
+        if not current_text:
+            # Ничего не сгенерировано (например, дедлайн) — пустую реплику в память и контекст не пишем
+            await bot.edit_message_text(chat_id=chat_id, message_id=stream_msg.message_id,
+                                        text=f"❌ {get_random_error_phrase()}")
+            logger.warning(f"LLM не вернул ответ пользователю {user_id}")
+            return
+        
+        memory_id = await add_to_memory(chat_id, user_id, user_input, current_text, topic)
+        await record_turn(chat_id, user_id, memory_id, user_input, current_text, topic)
         
         logger.info(f"Ответ LLM отправлен пользователю {user_id}")
         
+    except LLMOverloaded as e:
+        reply_span.fail(e)
+        stop_event.set()
+        await typing_task
+        retry_after = max(e.retry_after, 1)
+        await bot.send_message(
+            chat_id=chat_id,
+            text=f"⏳ Сейчас много запросов, я не успеваю ответить. Попробуйте ещё раз через {retry_after} с."
+        )
+        logger.warning(f"LLM-сервис перегружен, ответ пользователю {user_id} не сгенерирован: {e}")
     except Exception as e:
+        reply_span.fail(e)
         stop_event.set()
         await typing_task
         error_text = get_random_error_phrase()
         await bot.send_message(chat_id=chat_id, text=f"❌ {error_text}")
         logger.exception(f"Ошибка в фоновой задаче LLM: {e}")
+    finally:
+        finish_span(reply_span, token)
         
 async def keep_typing(bot, chat_id, stop_event: asyncio.Event):
     """Поддерживает статус 'typing' пока stop_event не установлен"""
@@ -104,77 +131,3 @@ async def keep_typing(bot, chat_id, stop_event: asyncio.Event):
             await asyncio.sleep(5)  # Отправляем действие каждые 5 секунд
     except Exception as e:
         logger.debug(f"Индикатор набора завершен: {e}")
-        
-
-async def build_prompt_and_topic(chat_id: int, user_id: int, user_message: str) -> Tuple[str, str]:
-    headers = {"X-API-Key": INTERNAL_API_KEY, "Content-Type": "application/json"}
-    
-    async with httpx.AsyncClient(timeout=10) as client:
-        resp = await client.post(
-            f"{LLM_URL}/detect_type",
-            json={"query": user_message},
-            headers=headers
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        topic = data.get("type", "simple")
-    
-    profile = await get_profile(chat_id, user_id)
-    profile_info = ""
-    if profile and topic in ["nutrition", "planning"]:
-        profile_info = (
-            f"User profile:\n"
-            f"- Gender: {profile['gender']}\n"
-            f"- Age: {profile['age']} years\n"
-            f"- Weight: {profile['weight']} kg\n"
-            f"- Goal: {profile['goal']}\n"
-            f"- Diet: {profile['diet']}\n\n"
-        )
-    
-    context = await get_user_context(chat_id, user_id, topic)
-    prompt = f"{profile_info}{context}\nUser: {user_message}" if context else f"{profile_info}User: {user_message}"
-    
-    return prompt, topic
-    
-    
-async def get_user_context(chat_id: int, user_id: int, current_topic: str) -> str:
-    cache_key = f"context:{chat_id}:{user_id}:{current_topic}"
-    cached = await redis.get(cache_key)
-    if cached:
-        return cached.decode()
-    
-    key = make_key(chat_id, user_id)
-    query = (
-        user_memory.select()
-        .where((user_memory.c.chat_id == key["chat_id"]) & 
-               (user_memory.c.user_id == key["user_id"]) & 
-               (user_memory.c.topic == current_topic))
-        .order_by(user_memory.c.created_at.asc())
-        .limit(5)
-    )
-    rows = await database.fetch_all(query)
-    
-    if not rows:
-        return ""
-    
-    if len(rows) > 3:
-        old_msgs = "\n".join(f"User: {r['user_message']}\nAI: {r['ai_response']}" for r in rows[:-3])
-        summary_prompt = f"Summarize this relevant history in 50-100 words, keep key facts on {current_topic}: {old_msgs}"
-        from services.llm_orchestrator import LLMOrchestrator
-        orchestrator = LLMOrchestrator()
-        summary = (await orchestrator.ask(summary_prompt))['answer']
-        recent = "\n".join(f"User: {r['user_message']}\nAI: {r['ai_response']}" for r in rows[-3:])
-        context = f"Summary of past {current_topic}: {summary}\nRecent: {recent}"
-    else:
-        context = "\n".join(f"User: {r['user_message']}\nAI: {r['ai_response']}" for r in rows)
-    
-    context_lines = context.split('\n')
-    unique_lines = []
-    for line in context_lines:
-        if line not in unique_lines:
-            unique_lines.append(line)
-    context = '\n'.join(unique_lines)
-    
-    logger.info(f"Context size: {len(context)} chars")
-    await redis.set(cache_key, context, ex=300)
-    return context
@@ -7,11 +7,13 @@ from aiogram.types import Update
 from aiogram.fsm.storage.redis import RedisStorage
 
 from backend.db import connect, disconnect
+from backend.llm_client import open_llm_client, close_llm_client
 from handlers.photo import photo_router
 from handlers.message import message_router
 from handlers.history import history_router
 from handlers.profile import profile_router
 from middlewares.logger import LoggingMiddleware
+from backend.tracing import span, exporter as span_exporter
 
 API_TOKEN = os.getenv("TELEGRAM_TOKEN")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
@@ -46,12 +48,16 @@ dp.include_router(message_router)
 @app.on_event("startup")
 async def startup():
     await connect()
+    await open_llm_client()
+    span_exporter.start()
     await bot.set_webhook(WEBHOOK_URL, secret_token=TG_SECRET_TOKEN)
 
 @app.on_event("shutdown")
 async def shutdown():
     await bot.session.close()
+    await close_llm_client()
     await disconnect()
+    await span_exporter.stop()
 
 # --- Webhook ---
 @app.post("/webhook")
@@ -72,9 +78,12 @@ async def telegram_webhook(request: Request):
             logger.info("Игнорирую сообщение о добавлении/удалении участника")
             return {"ok": True}
 
-    try:
-        update = Update.model_validate(update_data, context={"bot": bot})
-        await dp.feed_update(bot, update)
-    except Exception as e:
-        logger.info(f"Ошибка при обработке обновления: {e}")
+    # Корень трейса: фоновые задачи ответа и запросы в LLM-сервис продолжают его
+    with span("telegram.update", update_id=update_data.get("update_id", 0)) as update_span:
+        try:
+            update = Update.model_validate(update_data, context={"bot": bot})
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            update_span.fail(e)
+            logger.info(f"Ошибка при обработке обновления: {e}")
     return {"ok": True}